@@ -1,128 +1,140 @@
 import gradio as gr
-import requests
+import httpx
+import html
+import itertools
 import json
-from typing import Generator
 import time
+from typing import AsyncGenerator
 
-def query_rag(message: str, history: list) -> Generator[tuple, None, None]:
+RAG_API_URL = "http://localhost:8992"
+STREAM_FRAME_INTERVAL = 0.05  # 流式输出每50ms合并刷新一次界面，避免逐token推送整段对话历史
+MAX_SOURCE_TABS = 20  # 静态样式表中预生成的溯源标签切换规则数
+
+# 复用连接池的异步客户端，所有会话共享Gradio的事件循环
+_http_client = None
+_source_group_ids = itertools.count()
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            base_url=RAG_API_URL,
+            timeout=httpx.Timeout(connect=5.0, read=120.0, write=10.0, pool=10.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _http_client
+
+
+# 解析/rag/stream返回的SSE事件流，逐个产出(event, data)
+async def iter_sse_events(response: httpx.Response):
+    event, data_lines = "message", []
+    async for line in response.aiter_lines():
+        if line:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data_lines.append(value)
+            continue
+        if data_lines:
+            yield event, json.loads("\n".join(data_lines))
+        event, data_lines = "message", []
+
+
+# 溯源信息HTML：只包含紧凑的结构和转义后的内容，显示切换全部由静态样式表控制
+def render_sources(sources: list) -> str:
+    if not sources:
+        return ""
+
+    group = f"src-{next(_source_group_ids)}"
+    radios, tags, contents = [], [], []
+    for idx, source in enumerate(sources[:MAX_SOURCE_TABS]):
+        metadata = source.get("metadata", {})
+        file_name = html.escape(str(metadata.get("file_name", "未知文件")))
+        source_location = html.escape(str(metadata.get("source_location", "未知位置")))
+        page_content = html.escape(source.get("page_content", ""))
+        checked = " checked" if idx == 0 else ""
+        radios.append(f'<input type="radio" name="{group}" id="{group}-{idx}" class="source-radio"{checked}>')
+        tags.append(f'<label for="{group}-{idx}" class="source-tag">[{idx + 1}]</label>')
+        contents.append(
+            f'<div class="source-content"><div class="source-meta"><strong>📄 {file_name}</strong> · '
+            f'{source_location}</div><div class="source-text">{page_content}</div></div>'
+        )
+
+    return (
+        f'<div class="sources-wrapper">{"".join(radios)}<div class="sources-container">'
+        f'<div class="sources-header">📚 参考来源</div>'
+        f'<div class="sources-tags-wrapper">{"".join(tags)}</div>'
+        f'<div class="source-display-area">{"".join(contents)}</div></div></div>'
+    )
+
+
+async def query_rag(message: str, history: list) -> AsyncGenerator[tuple, None]:
     """
-    调用RAG接口并流式返回结果
+    调用RAG流式接口，按帧间隔合并token后刷新界面
     """
-    url = "http://localhost:8992/rag/query"
     payload = {"query": message}
-    
+
     # 添加用户消息
     new_history = history + [{"role": "user", "content": message}]
-    
+
     # 显示加载骨架屏
     loading_message = "⏳ 正在思考中..."
     yield new_history + [{"role": "assistant", "content": loading_message}], ""
-    
+
+    chunks, answer, sources_html = [], "", ""
     try:
-        response = requests.post(url, json=payload, timeout=30)
-        response.raise_for_status()
-        
-        result = response.json()
-        
-        # 获取模型回答
-        answer = result.get("response", "抱歉，没有获取到回答。")
-        
-        # 流式输出效果
-        assistant_message = ""
-        for char in answer:
-            assistant_message += char
-            yield new_history + [{"role": "assistant", "content": assistant_message}], ""
-            time.sleep(0.01)
-        
-        # 构建溯源信息HTML（使用radio按钮 + 正确的HTML结构）
-        sources = result.get("sources", [])
-        sources_html = ""
-        if sources:
-            import random
-            unique_id = random.randint(10000, 99999)
-            
-            sources_html = f'''
-            <div class="sources-wrapper-{unique_id}">
-            '''
-            
-            # 先放置所有radio input（隐藏的）
-            for idx in range(len(sources)):
-                checked = "checked" if idx == 0 else ""
-                sources_html += f'<input type="radio" name="source-radio-{unique_id}" id="radio-{unique_id}-{idx}" class="source-radio" {checked}>'
-            
-            sources_html += f'''
-                <div class="sources-container">
-                    <div class="sources-header">📚 参考来源</div>
-                    <div class="sources-tags-wrapper">
-            '''
-            
-            # 添加标签label
-            for idx in range(len(sources)):
-                sources_html += f'<label for="radio-{unique_id}-{idx}" class="source-tag">[{idx + 1}]</label>'
-            
-            sources_html += '</div><div class="source-display-area">'
-            
-            # 添加所有内容块
-            for idx, source in enumerate(sources):
-                metadata = source.get("metadata", {})
-                page_content = source.get("page_content", "")
-                
-                file_name = metadata.get("file_name", "未知文件")
-                source_location = metadata.get("source_location", "未知位置")
-                
-                sources_html += f'''
-                <div class="source-content source-content-{idx}">
-                    <div class="source-meta">
-                        <strong>📄 {file_name}</strong> · {source_location}
-                    </div>
-                    <div class="source-text">{page_content}</div>
-                </div>
-                '''
-            
-            sources_html += '</div></div></div>'
-            
-            # 使用CSS控制显示
-            sources_html += f'''
-            <style>
-            .sources-wrapper-{unique_id} .source-radio {{
-                display: none;
-            }}
-            
-            .sources-wrapper-{unique_id} .source-content {{
-                display: none;
-            }}
-            '''
-            
-            # 为每个radio生成对应的显示规则 - 带紫色主题
-            for idx in range(len(sources)):
-                sources_html += f'''
-            .sources-wrapper-{unique_id} #radio-{unique_id}-{idx}:checked ~ .sources-container .source-content-{idx} {{
-                display: block !important;
-                animation: slideDown 0.3s ease-out;
-            }}
-            
-            .sources-wrapper-{unique_id} #radio-{unique_id}-{idx}:checked ~ .sources-container .sources-tags-wrapper label[for="radio-{unique_id}-{idx}"] {{
-                background: linear-gradient(135deg, #5b47d2 0%, #7b64e8 100%) !important;
-                color: white !important;
-                border-color: #5b47d2 !important;
-                box-shadow: 0 4px 16px rgba(91, 71, 210, 0.4) !important;
-                transform: scale(1.05) !important;
-                font-weight: 600 !important;
-            }}
-                '''
-            
-            sources_html += '''
-            </style>
-            '''
-        
+        async with get_http_client().stream("POST", "/rag/stream", json=payload) as response:
+            if response.status_code == 503:
+                yield new_history + [{"role": "assistant", "content": "⏳ 服务正在启动中，请稍后再试"}], ""
+                return
+            response.raise_for_status()
+
+            last_frame = time.monotonic()
+            async for event, data in iter_sse_events(response):
+                if event == "sources":
+                    # 溯源信息在检索完成后只渲染一次，之后的帧不再重复发送
+                    sources_html = render_sources(data)
+                    yield new_history + [{"role": "assistant", "content": loading_message}], sources_html
+                elif event == "token":
+                    chunks.append(data.get("content", ""))
+                    now = time.monotonic()
+                    if now - last_frame >= STREAM_FRAME_INTERVAL:
+                        last_frame = now
+                        answer = "".join(chunks)
+                        yield new_history + [{"role": "assistant", "content": answer}], gr.update()
+                elif event == "done":
+                    answer = data.get("response") or "".join(chunks)
+                elif event == "error":
+                    raise RuntimeError(data.get("message", "未知错误"))
+
+        answer = answer or "".join(chunks) or "抱歉，没有获取到回答。"
         yield new_history + [{"role": "assistant", "content": answer}], sources_html
-            
-    except requests.exceptions.RequestException as e:
-        error_msg = f"❌ 请求失败：{str(e)}\n\n请确保后端服务运行在 http://localhost:8992"
-        yield new_history + [{"role": "assistant", "content": error_msg}], ""
+
+    except httpx.HTTPError as e:
+        error_msg = f"❌ 请求失败：{str(e)}\n\n请确保后端服务运行在 {RAG_API_URL}"
+        yield new_history + [{"role": "assistant", "content": error_msg}], sources_html
     except Exception as e:
         error_msg = f"❌ 发生错误：{str(e)}"
-        yield new_history + [{"role": "assistant", "content": error_msg}], ""
+        yield new_history + [{"role": "assistant", "content": error_msg}], sources_html
+
+
+# 溯源标签切换规则：按位置匹配第N个radio、标签和内容块，全部页面共用一份
+def source_tab_css(max_tabs: int) -> str:
+    rules = []
+    for n in range(1, max_tabs + 1):
+        rules.append(
+            f".sources-wrapper .source-radio:nth-of-type({n}):checked ~ .sources-container "
+            f".source-content:nth-of-type({n}) {{ display: block; animation: slideDown 0.3s ease-out; }}\n"
+            f".sources-wrapper .source-radio:nth-of-type({n}):checked ~ .sources-container "
+            f".source-tag:nth-of-type({n}) {{ background: linear-gradient(135deg, #5b47d2 0%, #7b64e8 100%) !important; "
+            f"color: white !important; border-color: #5b47d2 !important; "
+            f"box-shadow: 0 4px 16px rgba(91, 71, 210, 0.4) !important; transform: scale(1.05) !important; "
+            f"font-weight: 600 !important; }}\n"
+        )
+    return "".join(rules)
 
 # 自定义CSS样式
 custom_css = """
@@ -261,7 +273,12 @@ button[variant="primary"]:active {
     min-height: 150px;
 }
 
+.sources-wrapper .source-radio {
+    display: none;
+}
+
 .source-content {
+    display: none;
     padding: 20px;
     background: var(--background-fill-primary);
     border-radius: 12px;
@@ -368,7 +385,7 @@ button[variant="primary"]:active {
     background: rgba(255, 255, 255, 0.05);
     box-shadow: 0 8px 24px rgba(0, 0, 0, 0.3), 0 2px 8px rgba(0, 0, 0, 0.2);
 }
-"""
+""" + source_tab_css(MAX_SOURCE_TABS)
 
 # 创建Gradio界面
 with gr.Blocks(
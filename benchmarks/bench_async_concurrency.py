@@ -0,0 +1,79 @@
+"""Check that overlapping /rag/query chain executions run concurrently.
+
+N requests are issued at once through ``rag_chain.ainvoke``; with a non-blocking
+path the wall time should be close to one request measured on its own, while the
+old ``rag_chain.invoke`` inside an ``async def`` serialises them. The run exits
+non-zero when the concurrent wall time exceeds ``--tolerance`` x the single-request
+latency.
+
+    python benchmarks/bench_async_concurrency.py --requests 8
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from fakes import FakeChatModel, FakeRetriever
+
+import rag_chain
+
+
+def build_chain(args):
+    rag_chain.create_chat_model = lambda: FakeChatModel(latency=args.llm_latency)
+    return rag_chain.create_rag_chain(FakeRetriever(latency=args.retrieval_latency), None)
+
+
+def query_data(i):
+    return {"query_with_instruct": f"Instruct: test\nQuery: question {i}", "original_query": f"question {i}"}
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+async def run(args):
+    chain = build_chain(args)
+    await chain.ainvoke(query_data(-1))  # 预热
+
+    single = await timed(chain.ainvoke(query_data(0)))
+
+    # 旧实现：async接口里直接调用同步invoke，事件循环被阻塞
+    async def blocking_handler(i):
+        return chain.invoke(query_data(i))
+
+    blocking_wall = await timed(asyncio.gather(*(blocking_handler(i) for i in range(args.requests))))
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(timed(chain.ainvoke(query_data(i))) for i in range(args.requests)))
+    async_wall = time.perf_counter() - start
+
+    print(f"requests:              {args.requests}")
+    print(f"single request:        {single:.3f}s")
+    print(f"blocking invoke wall:  {blocking_wall:.3f}s")
+    print(f"ainvoke wall:          {async_wall:.3f}s (slowest request {max(latencies):.3f}s)")
+    print(f"speedup:               {blocking_wall / async_wall:.2f}x")
+
+    # 与单独测得的单请求耗时比较：事件循环被阻塞时N个请求串行执行，墙钟时间约为N倍
+    limit = args.tolerance * single
+    if async_wall > limit:
+        print(f"FAIL: ainvoke wall {async_wall:.3f}s > {args.tolerance} x single request ({limit:.3f}s)")
+        return 1
+    print(f"OK: ainvoke wall {async_wall:.3f}s <= {args.tolerance} x single request ({limit:.3f}s)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--retrieval-latency", type=float, default=0.1)
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
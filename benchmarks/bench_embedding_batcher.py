@@ -0,0 +1,64 @@
+"""Compare per-call query embedding with the EmbeddingBatcher micro-batching queue.
+
+Concurrent client threads embed single queries against a fake embedding model
+whose cost is a fixed per-call overhead plus a small per-item cost.
+
+    python benchmarks/bench_embedding_batcher.py --threads 16 --queries 2000
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fakes import FakeEmbeddingLLM
+
+from embedding_batcher import EmbeddingBatcher
+
+
+def run(embed_one, threads, queries):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(embed_one, (f"Instruct: test\nQuery: question {i}" for i in range(queries))))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--call-overhead-ms", type=float, default=4.0)
+    parser.add_argument("--per-item-ms", type=float, default=0.2)
+    args = parser.parse_args()
+
+    def new_model():
+        return FakeEmbeddingLLM(call_overhead=args.call_overhead_ms / 1000, per_item=args.per_item_ms / 1000)
+
+    # 当前行为：每条query单独调用一次model.embed([text])，模型访问串行
+    model = new_model()
+    lock = threading.Lock()
+
+    def per_call(text):
+        with lock:
+            return model.embed([text])[0].outputs.embedding
+
+    per_call_time = run(per_call, args.threads, args.queries)
+
+    batched_model = new_model()
+    batcher = EmbeddingBatcher(
+        lambda texts: [o.outputs.embedding for o in batched_model.embed(texts)],
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+    )
+    batched_time = run(batcher.embed, args.threads, args.queries)
+
+    print(f"per-call:  {per_call_time:7.3f}s  {args.queries / per_call_time:8.1f} q/s  model calls={model.calls}")
+    print(f"batched:   {batched_time:7.3f}s  {args.queries / batched_time:8.1f} q/s  model calls={batched_model.calls}")
+    print(f"speedup:   {per_call_time / batched_time:.2f}x")
+    print(f"stats:     {batcher.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Recall@k and latency of dense, BM25 and hybrid (RRF) retrieval.
+
+Queries are sampled from the indexed chunks: each query is a short window of
+text taken from one chunk, and that chunk is the relevant document. By default
+the live collection, sparse index and embedding model from config are used;
+``--fake`` builds a temporary collection from the PDFs in ``--input`` with a
+deterministic fake embedding model so the script runs on a CPU-only box.
+
+    python benchmarks/bench_hybrid.py --queries 200 --k 5
+    python benchmarks/bench_hybrid.py --fake --input dataset/unupdate_data
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from fakes import SERVER_DIR  # noqa: F401  (adds server/ to sys.path)
+
+import config
+from hybrid_retriever import HybridRetriever, strip_instruct
+from sparse_index import doc_key, load_sparse_index, tokenize
+from vector_store import load_existing_vector_store
+
+TASK = "Given a search query, retrieve relevant passages that answer the query"
+
+
+def sample_queries(sparse_index, num_queries, query_words, seed):
+    rng = random.Random(seed)
+    documents = [d for d in sparse_index.iter_documents() if len(d.page_content.split()) > query_words]
+    queries = []
+    for document in rng.sample(documents, min(num_queries, len(documents))):
+        words = document.page_content.split()
+        start = rng.randrange(0, len(words) - query_words)
+        queries.append((" ".join(words[start : start + query_words]), doc_key(document.metadata)))
+    return queries
+
+
+def evaluate(name, search, queries, k):
+    latencies, hits, reciprocal_ranks = [], 0, []
+    for query, relevant in queries:
+        start = time.perf_counter()
+        documents = search(query)[:k]
+        latencies.append((time.perf_counter() - start) * 1000)
+        keys = [doc_key(document.metadata) for document in documents]
+        hits += relevant in keys
+        reciprocal_ranks.append(1 / (keys.index(relevant) + 1) if relevant in keys else 0.0)
+    latencies.sort()
+    print(
+        f"{name:8s} recall@{k}={hits / len(queries):.3f}  MRR={statistics.mean(reciprocal_ranks):.3f}  "
+        f"p50={latencies[len(latencies) // 2]:.2f}ms  p95={latencies[int(len(latencies) * 0.95) - 1]:.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-words", type=int, default=6)
+    parser.add_argument("--k", type=int, default=config.RETRIEVER_TOP_K)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fake", action="store_true", help="fake embeddings + temporary Milvus Lite/BM25 index")
+    parser.add_argument("--input", default=config.UNUPDATED_DATA_PATH, help="PDF directory for --fake")
+    args = parser.parse_args()
+
+    if args.fake:
+        import vector_manager
+        from fakes import FakeEmbeddings
+
+        workdir = Path(tempfile.mkdtemp(prefix="mrag_hybrid_"))
+        config.MILVUS_URI = str(workdir / "milvus.db")
+        for name in ("SPARSE_INDEX_DIR", "INGEST_CHECKPOINT_PATH", "INGEST_MANIFEST_PATH", "KB_VERSION_PATH", "DOC_EMBED_CACHE_DIR"):
+            setattr(config, name, str(workdir / name.lower()))
+        embedding_model = FakeEmbeddings(call_overhead=0, per_item=0)
+        vector_manager.build_offline_knowledge_base(args.input, embedding_model, workers=1)
+    else:
+        from vector_store import VLLMEmbedding
+
+        embedding_model = VLLMEmbedding(model_name=config.EMBEDDING_MODEL_PATH)
+
+    vector_store = load_existing_vector_store(embedding_model)
+    sparse_index = load_sparse_index()
+    queries = sample_queries(sparse_index, args.queries, args.query_words, args.seed)
+    if not queries:
+        raise SystemExit(
+            f"no queries: the sparse index has {len(sparse_index)} chunks and none is longer than "
+            f"--query-words={args.query_words} words (is --input empty?)"
+        )
+    print(f"{len(sparse_index)} chunks, {len(queries)} queries, {len(set(tokenize(' '.join(q for q, _ in queries))))} query terms")
+
+    dense = vector_store.as_retriever(search_kwargs={"k": config.HYBRID_FETCH_K})
+    hybrid = HybridRetriever(
+        dense_retriever=dense, sparse_index=sparse_index, k=args.k, sparse_k=config.HYBRID_FETCH_K, rrf_k=config.RRF_K
+    )
+
+    def instruct(query):
+        return embedding_model.get_detailed_instruct(TASK, query)
+
+    evaluate("dense", lambda q: dense.invoke(instruct(q)), queries, args.k)
+    evaluate("bm25", lambda q: [d for d, _ in sparse_index.search(strip_instruct(instruct(q)), args.k)], queries, args.k)
+    evaluate("hybrid", lambda q: hybrid.invoke(instruct(q)), queries, args.k)
+
+
+if __name__ == "__main__":
+    main()
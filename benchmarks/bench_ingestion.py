@@ -0,0 +1,102 @@
+"""Wall-clock benchmark of the knowledge-base build over generated PDFs.
+
+Modes:
+  legacy   - parse every file, then embed and insert one giant list (the old path)
+  serial   - build_offline_knowledge_base(workers=1): batched, single process
+  parallel - build_offline_knowledge_base(workers=N): process-pool parsing pipelined with embedding
+
+Embedding uses a fake model with a per-call and per-chunk cost; vectors go into a
+temporary Milvus Lite file, so the run needs no GPU. Each mode runs in a forked
+child process so its peak RSS can be reported separately.
+
+    python benchmarks/bench_ingestion.py --files 200 --pages 10 --workers 8
+"""
+
+import argparse
+import multiprocessing
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+from langchain_milvus import Milvus
+
+from fakes import FakeEmbeddings
+from pdfgen import generate_corpus
+
+import config
+import vector_manager
+from document_processor import UnifiedDocumentLoader
+
+
+def legacy_build(input_dir, embedding_model):
+    all_documents = []
+    document_loader = UnifiedDocumentLoader()
+    for file_path in vector_manager.list_source_files(input_dir):
+        all_documents.extend(document_loader.load_and_split_documents(str(file_path)))
+    Milvus.from_documents(
+        documents=all_documents,
+        embedding=embedding_model,
+        connection_args={"uri": config.MILVUS_URI},
+        collection_name=config.MILVUS_COLLECTION_NAME,
+        drop_old=True,
+    )
+
+
+def run_mode(mode, args, corpus, workdir, results):
+    config.MILVUS_URI = str(workdir / f"{mode}_milvus.db")  # 每种模式使用独立的Milvus Lite文件
+    # 构建过程写入的稀疏索引、清单、断点和缓存都放在临时目录，不写入生产路径
+    for name in (
+        "SPARSE_INDEX_DIR", "INGEST_CHECKPOINT_PATH", "INGEST_MANIFEST_PATH", "DOC_EMBED_CACHE_DIR", "MMAP_STORE_DIR",
+    ):
+        setattr(config, name, str(workdir / f"{mode}_{name.lower()}"))
+    embeddings = FakeEmbeddings(call_overhead=args.call_overhead_ms / 1000, per_item=args.per_chunk_ms / 1000)
+    start = time.perf_counter()
+    if mode == "legacy":
+        legacy_build(corpus, embeddings)
+    else:
+        workers = 1 if mode == "serial" else args.workers
+        vector_manager.build_offline_knowledge_base(corpus, embeddings, workers=workers)
+    elapsed = time.perf_counter() - start
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results[mode] = (elapsed, peak_rss_mb, embeddings.model.calls, embeddings.model.items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=config.INGEST_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=config.INGEST_EMBED_BATCH_SIZE)
+    parser.add_argument("--call-overhead-ms", type=float, default=5.0)
+    parser.add_argument("--per-chunk-ms", type=float, default=0.5)
+    parser.add_argument("--modes", default="legacy,serial,parallel")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="mrag_ingest_"))
+    corpus = workdir / "raw_data"
+    generate_corpus(corpus, args.files, args.pages)
+    config.KB_VERSION_PATH = str(workdir / "kb_version")
+    config.INGEST_EMBED_BATCH_SIZE = args.batch_size
+    print(f"corpus: {args.files} files x {args.pages} pages in {corpus}")
+
+    ctx = multiprocessing.get_context("fork")
+    manager = ctx.Manager()
+    results = manager.dict()
+    for mode in args.modes.split(","):
+        process = ctx.Process(target=run_mode, args=(mode, args, corpus, workdir, results))
+        process.start()
+        process.join()
+        elapsed, peak_rss_mb, calls, items = results[mode]
+        print(
+            f"{mode:9s} {elapsed:8.2f}s  {args.files / elapsed:7.1f} files/s  peak RSS {peak_rss_mb:8.1f} MB  "
+            f"embed calls={calls} chunks={items}"
+        )
+
+    if "legacy" in results:
+        for mode, (elapsed, *_rest) in results.items():
+            print(f"{mode:9s} speedup vs legacy: {results['legacy'][0] / elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
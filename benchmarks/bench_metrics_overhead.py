@@ -0,0 +1,74 @@
+"""Estimate the per-request cost of the metrics instrumentation.
+
+Times the ``stage()`` context manager and a full pass through ``MetricsMiddleware``
+around a no-op ASGI app, then relates the instrumentation cost of one request
+(middleware + ``--stages`` stage timings) to a typical request latency.
+
+    python benchmarks/bench_metrics_overhead.py --request-ms 300
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+import fakes  # noqa: F401  把server目录加入sys.path
+
+import metrics
+
+
+def time_stage(n):
+    start = time.perf_counter()
+    for _ in range(n):
+        with metrics.stage("bench"):
+            pass
+    return (time.perf_counter() - start) / n
+
+
+def time_middleware(n):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    bare_scope = {"type": "http", "path": "/bench"}
+    middleware = metrics.MetricsMiddleware(app, endpoints=["/bench"])
+
+    async def run(handler):
+        start = time.perf_counter()
+        for _ in range(n):
+            await handler(dict(bare_scope), receive, send)
+        return (time.perf_counter() - start) / n
+
+    return asyncio.run(run(middleware)) - asyncio.run(run(app))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--stages", type=int, default=12, help="instrumented stages per request")
+    parser.add_argument("--request-ms", type=float, default=300.0, help="typical end-to-end request latency")
+    args = parser.parse_args()
+
+    stage_cost = time_stage(args.iterations)
+    middleware_cost = time_middleware(args.iterations // 10)
+    per_request = middleware_cost + args.stages * stage_cost
+    overhead = per_request / (args.request_ms / 1000)
+
+    print(f"stage():            {stage_cost * 1e6:.2f} us")
+    print(f"middleware:         {middleware_cost * 1e6:.2f} us")
+    print(f"per request:        {per_request * 1e6:.2f} us ({args.stages} stages)")
+    print(f"overhead @ {args.request_ms:.0f}ms:  {overhead:.4%}")
+    if overhead >= 0.01:
+        print("FAIL: instrumentation overhead is above 1%")
+        sys.exit(1)
+    print("OK: instrumentation overhead is below 1%")
+
+
+if __name__ == "__main__":
+    main()
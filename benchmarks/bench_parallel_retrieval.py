@@ -0,0 +1,71 @@
+"""Measure the saving from running local retrieval and MCP web search in parallel.
+
+Compares the old sequential order (retriever, then web search) with
+``retrieve_and_format`` / ``aretrieve_and_format``, and checks that a web search
+slower than ``WEB_SEARCH_TIMEOUT`` is dropped at the deadline.
+
+    python benchmarks/bench_parallel_retrieval.py --retrieval-latency 0.3 --search-latency 0.8
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from fakes import FakeRetriever, FakeSearchManager
+
+import config
+import rag_chain
+
+QUERY_DATA = {"query_with_instruct": "Instruct: test\nQuery: WebArena是什么？", "original_query": "WebArena是什么？"}
+
+
+def sequential(retriever, search):
+    retriever.invoke(QUERY_DATA["query_with_instruct"])
+    search.web_search(QUERY_DATA["original_query"])
+
+
+def measure(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--retrieval-latency", type=float, default=0.3)
+    parser.add_argument("--search-latency", type=float, default=0.8)
+    parser.add_argument("--timeout", type=float, default=1.0, help="WEB_SEARCH_TIMEOUT")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    config.ENABLE_WEB_SEARCH = True
+    config.WEB_SEARCH_TIMEOUT = args.timeout
+    retriever = FakeRetriever(latency=args.retrieval_latency)
+    search = FakeSearchManager(latency=args.search_latency)
+
+    seq, _ = measure(lambda: sequential(retriever, search), args.repeat)
+    par, result = measure(lambda: rag_chain.retrieve_and_format(retriever, QUERY_DATA, search), args.repeat)
+    apar, aresult = measure(
+        lambda: asyncio.run(rag_chain.aretrieve_and_format(retriever, QUERY_DATA, search)), args.repeat
+    )
+    print(f"sequential:           {seq * 1000:8.1f} ms")
+    print(f"parallel (sync):      {par * 1000:8.1f} ms  web_search={result['metadata']['web_search']}")
+    print(f"parallel (async):     {apar * 1000:8.1f} ms  web_search={aresult['metadata']['web_search']}")
+    print(f"saving:               {(seq - par) * 1000:8.1f} ms per query")
+
+    # Web搜索慢于deadline：应在deadline附近返回，且只带本地文档
+    slow = FakeSearchManager(latency=args.timeout * 3)
+    late, result = measure(lambda: rag_chain.retrieve_and_format(retriever, QUERY_DATA, slow), 1)
+    print(
+        f"late web search:      {late * 1000:8.1f} ms  web_search={result['metadata']['web_search']}"
+        f" web_docs={result['web_docs']!r}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""PDF parsing throughput (pages/s) of the UnifiedDocumentLoader backends.
+
+Generates text PDFs of several sizes with ``pdfgen`` and parses every file with:
+  pypdfloader - langchain's PyPDFLoader, the loader used before the parser backends
+  pypdf       - UnifiedDocumentLoader(parser="pypdf"), one process
+  pypdfium2   - UnifiedDocumentLoader(parser="pypdfium2"), one process
+  pypdfium2xN - pypdfium2 with pages split across N processes (``--page-workers``);
+                only PDFs with at least ``PDF_PARALLEL_MIN_PAGES`` pages are split
+
+For each size it reports pages/s and the time until the first page is yielded by
+``lazy_load_pdf`` (the full list for pypdfloader), and checks that every backend
+extracts the same words as PyPDFLoader. Page-parallel parsing only helps with
+more than one CPU core.
+
+    python benchmarks/bench_pdf_parsing.py --sizes 10,100,1000 --files 3 --page-workers 4
+"""
+
+import argparse
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+from fakes import SERVER_DIR  # noqa: F401  (adds server/ to sys.path)
+from pdfgen import generate_corpus
+
+import config
+from document_processor import UnifiedDocumentLoader
+from langchain_community.document_loaders import PyPDFLoader
+
+
+def parse_pypdfloader(file_path):
+    start = time.perf_counter()
+    pages = PyPDFLoader(file_path).load()
+    return [page.page_content for page in pages], time.perf_counter() - start
+
+
+def parse_loader(loader, file_path):
+    start = time.perf_counter()
+    first_page, texts = None, []
+    for page in loader.lazy_load_pdf(file_path):
+        if first_page is None:
+            first_page = time.perf_counter() - start
+        texts.append(page.page_content)
+    return texts, first_page
+
+
+def run(name, parse, files):
+    pages, first_page = 0, []
+    texts = {}
+    start = time.perf_counter()
+    for file_path in files:
+        texts[file_path], first = parse(file_path)
+        pages += len(texts[file_path])
+        first_page.append(first)
+    elapsed = time.perf_counter() - start
+    return {
+        "name": name,
+        "pages_per_s": pages / elapsed,
+        "first_page_ms": 1000 * sum(first_page) / len(first_page),
+        "texts": texts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,500", help="pages per generated PDF")
+    parser.add_argument("--files", type=int, default=3, help="PDFs per size")
+    parser.add_argument("--page-workers", type=int, default=config.PDF_PAGE_WORKERS)
+    parser.add_argument("--min-pages", type=int, default=config.PDF_PARALLEL_MIN_PAGES)
+    args = parser.parse_args()
+    config.PDF_PARALLEL_MIN_PAGES = args.min_pages
+
+    workdir = Path(tempfile.mkdtemp(prefix="mrag_pdf_"))
+    backends = [
+        ("pypdfloader", parse_pypdfloader),
+        ("pypdf", partial(parse_loader, UnifiedDocumentLoader("pypdf", page_workers=1))),
+        ("pypdfium2", partial(parse_loader, UnifiedDocumentLoader("pypdfium2", page_workers=1))),
+    ]
+    if args.page_workers > 1:
+        loader = UnifiedDocumentLoader("pypdfium2", page_workers=args.page_workers)
+        backends.append((f"pypdfium2x{args.page_workers}", partial(parse_loader, loader)))
+
+    print(f"{'pages':>6s} {'backend':14s} {'pages/s':>9s} {'first page ms':>14s} {'same words':>11s}")
+    for size in [int(x) for x in args.sizes.split(",")]:
+        files = [str(path) for path in generate_corpus(workdir / f"pages_{size}", args.files, size)]
+        reference = None
+        for name, parse in backends:
+            result = run(name, parse, files)
+            reference = reference or result["texts"]
+            same = all(
+                [text.split() for text in result["texts"][path]] == [text.split() for text in reference[path]]
+                for path in files
+            )
+            print(
+                f"{size:6d} {name:14s} {result['pages_per_s']:9.1f} {result['first_page_ms']:14.1f} {str(same):>11s}",
+                flush=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Compare how much prompt prefix each PROMPT_LAYOUT lets vLLM reuse.
+
+Queries are drawn from a few topics; every query on a topic retrieves the same
+chunks, but in a different score order and with a different question wording.
+Each layout sends the resulting prompts through the real generation chain
+(``ChatOpenAI``) to a local OpenAI-compatible stub that simulates automatic
+prefix caching and reports the cached (shared-prefix) tokens.
+
+    python benchmarks/bench_prompt_prefix.py --queries 200 --topics 10
+"""
+
+import argparse
+import random
+
+from fakes import make_documents
+from openai_stub import OpenAIStub
+
+import config
+import rag_chain
+
+QUESTIONS = [
+    "What does {topic} evaluate?",
+    "Summarise the main idea of {topic}.",
+    "{topic}的主要贡献是什么？",
+    "How is {topic} different from earlier work?",
+]
+
+
+def build_workload(args):
+    rng = random.Random(args.seed)
+    topics = []
+    for t in range(args.topics):
+        docs = make_documents(args.chunks_per_topic, file_name=f"paper_{t}.pdf")
+        for doc in docs:
+            doc.page_content = f"[paper_{t}] " + " ".join(
+                rng.choice(["agent", "GUI", "benchmark", "网页", "任务", "model", "reward", "planning"])
+                for _ in range(args.chunk_words)
+            )
+        topics.append(docs)
+
+    workload = []
+    for _ in range(args.queries):
+        t = rng.randrange(args.topics)
+        docs = list(topics[t])
+        rng.shuffle(docs)  # 检索分数的微小差异导致每次顺序不同
+        question = rng.choice(QUESTIONS).format(topic=f"paper_{t}")
+        workload.append({"local_docs": docs, "web_docs": None, "question": question, "metadata": {}})
+    return workload
+
+
+def run_layout(layout, workload, stub):
+    config.PROMPT_LAYOUT = layout
+    generation_chain = rag_chain.create_generation_chain(layout)
+    stub.prefix_cache.reset()
+    for retrieval_result in workload:
+        generation_chain.invoke(rag_chain.assemble_retrieval(retrieval_result))
+    cache = stub.prefix_cache
+    return {
+        "requests": cache.requests,
+        "prompt_tokens": cache.prompt_tokens,
+        "cached_tokens": cache.cached_tokens,
+        "avg_shared_prefix": cache.cached_tokens / max(cache.requests, 1),
+        "hit_rate": cache.cached_tokens / max(cache.prompt_tokens, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--topics", type=int, default=10)
+    parser.add_argument("--chunks-per-topic", type=int, default=5)
+    parser.add_argument("--chunk-words", type=int, default=120)
+    parser.add_argument("--block-size", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workload = build_workload(args)
+    with OpenAIStub(block_size=args.block_size) as stub:
+        config.REASONING_API_BASE = stub.base_url
+        results = {layout: run_layout(layout, workload, stub) for layout in ("legacy", "prefix_cache")}
+
+    print(f"{'layout':<14}{'requests':>10}{'prompt tok':>12}{'cached tok':>12}{'avg prefix':>12}{'hit rate':>10}")
+    for layout, r in results.items():
+        print(
+            f"{layout:<14}{r['requests']:>10}{r['prompt_tokens']:>12}{r['cached_tokens']:>12}"
+            f"{r['avg_shared_prefix']:>12.1f}{r['hit_rate']:>10.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
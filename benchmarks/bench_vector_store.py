@@ -0,0 +1,172 @@
+"""Milvus Lite vs the in-process mmap vector store on the same data.
+
+Synthetic L2-normalised vectors with small text/metadata payloads are written
+through ``load_existing_vector_store`` into both backends (``VECTOR_STORE_BACKEND``
+= milvus / mmap), so the measured paths are the ones the service uses. Reports
+ingestion time, single-query latency (``similarity_search_by_vector``, including
+document parsing), ``search_by_vectors`` batch throughput and the top-k overlap
+between the two backends. With ``--workers N`` it then forks N processes that
+each open the mmap store and search it, and reads the Rss/Pss of the
+``vectors.f32`` mapping from ``/proc/self/smaps`` (Linux) to show that workers
+share one copy of the page cache.
+
+    python benchmarks/bench_vector_store.py --vectors 100000 --dim 1024 --queries 300
+"""
+
+import argparse
+import multiprocessing
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from fakes import SERVER_DIR  # noqa: F401  (adds server/ to sys.path)
+
+import config
+from langchain_core.embeddings import Embeddings
+from vector_store import iter_batches, load_existing_vector_store
+
+
+def make_data(n, dim, seed):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    texts = [f"synthetic chunk {i} " + "lorem ipsum " * 40 for i in range(n)]
+    metadatas = [
+        {"file_name": f"doc_{i // 50:05d}.pdf", "chunk_id": i % 50, "source_location": f"第{i % 50 // 5 + 1}页"}
+        for i in range(n)
+    ]
+    queries = vectors[rng.choice(n, 1000, replace=False)] + 0.05 * rng.standard_normal((1000, dim)).astype(np.float32)
+    return vectors, texts, metadatas, queries
+
+
+# 写入时按文本查表返回预先生成的向量，两种后端都走add_texts这条入库路径
+class LookupEmbeddings(Embeddings):
+    def __init__(self, texts=(), vectors=()):
+        self.rows = {text: vector for text, vector in zip(texts, vectors)}
+
+    def embed_documents(self, texts):
+        return [self.rows[text].tolist() for text in texts]
+
+    def embed_query(self, text):
+        raise NotImplementedError("queries are searched by vector")
+
+
+def open_store(backend, embeddings=None, drop_old=False):
+    config.VECTOR_STORE_BACKEND = backend
+    return load_existing_vector_store(embeddings or LookupEmbeddings(), drop_old=drop_old)
+
+
+def ingest(backend, vectors, texts, metadatas, batch_size):
+    store = open_store(backend, LookupEmbeddings(texts, vectors), drop_old=True)
+    start = time.perf_counter()
+    for batch in iter_batches(range(len(texts)), batch_size):
+        rows = slice(batch[0], batch[-1] + 1)
+        store.add_texts(texts[rows], metadatas[rows])
+    return store, time.perf_counter() - start
+
+
+def single_query(store, queries, k):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        documents = store.similarity_search_by_vector(query.tolist(), k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([(d.metadata["file_name"], d.metadata["chunk_id"]) for d in documents])
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], results
+
+
+def batch_throughput(store, queries, k, batch_size):
+    start = time.perf_counter()
+    for batch in iter_batches(range(len(queries)), batch_size):
+        store.search_by_vectors([queries[i].tolist() for i in batch], k)
+    return len(queries) / (time.perf_counter() - start)
+
+
+def mapping_memory(path):
+    rss = pss = 0
+    in_mapping = False
+    with open("/proc/self/smaps", encoding="utf-8") as f:
+        for line in f:
+            fields = line.split()
+            if "-" in fields[0] and len(fields) >= 5:
+                in_mapping = fields[-1] == path
+            elif in_mapping and fields[0] == "Rss:":
+                rss += int(fields[1])
+            elif in_mapping and fields[0] == "Pss:":
+                pss += int(fields[1])
+    return rss, pss
+
+
+def worker(queries, k, barrier, results):
+    store = open_store("mmap")
+    for query in queries:
+        store.similarity_search_by_vector(query.tolist(), k=k)
+    barrier.wait()  # 所有worker都已映射并访问过全部页面后再统计Pss
+    results.put(mapping_memory(str(Path(config.MMAP_STORE_DIR).resolve() / "vectors.f32")))
+    barrier.wait()
+
+
+def shared_pages(workers, queries, k):
+    context = multiprocessing.get_context("fork")
+    barrier, results = context.Barrier(workers), context.Queue()
+    processes = [context.Process(target=worker, args=(queries, k, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    memory = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=config.RETRIEVER_TOP_K)
+    parser.add_argument("--batch-size", type=int, default=32, help="queries per search_by_vectors call")
+    parser.add_argument("--ingest-batch", type=int, default=config.INGEST_EMBED_BATCH_SIZE)
+    parser.add_argument("--milvus-index", default="FLAT", help="Milvus index type for the comparison")
+    parser.add_argument("--workers", type=int, default=4, help="processes sharing the mmap store (0 = skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="mrag_vstore_"))
+    config.MILVUS_URI = str(workdir / "milvus.db")
+    config.MMAP_STORE_DIR = str(workdir / "mmap_store")
+    config.MILVUS_INDEX_TYPE = args.milvus_index
+    config.MILVUS_METRIC_TYPE = config.MMAP_METRIC_TYPE = "IP"
+    vectors, texts, metadatas, queries = make_data(args.vectors, args.dim, args.seed)
+    queries = queries[: args.queries]
+    print(f"{args.vectors} vectors, dim={args.dim}, {len(queries)} queries, k={args.k}, Milvus index {args.milvus_index}")
+
+    results = {}
+    for backend in ("milvus", "mmap"):
+        store, ingest_seconds = ingest(backend, vectors, texts, metadatas, args.ingest_batch)
+        p50, p99, results[backend] = single_query(store, queries, args.k)
+        qps = batch_throughput(store, queries, args.k, args.batch_size)
+        print(
+            f"{backend:7s} ingest {ingest_seconds:7.2f}s  single-query p50 {p50:7.2f}ms  p99 {p99:7.2f}ms  "
+            f"batch({args.batch_size}) {qps:8.1f} queries/s",
+            flush=True,
+        )
+
+    overlap = np.mean([
+        len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(results["milvus"], results["mmap"])
+    ])
+    print(f"top-{args.k} overlap milvus vs mmap: {overlap:.3f}")
+
+    if args.workers > 0:
+        memory = shared_pages(args.workers, queries[:20], args.k)
+        matrix_mb = args.vectors * args.dim * 4 / 2**20
+        print(f"vectors.f32 {matrix_mb:.1f} MB mapped by {args.workers} workers:")
+        for i, (rss, pss) in enumerate(memory):
+            print(f"  worker {i}: Rss {rss / 1024:7.1f} MB  Pss {pss / 1024:7.1f} MB")
+        print(f"  total Pss {sum(pss for _, pss in memory) / 1024:.1f} MB (one shared copy)")
+
+
+if __name__ == "__main__":
+    main()
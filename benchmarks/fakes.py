@@ -0,0 +1,142 @@
+"""Local stand-ins for the heavy RAG dependencies, used by the benchmark scripts."""
+
+import asyncio
+import hashlib
+import math
+import sys
+import time
+from functools import partial
+from types import ModuleType, SimpleNamespace
+from pathlib import Path
+from typing import Any, List, Optional
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "server"
+if str(SERVER_DIR) not in sys.path:
+    sys.path.insert(0, str(SERVER_DIR))
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.retrievers import BaseRetriever
+
+
+def make_documents(n: int = 5, file_name: str = "fake.pdf") -> List[Document]:
+    return [
+        Document(
+            page_content=f"Fake chunk {i} about agents, retrieval and benchmarks.",
+            metadata={"file_name": file_name, "source_location": f"第{i + 1}页", "chunk_id": i},
+        )
+        for i in range(n)
+    ]
+
+
+def fake_embedding(text: str, dim: int = 64) -> List[float]:
+    # 确定性embedding：按词哈希到dim维向量再归一化，相同文本得到相同向量，共享词的文本相似
+    vector = [0.0] * dim
+    for token in text.lower().split():
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        vector[digest[0] % dim] += 1.0 if digest[1] % 2 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+# 模拟vllm.LLM(task="embed")：embed()的耗时 = 固定开销 + 每条文本的开销，与GPU上批处理的特性一致
+class FakeEmbeddingLLM:
+    def __init__(self, model: str = "fake", task: str = "embed", dim: int = 64,
+                 call_overhead: float = 0.004, per_item: float = 0.0002, **kwargs):
+        self.dim = dim
+        self.call_overhead = call_overhead
+        self.per_item = per_item
+        self.calls = 0
+        self.items = 0
+
+    def embed(self, texts: List[str], **kwargs) -> list:
+        self.calls += 1
+        self.items += len(texts)
+        time.sleep(self.call_overhead + self.per_item * len(texts))
+        return [SimpleNamespace(outputs=SimpleNamespace(embedding=fake_embedding(t, self.dim))) for t in texts]
+
+
+# 用FakeEmbeddingLLM代替vllm模块，VLLMEmbedding（及chat.py）无需GPU即可启动
+def install_fake_vllm(**kwargs) -> ModuleType:
+    module = ModuleType("vllm")
+    module.LLM = partial(FakeEmbeddingLLM, **kwargs)
+    sys.modules["vllm"] = module
+    return module
+
+
+# 与VLLMEmbedding接口一致的Embeddings，底层使用FakeEmbeddingLLM
+class FakeEmbeddings(Embeddings):
+    def __init__(self, **kwargs):
+        self.model = FakeEmbeddingLLM(**kwargs)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [output.outputs.embedding for output in self.model.embed(texts)]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.model.embed([text])[0].outputs.embedding
+
+    def get_detailed_instruct(self, task_description: str, query: str) -> str:
+        return f"Instruct: {task_description}\nQuery: {query}"
+
+
+# 模拟vLLM推理服务：同步调用阻塞线程，异步调用只让出事件循环
+class FakeChatModel(BaseChatModel):
+    latency: float = 0.5
+    answer: str = "This is a fake answer generated for benchmarking."
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+
+# 模拟Embedding + Milvus检索：阻塞型调用
+class FakeRetriever(BaseRetriever):
+    latency: float = 0.1
+    docs: Optional[List[Document]] = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        time.sleep(self.latency)
+        return list(self.docs or make_documents())
+
+
+# 模拟MCP Web搜索：web_search阻塞latency秒后返回固定结果
+class FakeSearchManager:
+    def __init__(self, latency: float = 1.0, result: str = "Fake web search result."):
+        self.latency = latency
+        self.result = result
+        self.web_search_tool = object()
+        self.calls = 0
+
+    def web_search(self, query: str) -> Optional[str]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return f"{self.result} ({query})"
+
+
+# 模拟MCP的LangChain工具（bailian-websearch）：invoke阻塞latency秒后返回固定结果
+class FakeMCPTool:
+    name = "bailian-websearch_fake"
+
+    def __init__(self, latency: float = 0.3, result: str = "Fake web search result."):
+        self.latency = latency
+        self.result = result
+        self.calls = 0
+
+    def invoke(self, arguments: dict) -> str:
+        self.calls += 1
+        time.sleep(self.latency)
+        return f"{self.result} ({arguments.get('query')})"
@@ -0,0 +1,230 @@
+"""Load-test /rag/query on a CPU-only box with local stand-ins for every external service.
+
+A child process builds a knowledge base from generated PDFs with
+``vector_manager`` and starts the real FastAPI app from ``chat.py`` on uvicorn, with:
+  - a deterministic fake vLLM embedding model (``install_fake_vllm``), or with
+    ``--embedding-backend remote`` the stub's ``/v1/embeddings`` through ``RemoteEmbedding``
+  - an in-process OpenAI-compatible stub with per-token latency (``REASONING_API_BASE``)
+  - a fake MCP web search tool (``--web-search-ms``; 0 disables web search)
+  - the Milvus Lite file, or with ``--vector-store mmap`` the in-process ``MmapVectorStore``
+
+The parent process then drives ``/rag/query`` over HTTP:
+  concurrency - N closed-loop clients, each sending its next request when the last one returns
+  rate        - open-loop Poisson arrivals at R req/s; latency is measured from the scheduled
+                arrival time, so queueing delay is not hidden (no coordinated omission)
+
+and reports throughput and p50/p95/p99 latency per level.
+
+    python benchmarks/loadtest.py --mode concurrency --levels 1,8,32 --duration 20
+    python benchmarks/loadtest.py --mode rate --levels 5,10,20 --duration 20 --json results.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from fakes import FakeMCPTool, install_fake_vllm
+from openai_stub import OpenAIStub, _free_port
+from pdfgen import WORDS, generate_corpus
+
+import config
+
+
+def serve(args, workdir: Path, port: int):
+    config.MILVUS_URI = str(workdir / "milvus.db")
+    for name in (
+        "SPARSE_INDEX_DIR", "INGEST_CHECKPOINT_PATH", "INGEST_MANIFEST_PATH",
+        "KB_VERSION_PATH", "DOC_EMBED_CACHE_DIR", "MMAP_STORE_DIR",
+    ):
+        setattr(config, name, str(workdir / name.lower()))
+    install_fake_vllm(call_overhead=args.embed_call_ms / 1000, per_item=args.embed_item_ms / 1000)
+
+    import vector_manager
+    from vector_store import create_embedding_model
+
+    stub = OpenAIStub(
+        reply=" ".join(random.Random(0).choice(WORDS) for _ in range(args.answer_tokens)),
+        token_latency=args.token_ms / 1000,
+        first_token_latency=args.first_token_ms / 1000,
+        embedding_latency=args.embed_call_ms / 1000,
+    ).start()
+    config.REASONING_API_BASE = stub.base_url
+    config.EMBEDDING_API_BASE = stub.base_url
+    config.EMBEDDING_BACKEND = args.embedding_backend
+    config.VECTOR_STORE_BACKEND = args.vector_store
+
+    corpus = workdir / "raw_data"
+    generate_corpus(corpus, args.files, args.pages)
+    vector_manager.build_offline_knowledge_base(str(corpus), create_embedding_model("fake"), workers=1)
+
+    config.ENABLE_WEB_SEARCH = args.web_search_ms > 0
+    if config.ENABLE_WEB_SEARCH:
+        from mcp_manager import MCP_Service
+
+        def initialize():
+            MCP_Service.web_search_tool = FakeMCPTool(latency=args.web_search_ms / 1000)
+            return True
+
+        MCP_Service.initialize = initialize
+
+    import uvicorn
+    import chat
+
+    uvicorn.run(chat.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def make_queries(n: int, seed: int):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(6)) for _ in range(n)]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(mode, level, latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "mode": mode,
+        "level": level,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "mean_ms": 1000 * sum(latencies) / len(latencies) if latencies else float("nan"),
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p95_ms": 1000 * percentile(latencies, 95),
+        "p99_ms": 1000 * percentile(latencies, 99),
+    }
+
+
+async def send(client, query, latencies, errors, start):
+    try:
+        response = await client.post("/rag/query", json={"query": query})
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    except Exception:
+        errors.append(1)
+
+
+async def run_concurrency(client, queries, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    rng = random.Random(concurrency)
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await send(client, rng.choice(queries), latencies, errors, time.perf_counter())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, len(errors), time.perf_counter() - start
+
+
+async def run_rate(client, queries, rate, duration):
+    latencies, errors, tasks = [], [], []
+    rng = random.Random(int(rate * 1000))
+    start = time.perf_counter()
+    scheduled = start
+    while scheduled - start < duration:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(client, rng.choice(queries), latencies, errors, scheduled)))
+        scheduled += rng.expovariate(rate)
+    await asyncio.gather(*tasks)
+    return latencies, len(errors), time.perf_counter() - start
+
+
+async def drive(args, base_url):
+    queries = make_queries(args.distinct_queries, args.seed)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        for query in queries[: args.warmup]:
+            await client.post("/rag/query", json={"query": query})
+
+        results = []
+        for level in [float(x) for x in args.levels.split(",")]:
+            if args.mode == "concurrency":
+                level = int(level)
+                latencies, errors, elapsed = await run_concurrency(client, queries, level, args.duration)
+            else:
+                latencies, errors, elapsed = await run_rate(client, queries, level, args.duration)
+            result = summarize(args.mode, level, latencies, errors, elapsed)
+            results.append(result)
+            print(
+                f"{args.mode} {level:>6}  {result['requests']:>6} req  {result['errors']:>4} err  "
+                f"{result['throughput']:7.2f} req/s  p50 {result['p50_ms']:8.1f}  "
+                f"p95 {result['p95_ms']:8.1f}  p99 {result['p99_ms']:8.1f} ms",
+                flush=True,
+            )
+        return results
+
+
+def wait_ready(base_url, process, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not process.is_alive():
+            raise RuntimeError("server process exited during startup")
+        try:
+            if httpx.get(f"{base_url}/readyz", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError("server did not become ready")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["concurrency", "rate"], default="concurrency")
+    parser.add_argument("--levels", default="1,8,32", help="concurrency levels or arrival rates (req/s)")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--distinct-queries", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--embedding-backend", choices=["vllm", "remote"], default="vllm")
+    parser.add_argument("--vector-store", choices=["milvus", "mmap"], default="milvus")
+    parser.add_argument("--embed-call-ms", type=float, default=4.0)
+    parser.add_argument("--embed-item-ms", type=float, default=0.2)
+    parser.add_argument("--first-token-ms", type=float, default=50.0)
+    parser.add_argument("--token-ms", type=float, default=10.0)
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    parser.add_argument("--web-search-ms", type=float, default=300.0)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the per-level results to this file")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="mrag_load_"))
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    process = multiprocessing.get_context("fork").Process(target=serve, args=(args, workdir, port), daemon=True)
+    process.start()
+    try:
+        wait_ready(base_url, process, args.startup_timeout)
+        print(f"server ready at {base_url} (workdir {workdir})", flush=True)
+        results = asyncio.run(drive(args, base_url))
+    finally:
+        process.terminate()
+        process.join(timeout=10)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    sys.exit(1 if any(r["errors"] for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
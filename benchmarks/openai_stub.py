@@ -0,0 +1,189 @@
+"""In-process OpenAI-compatible chat completions / embeddings stub for the benchmark scripts.
+
+Serves ``POST /v1/chat/completions`` (plain and ``stream=true``) and
+``POST /v1/embeddings`` (deterministic ``fake_embedding`` vectors) on a background
+uvicorn thread. Prompts are split into approximate tokens and run through a
+simulated vLLM automatic prefix cache (hash chain over fixed-size blocks), so
+each response reports ``usage.prompt_tokens_details.cached_tokens``.
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import socket
+import threading
+import time
+import uuid
+from typing import List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from fakes import fake_embedding
+
+# 近似token：英文单词/数字、单个汉字、单个标点各算一个
+_TOKEN = re.compile(r"[A-Za-z0-9]+|[一-鿿]|[^\sA-Za-z0-9一-鿿]")
+
+
+def approx_tokens(text: str) -> List[str]:
+    return _TOKEN.findall(text)
+
+
+# 模拟vLLM的自动前缀缓存：按block_size切块，每块的hash包含之前所有块，只有完整块可以命中
+class PrefixCacheSimulator:
+    def __init__(self, block_size: int = 16):
+        self.block_size = block_size
+        self.blocks = set()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def observe(self, tokens: List[str]) -> int:
+        cached, hit, parent = 0, True, b""
+        with self.lock:
+            for start in range(0, len(tokens) - self.block_size + 1, self.block_size):
+                block = "\x00".join(tokens[start : start + self.block_size]).encode("utf-8")
+                parent = hashlib.sha1(parent + block).digest()
+                if hit and parent in self.blocks:
+                    cached += self.block_size
+                else:
+                    hit = False
+                    self.blocks.add(parent)
+            self.requests += 1
+            self.prompt_tokens += len(tokens)
+            self.cached_tokens += cached
+        return cached
+
+    def reset(self):
+        with self.lock:
+            self.blocks.clear()
+            self.requests = self.prompt_tokens = self.cached_tokens = 0
+
+
+class OpenAIStub:
+    def __init__(self, reply: str = "This is a stub answer.", token_latency: float = 0.0,
+                 first_token_latency: float = 0.0, block_size: int = 16, port: int = 0,
+                 embedding_dim: int = 64, embedding_latency: float = 0.0):
+        self.reply = reply
+        self.token_latency = token_latency
+        self.first_token_latency = first_token_latency
+        self.prefix_cache = PrefixCacheSimulator(block_size)
+        self.prompts: List[str] = []
+        self.embedding_dim = embedding_dim
+        self.embedding_latency = embedding_latency
+        self.embedding_requests = 0
+        self.port = port or _free_port()
+        self._server = None
+        self._thread = None
+        self.app = self._build_app()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: Request):
+            body = await request.json()
+            prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+            self.prompts.append(prompt)
+            tokens = approx_tokens(prompt)
+            cached = self.prefix_cache.observe(tokens)
+            reply_tokens = approx_tokens(self.reply) or [self.reply]
+            usage = {
+                "prompt_tokens": len(tokens),
+                "completion_tokens": len(reply_tokens),
+                "total_tokens": len(tokens) + len(reply_tokens),
+                "prompt_tokens_details": {"cached_tokens": cached},
+            }
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            model = body.get("model", "stub")
+
+            if body.get("stream"):
+                return StreamingResponse(
+                    self._stream(completion_id, model, reply_tokens, usage),
+                    media_type="text/event-stream",
+                )
+
+            await asyncio.sleep(self.first_token_latency + self.token_latency * len(reply_tokens))
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        @app.post("/v1/embeddings")
+        async def embeddings(request: Request):
+            body = await request.json()
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            self.embedding_requests += 1
+            await asyncio.sleep(self.embedding_latency)
+            return JSONResponse({
+                "object": "list",
+                "model": body.get("model", "stub"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(text, self.embedding_dim)}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": sum(len(approx_tokens(text)) for text in inputs)},
+            })
+
+        return app
+
+    async def _stream(self, completion_id, model, reply_tokens, usage):
+        def chunk(delta, finish_reason=None, **extra):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **extra,
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        await asyncio.sleep(self.first_token_latency)
+        yield chunk({"role": "assistant", "content": ""})
+        for i, token in enumerate(reply_tokens):
+            await asyncio.sleep(self.token_latency)
+            yield chunk({"content": token if i == 0 else " " + token})
+        yield chunk({}, "stop", usage=usage)
+        yield "data: [DONE]\n\n"
+
+    def start(self) -> "OpenAIStub":
+        server_config = uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning")
+        self._server = uvicorn.Server(server_config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
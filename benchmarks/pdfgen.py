@@ -0,0 +1,62 @@
+"""Generate simple text PDFs for the ingestion and parsing benchmarks (no third-party deps)."""
+
+import random
+from pathlib import Path
+from typing import List
+
+WORDS = (
+    "agent retrieval augmented generation milvus vector index embedding query answer "
+    "benchmark latency throughput webarena gui framework model reasoning context chunk "
+    "document page search ranking prompt token cache batch pipeline memory"
+).split()
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def random_page_text(rng: random.Random, lines: int = 45, words_per_line: int = 12) -> List[str]:
+    return [" ".join(rng.choice(WORDS) for _ in range(words_per_line)) for _ in range(lines)]
+
+
+def write_pdf(path: Path, pages: List[List[str]]):
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages，所有Page对象编号确定后再写入
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for lines in pages:
+        stream = "BT /F1 10 Tf 12 TL 50 790 Td " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        stream = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+
+
+def generate_corpus(directory: Path, num_files: int, pages_per_file: int, seed: int = 0) -> List[Path]:
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(num_files):
+        path = directory / f"doc_{i:05d}.pdf"
+        write_pdf(path, [random_page_text(rng) for _ in range(pages_per_file)])
+        paths.append(path)
+    return paths
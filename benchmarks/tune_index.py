@@ -0,0 +1,214 @@
+"""Recall@k, latency and memory of Milvus index settings against exact search.
+
+Vectors are read from the live collection (``config.MILVUS_URI`` /
+``MILVUS_COLLECTION_NAME``), or generated with ``--synthetic N`` (clustered,
+L2-normalised) on a box without a knowledge base. Every index setting is built
+in a temporary Milvus Lite file, so the live collection is never modified. Queries
+are stored vectors plus a little noise; the ground truth is an exact numpy
+top-k under the same metric. For each build setting every search setting
+(``nprobe`` / ``ef``) is swept, and the script reports recall@k, p50/p99 latency of
+single-query searches, build time and the estimated index memory for float32
+and float16 vectors (Milvus Lite does not report memory and cannot store float16).
+
+    python benchmarks/tune_index.py --queries 500 --k 5
+    python benchmarks/tune_index.py --synthetic 100000 --dim 1024 --index-types FLAT,IVF_FLAT,HNSW --ef 16,64,256
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from fakes import SERVER_DIR  # noqa: F401  (adds server/ to sys.path)
+
+import config
+from pymilvus import DataType, MilvusClient
+
+from vector_store import iter_batches
+
+
+def load_collection_vectors(uri, collection_name, limit):
+    client = MilvusClient(uri=uri)
+    schema = client.describe_collection(collection_name)
+    field = next(f["name"] for f in schema["fields"] if f["type"] in (DataType.FLOAT_VECTOR, DataType.FLOAT16_VECTOR))
+    iterator = client.query_iterator(collection_name, batch_size=1000, output_fields=[field], limit=limit or -1)
+    vectors = []
+    while True:
+        rows = iterator.next()
+        if not rows:
+            break
+        vectors.extend(row[field] for row in rows)
+    iterator.close()
+    client.close()
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def synthetic_vectors(n, dim, clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(vectors, n, noise, seed):
+    rng = np.random.default_rng(seed + 1)
+    queries = vectors[rng.choice(len(vectors), min(n, len(vectors)), replace=False)]
+    return (queries + noise * rng.standard_normal(queries.shape).astype(np.float32)).astype(np.float32)
+
+
+# 精确top-k：与Milvus度量一致，L2取距离最小，IP/COSINE取相似度最大
+def exact_topk(vectors, queries, k, metric):
+    if metric == "COSINE":
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    results = []
+    for batch in iter_batches(range(len(queries)), 256):
+        block = queries[batch[0] : batch[-1] + 1]
+        scores = block @ vectors.T
+        if metric == "L2":
+            scores = 2 * scores - (vectors * vectors).sum(axis=1)  # -||q-v||² + ||q||²，排序与L2一致
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results.extend(set(row) for row in top)
+    return results
+
+
+# 估算的索引内存：原始向量 + IVF聚类中心/倒排id 或 HNSW底层2M条边（上层节点可忽略）
+def estimate_memory(index_type, params, n, dim, bytes_per_value):
+    raw = n * dim * bytes_per_value
+    if index_type == "IVF_FLAT":
+        return raw + params["nlist"] * dim * 4 + n * 8
+    if index_type == "IVF_SQ8":
+        return n * dim + params["nlist"] * dim * 4 + n * 8
+    if index_type == "HNSW":
+        return raw + n * 2 * params["M"] * 4
+    return raw
+
+
+def build_settings(args):
+    settings = []
+    for index_type in args.index_types.split(","):
+        if index_type == "FLAT":
+            settings.append((index_type, {}, [{}]))
+        elif index_type in ("IVF_FLAT", "IVF_SQ8"):
+            for nlist in ints(args.nlist):
+                settings.append((index_type, {"nlist": nlist}, [{"nprobe": p} for p in ints(args.nprobe)]))
+        elif index_type == "HNSW":
+            for m in ints(args.hnsw_m):
+                for ef_construction in ints(args.ef_construction):
+                    build = {"M": m, "efConstruction": ef_construction}
+                    settings.append((index_type, build, [{"ef": max(ef, args.k)} for ef in ints(args.ef)]))
+        else:
+            raise SystemExit(f"unsupported index type: {index_type}")
+    return settings
+
+
+def ints(value):
+    return [int(x) for x in value.split(",")]
+
+
+def build_collection(client, name, vectors, index_type, metric, params):
+    schema = client.create_schema(auto_id=False)
+    schema.add_field("id", DataType.INT64, is_primary=True)
+    schema.add_field("vector", DataType.FLOAT_VECTOR, dim=vectors.shape[1])
+    index_params = client.prepare_index_params()
+    index_params.add_index("vector", index_type=index_type, metric_type=metric, params=params)
+
+    start = time.perf_counter()
+    client.create_collection(name, schema=schema, index_params=index_params)
+    for batch in iter_batches(range(len(vectors)), 5000):
+        client.insert(name, [{"id": i, "vector": vectors[i]} for i in batch])
+    client.flush(name)
+    client.load_collection(name)
+    return time.perf_counter() - start
+
+
+def evaluate(client, name, queries, truth, k, metric, search_params):
+    latencies, hits = [], 0
+    for query, relevant in zip(queries, truth):
+        start = time.perf_counter()
+        result = client.search(name, data=[query], anns_field="vector", limit=k,
+                               search_params={"metric_type": metric, "params": search_params})
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(relevant & {hit["id"] for hit in result[0]})
+    latencies.sort()
+    return {
+        "recall": hits / (len(queries) * k),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uri", default=config.MILVUS_URI)
+    parser.add_argument("--collection", default=config.MILVUS_COLLECTION_NAME)
+    parser.add_argument("--limit", type=int, default=0, help="read at most this many vectors (0 = all)")
+    parser.add_argument("--synthetic", type=int, default=0, help="generate N synthetic vectors instead")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--metric", default=config.MILVUS_METRIC_TYPE, choices=["L2", "IP", "COSINE"])
+    parser.add_argument("--index-types", default="FLAT,IVF_FLAT,IVF_SQ8,HNSW")
+    parser.add_argument("--nlist", default="256")
+    parser.add_argument("--nprobe", default="4,16,64")
+    parser.add_argument("--hnsw-m", default="16")
+    parser.add_argument("--ef-construction", default="200")
+    parser.add_argument("--ef", default="16,64,256")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.05, help="std of the noise added to query vectors")
+    parser.add_argument("--k", type=int, default=config.RETRIEVER_TOP_K)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, args.dim, args.clusters, args.seed)
+        source = f"{args.synthetic} synthetic vectors"
+    else:
+        vectors = load_collection_vectors(args.uri, args.collection, args.limit)
+        source = f"{len(vectors)} vectors from {args.uri}:{args.collection}"
+    n, dim = vectors.shape
+    queries = make_queries(vectors, args.queries, args.noise, args.seed)
+    truth = exact_topk(vectors, queries, args.k, args.metric)
+    print(f"{source}, dim={dim}, metric={args.metric}, {len(queries)} queries, recall@{args.k} vs exact search")
+    print(f"{'index':9s} {'build params':34s} {'search params':14s} {'recall':>7s} {'p50 ms':>8s} "
+          f"{'p99 ms':>8s} {'build s':>8s} {'mem MB':>8s} {'fp16 MB':>8s}")
+
+    workdir = Path(tempfile.mkdtemp(prefix="mrag_tune_"))
+    client = MilvusClient(uri=str(workdir / "tune.db"))
+    results = []
+    try:
+        for i, (index_type, build_params, search_grid) in enumerate(build_settings(args)):
+            name = f"tune_{i}"
+            build_seconds = build_collection(client, name, vectors, index_type, args.metric, build_params)
+            memory = estimate_memory(index_type, build_params, n, dim, 4)
+            memory_fp16 = estimate_memory(index_type, build_params, n, dim, 2) if index_type != "IVF_SQ8" else memory
+            for search_params in search_grid:
+                result = {
+                    "index_type": index_type,
+                    "build_params": build_params,
+                    "search_params": search_params,
+                    **evaluate(client, name, queries, truth, args.k, args.metric, search_params),
+                    "build_s": build_seconds,
+                    "memory_mb": memory / 2**20,
+                    "memory_fp16_mb": memory_fp16 / 2**20,
+                }
+                results.append(result)
+                print(
+                    f"{index_type:9s} {json.dumps(build_params):34s} {json.dumps(search_params):14s} "
+                    f"{result['recall']:7.3f} {result['p50_ms']:8.2f} {result['p99_ms']:8.2f} "
+                    f"{build_seconds:8.2f} {result['memory_mb']:8.1f} {result['memory_fp16_mb']:8.1f}",
+                    flush=True,
+                )
+            client.drop_collection(name)
+    finally:
+        client.close()
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+#!/bin/bash
+
+# Activate conda environment
+source /NAS/caizj/miniconda3/etc/profile.d/conda.sh
+conda activate df
+
+# Start VLLM embedding server in the background (used when EMBEDDING_BACKEND = "remote")
+CUDA_VISIBLE_DEVICES=${CUDA_VISIBLE_DEVICES:-3} nohup python -m vllm.entrypoints.openai.api_server \
+  --model /NAS/caizj/models/qwen/Qwen3-Embedding-0.6B/ --task embed \
+  --host 0.0.0.0 --port 8889 > vllm_embedding.log 2>&1 &
+
+echo "Embedding VLLM service started with PID: $!"
+echo "Log file: vllm_embedding.log"
@@ -1,14 +1,45 @@
+import argparse
+import asyncio
+import json
+from contextlib import asynccontextmanager
 from typing import Any, Dict, List, Optional
 
 import config
 import uvicorn
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from loguru import logger
-from pydantic import BaseModel, Field
-from rag_chain import create_rag_chain
-from vector_store import VLLMEmbedding, load_existing_vector_store
-from mcp_manager import MCP_Service
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, ValidationError, model_validator
+from rag_chain import aretrieve_and_format, assemble_retrieval
+from executor import run_blocking
+from hybrid_retriever import HybridRetriever
+from metadata_filter import MetadataFilter
+from metrics import REGISTRY, MetricsMiddleware, stage
+from service import RAGService
+
+
+# 检索范围：按文件名、页码范围或其他入库元数据（config.FILTERABLE_METADATA_FIELDS）限定，条件之间为and
+class RetrievalFilter(BaseModel):
+    # 未知字段返回422，避免拼写错误（如file_name）被忽略后变成不限范围的检索
+    model_config = ConfigDict(extra="forbid")
+
+    file_names: Optional[List[str]] = None
+    page_from: Optional[int] = Field(default=None, ge=1)
+    page_to: Optional[int] = Field(default=None, ge=1)
+    metadata: Dict[str, Any] = Field(default_factory=dict)  # 字段 -> 值或值列表，如{"chunk_id": [0, 1]}
+
+    _compiled: Optional[MetadataFilter] = PrivateAttr(default=None)
+
+    # 校验阶段即编译为MetadataFilter，字段或取值不合法时返回422
+    @model_validator(mode="after")
+    def compile_filter(self):
+        self._compiled = MetadataFilter.build(self.file_names, self.page_from, self.page_to, self.metadata)
+        return self
+
+    @property
+    def compiled(self) -> Optional[MetadataFilter]:
+        return self._compiled
 
 
 class RAGRequest(BaseModel):
@@ -16,6 +47,7 @@ class RAGRequest(BaseModel):
     task_description: Optional[str] = Field(
         default="Given a search query, retrieve relevant passages that answer the query",
     )
+    filters: Optional[RetrievalFilter] = None
 
 
 class SourceDocument(BaseModel):
@@ -26,29 +58,35 @@ class SourceDocument(BaseModel):
 class RAGResponse(BaseModel):
     response: str
     sources: List[SourceDocument]
+    metadata: Dict[str, Any] = Field(default_factory=dict)  # 如web_search状态: ok/empty/timeout/busy/disabled
 
 
-# Initialize RAG chain：embedding_model -> vector_store -> retriever -> rag_chain 
-embedding_model = VLLMEmbedding(model_name=config.EMBEDDING_MODEL_PATH)
-vector_store = load_existing_vector_store(embedding_model)
-retriever = vector_store.as_retriever(search_kwargs={"k": config.RETRIEVER_TOP_K})
+class RAGBatchItem(BaseModel):
+    index: int
+    status: str  # ok / error
+    result: Optional[RAGResponse] = None
+    error: Optional[str] = None
+
+
+class RAGBatchResponse(BaseModel):
+    results: List[RAGBatchItem]
 
-# 根据配置决定是否启用MCP
-mcp_service = None
-if config.ENABLE_WEB_SEARCH:
-    try:
-        if MCP_Service.initialize():
-            mcp_service = MCP_Service
-            logger.info("✅ MCP服务已启用")
-    except Exception as e:
-        logger.warning(f"MCP服务初始化失败: {e}")
 
-rag_chain = create_rag_chain(retriever,mcp_service)
-logger.info("✅ RAG service initialized successfully")
+# RAG组件在lifespan中后台初始化，进程启动后立即可以响应/healthz和/readyz
+service = RAGService()
 
+# /rag/batch同时处理（Web搜索+LLM生成）的条目数上限，保护vLLM服务和Web搜索线程池不被单个大batch占满
+batch_generation_semaphore = asyncio.Semaphore(config.BATCH_GENERATION_CONCURRENCY)
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await service.start()
+    yield
+    await service.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -56,34 +94,287 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# 请求耗时直方图、并发数和Server-Timing响应头；/metrics以Prometheus文本格式导出
+if config.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, endpoints=["/rag/query", "/rag/stream", "/rag/batch"])
+
+    @app.get("/metrics")
+    async def metrics_endpoint():
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+# 存活探针：进程和事件循环可用即返回200；启动阶段重试耗尽时返回503，由存活探针重启进程
+@app.get("/healthz")
+async def healthz_endpoint():
+    if service.failed:
+        return JSONResponse({"status": "failed", **service.status()}, status_code=503)
+    return {"status": "ok"}
+
+
+# 就绪探针：Embedding、Milvus、LLM预热全部完成后返回200，否则返回503及各启动阶段状态
+@app.get("/readyz")
+async def readyz_endpoint():
+    return JSONResponse(service.status(), status_code=200 if service.ready else 503)
 
-# 1.FastAPI输入输出为BaseModel实体对象，需创建RAGRequest和RAGResponse对象
-@app.post("/rag/query", response_model=RAGResponse)
-async def rag_query_endpoint(request: RAGRequest):
-    query_with_instruct = embedding_model.get_detailed_instruct(  # 2. Qwen3Embedding输入数据包括Instruct和Query
-        task_description=request.task_description,
-        query=request.query,
-    )
 
-    # 3. 区分embedding所需query和网络搜索所需query
+# 问答接口的依赖：服务未就绪时直接返回503
+def ready_service():
+    if not service.ready:
+        raise HTTPException(status_code=503, detail=service.status(), headers={"Retry-After": "5"})
+
+
+def build_query_data(request: RAGRequest) -> Dict[str, Any]:
+    with stage("instruct"):
+        query_with_instruct = service.embedding_model.get_detailed_instruct(  # Qwen3Embedding输入数据包括Instruct和Query
+            task_description=request.task_description,
+            query=request.query,
+        )
+
+    # 区分embedding所需query和网络搜索所需query
     query_data = {
         "query_with_instruct": query_with_instruct,
         "original_query": request.query
     }
+    if request.filters is not None and request.filters.compiled is not None:
+        query_data["metadata_filter"] = request.filters.compiled
+    return query_data
+
+
+def build_source_documents(docs) -> List[SourceDocument]:
+    return [
+        SourceDocument(page_content=doc.page_content, metadata=doc.metadata)
+        for doc in docs
+    ]
+
+
+# 查询语义缓存：query向量经embed_query计算后进入query向量缓存，随后检索阶段直接命中，不会重复计算
+# 语义缓存不区分检索范围，带过滤条件的请求既不查询也不写入缓存
+async def lookup_semantic_cache(query_data: Dict[str, Any]):
+    if service.semantic_cache is None or query_data.get("metadata_filter") is not None:
+        return None, None
+
+    embedding = await run_blocking(service.embedding_model.embed_query, query_data["query_with_instruct"])
+    return embedding, await semantic_cache_hit(embedding)
+
+
+# 语义缓存的查找和写入要与整个缓存矩阵做相似度计算并读取kb_version文件，在线程池中执行，不阻塞事件循环
+async def semantic_cache_hit(embedding) -> Optional[RAGResponse]:
+    if service.semantic_cache is None or embedding is None:
+        return None
+    hit = await run_blocking(service.semantic_cache.lookup, embedding)
+    if hit is None:
+        return None
+
+    response, similarity = hit
+    metadata = {**response.metadata, "semantic_cache": {"hit": True, "similarity": round(similarity, 4)}}
+    return response.model_copy(update={"metadata": metadata})
+
+
+async def store_semantic_cache(embedding, response: RAGResponse):
+    if service.semantic_cache is None or embedding is None:
+        return
+    # Web搜索超时或在途搜索已满时的降级回答不缓存
+    if response.metadata.get("web_search", {}).get("status") in ("timeout", "busy"):
+        return
+    await run_blocking(service.semantic_cache.store, embedding, response)
+
+
+# 显式序列化响应，使序列化耗时计入serialize阶段和Server-Timing
+def json_response(model: BaseModel) -> JSONResponse:
+    with stage("serialize"):
+        return JSONResponse(model.model_dump(mode="json"))
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 
-    result = rag_chain.invoke(query_data)  # 4. 执行rag_chain
+# 1.FastAPI输入输出为BaseModel实体对象，需创建RAGRequest和RAGResponse对象
+@app.post("/rag/query", response_model=RAGResponse, dependencies=[Depends(ready_service)])
+async def rag_query_endpoint(request: RAGRequest):
+    query_data = build_query_data(request)  # 2. 构建Instruct + Query
+
+    # 3. 语义缓存命中则直接返回，不调用LLM
+    embedding, cached = await lookup_semantic_cache(query_data)
+    if cached is not None:
+        return json_response(cached)
+
+    # 4. 异步执行rag_chain：检索在线程池中执行，ChatOpenAI走异步客户端，不阻塞事件循环
+    result = await service.rag_chain.ainvoke(query_data)
+
+    # 5. 文档溯源，组合response和sources给RAGResponse
+    sources = build_source_documents(result["sources"])
+    response = RAGResponse(
+        response=result["response"], sources=sources, metadata=result["metadata"]
+    )
+    await store_semantic_cache(embedding, response)
+    return json_response(response)
+
+
+# 批量检索：所有query一次Embedding，过滤条件相同的query一次多向量检索；混合检索时再逐条补充BM25并融合
+# 带过滤条件的query返回的embedding为None，不使用语义缓存
+def batch_retrieve(query_data: List[Dict[str, Any]]):
+    queries_with_instruct = [data["query_with_instruct"] for data in query_data]
+    filters = [data.get("metadata_filter") for data in query_data]
+    embeddings = service.embedding_model.embed_queries(queries_with_instruct)
+
+    groups: Dict[Optional[MetadataFilter], List[int]] = {}
+    for i, metadata_filter in enumerate(filters):
+        groups.setdefault(metadata_filter, []).append(i)
+    dense_docs = [None] * len(query_data)
+    for metadata_filter, indices in groups.items():
+        results = service.vector_store.search_by_vectors(
+            [embeddings[i] for i in indices], service.dense_top_k, metadata_filter
+        )
+        for i, docs in zip(indices, results):
+            dense_docs[i] = docs
 
-    sources = []     # 5. 文档溯源
-    for doc in result["sources"]:
-        source_doc = SourceDocument(
-            page_content=doc.page_content, metadata=doc.metadata
+    if isinstance(service.retriever, HybridRetriever):
+        local_docs = [
+            service.retriever.fuse(q, docs, metadata_filter)
+            for q, docs, metadata_filter in zip(queries_with_instruct, dense_docs, filters)
+        ]
+    else:
+        local_docs = [docs[: service.retriever_top_k] for docs in dense_docs]
+    embeddings = [None if f is not None else embedding for embedding, f in zip(embeddings, filters)]
+    return embeddings, local_docs
+
+
+async def answer_batch_item(index: int, query_data: Dict[str, Any], embedding, local_docs) -> RAGBatchItem:
+    try:
+        cached = await semantic_cache_hit(embedding)
+        if cached is not None:
+            return RAGBatchItem(index=index, status="ok", result=cached)
+
+        # 信号量覆盖Web搜索、重排序和生成：同时处理的条目数不超过BATCH_GENERATION_CONCURRENCY（小于WEB_SEARCH_MAX_IN_FLIGHT），
+        # 条目不会因在途Web搜索已满而跳过Web搜索，结果与条目在batch中的位置无关
+        async with batch_generation_semaphore:
+            retrieval_result = await aretrieve_and_format(
+                service.retriever, query_data, service.mcp_service, service.reranker, local_docs
+            )
+            retrieved = await run_blocking(assemble_retrieval, retrieval_result)  # 按token预算打包上下文是CPU计算，不在事件循环中执行
+            answer = await service.generation_chain.ainvoke(retrieved)
+
+        response = RAGResponse(
+            response=answer,
+            sources=build_source_documents(retrieved["sources"]),
+            metadata=retrieved["metadata"],
         )
-        sources.append(source_doc)
-    # 6. 组合response和sources给RAGResponse
-    return RAGResponse(response=result["response"], sources=sources)
+        await store_semantic_cache(embedding, response)
+        return RAGBatchItem(index=index, status="ok", result=response)
+    except Exception as e:
+        logger.error(f"批量请求第{index}条失败: {e}")
+        return RAGBatchItem(index=index, status="error", error=str(e))
+
+
+# 批量问答：结果与请求顺序一致，单条失败只影响该条的status/error
+# 逐条校验请求体，某条的query或过滤条件不合法时只将该条标记为error，不使整个batch返回422
+@app.post("/rag/batch", response_model=RAGBatchResponse, dependencies=[Depends(ready_service)])
+async def rag_batch_endpoint(requests: List[Any]):
+    if len(requests) > config.BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=413, detail=f"单次最多{config.BATCH_MAX_REQUESTS}条请求，收到{len(requests)}条"
+        )
+
+    results: List[Optional[RAGBatchItem]] = [None] * len(requests)
+    indices, query_data = [], []
+    for i, raw in enumerate(requests):
+        try:
+            request = RAGRequest.model_validate(raw)
+        except ValidationError as e:
+            results[i] = RAGBatchItem(index=i, status="error", error=str(e))
+            continue
+        indices.append(i)
+        query_data.append(build_query_data(request))
+    if not query_data:
+        return json_response(RAGBatchResponse(results=results))
+
+    try:
+        embeddings, local_docs = await run_blocking(batch_retrieve, query_data)
+    except Exception as e:
+        logger.error(f"批量检索失败: {e}")
+        for i in indices:
+            results[i] = RAGBatchItem(index=i, status="error", error=str(e))
+        return json_response(RAGBatchResponse(results=results))
+
+    answers = await asyncio.gather(
+        *(
+            answer_batch_item(i, data, embedding, docs)
+            for i, data, embedding, docs in zip(indices, query_data, embeddings, local_docs)
+        )
+    )
+    for i, answer in zip(indices, answers):
+        results[i] = answer
+    return json_response(RAGBatchResponse(results=results))
+
+
+# 运行时统计信息：Embedding微批的batch大小、排队等待时间等
+@app.get("/rag/stats")
+async def rag_stats_endpoint():
+    return {
+        "startup": service.status(),
+        "embedding": service.embedding_model.stats() if service.embedding_model else None,
+        "semantic_cache": service.semantic_cache.stats() if service.semantic_cache else None,
+        "web_search": service.mcp_service.stats() if service.mcp_service else None,
+    }
+
+
+# SSE流式接口：先发送sources事件，再逐token发送token事件，最后发送done事件
+@app.post("/rag/stream", dependencies=[Depends(ready_service)])
+async def rag_stream_endpoint(request: RAGRequest):
+    query_data = build_query_data(request)
+
+    async def event_stream():
+        try:
+            embedding, cached = await lookup_semantic_cache(query_data)
+            if cached is not None:
+                yield sse_event("sources", [source.model_dump() for source in cached.sources])
+                yield sse_event("token", {"content": cached.response})
+                yield sse_event("done", {"response": cached.response, "metadata": cached.metadata})
+                return
+
+            # 1. 检索阶段完成后立即返回溯源文档
+            retrieved = await service.retrieval_chain.ainvoke(query_data)
+            sources = build_source_documents(retrieved["sources"])
+            yield sse_event("sources", [source.model_dump() for source in sources])
+
+            # 2. 生成阶段：vLLM每产出一个token就推送一次
+            chunks = []
+            async for chunk in service.generation_chain.astream(retrieved):
+                chunks.append(chunk)
+                yield sse_event("token", {"content": chunk})
+
+            response = RAGResponse(
+                response="".join(chunks), sources=sources, metadata=retrieved["metadata"]
+            )
+            await store_semantic_cache(embedding, response)
+            yield sse_event("done", {"response": response.response, "metadata": response.metadata})
+        except Exception as e:
+            logger.error(f"流式生成失败: {e}")
+            yield sse_event("error", {"message": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host=config.API_HOST, port=config.API_PORT, log_level="info")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=config.API_WORKERS, help="uvicorn worker进程数")
+    args = parser.parse_args()
+
+    workers = args.workers
+    if workers > 1 and config.EMBEDDING_BACKEND == "vllm":
+        logger.warning("EMBEDDING_BACKEND=vllm时每个worker都会加载一份Embedding模型，改为单worker运行")
+        workers = 1
+
+    if workers > 1:
+        # 多worker需要以导入字符串启动，各worker独立初始化RAGService，缓存和指标按worker统计
+        uvicorn.run("chat:app", host=config.API_HOST, port=config.API_PORT, workers=workers, log_level="info")
+    else:
+        uvicorn.run(app, host=config.API_HOST, port=config.API_PORT, log_level="info")
@@ -1,12 +1,22 @@
 import os
 
-os.environ["CUDA_VISIBLE_DEVICES"] = "3"
 from dotenv import load_dotenv
 load_dotenv()
 
 # --- MODEL ---
 REASONING_MODEL_PATH = "/NAS/caizj/models/deepseek/DeepSeek-R1-Distill-Qwen-1.5B/"
 EMBEDDING_MODEL_PATH = "/NAS/caizj/models/qwen/Qwen3-Embedding-0.6B/"
+# Embedding模型使用的GPU，在创建vLLM引擎前写入CUDA_VISIBLE_DEVICES（环境变量已设置时不覆盖）
+EMBEDDING_CUDA_DEVICES = "3"
+# Embedding后端：vllm（API进程内加载模型，只能单worker）/ remote（OpenAI兼容的/v1/embeddings服务）
+EMBEDDING_BACKEND = "vllm"
+EMBEDDING_API_BASE = "http://localhost:8889/v1"
+EMBEDDING_API_KEY = "EMPTY"
+EMBEDDING_REMOTE_BATCH_SIZE = 64  # 单次/v1/embeddings请求的最大文本数
+EMBEDDING_REMOTE_TIMEOUT = 30.0
+EMBEDDING_REMOTE_RETRIES = 3
+EMBEDDING_REMOTE_BACKOFF = 0.5  # 重试间隔 = BACKOFF * 2^attempt
+EMBEDDING_REMOTE_MAX_CONNECTIONS = 32
 
 # --- DATASET ---
 RAW_DATA_PATH = "/NAS/caizj/project/Awesome-MRAG/dataset/raw_data"
@@ -15,20 +25,151 @@ UNUPDATED_DATA_PATH = "/NAS/caizj/project/Awesome-MRAG/dataset/unupdate_data"
 # --- Milvus ---
 MILVUS_URI = "/NAS/caizj/project/Awesome-MRAG/dataset/milvus/mrag_milvus.db"
 MILVUS_COLLECTION_NAME = "mrag_collection"
+KB_VERSION_PATH = "/NAS/caizj/project/Awesome-MRAG/dataset/milvus/kb_version"  # 知识库变化时更新
+# 索引类型和度量只在创建collection时生效，修改后需要重建知识库；检索参数按collection实际的索引类型选择
+# AUTOINDEX（默认）/ FLAT / IVF_FLAT / IVF_SQ8 / HNSW，可用 benchmarks/tune_index.py 比较召回率、延迟和内存
+MILVUS_INDEX_TYPE = "AUTOINDEX"
+MILVUS_METRIC_TYPE = "L2"  # Qwen3-Embedding输出已归一化，L2 / IP / COSINE 排序一致
+MILVUS_INDEX_PARAMS = {
+    "IVF_FLAT": {"nlist": 1024},
+    "IVF_SQ8": {"nlist": 1024},
+    "HNSW": {"M": 16, "efConstruction": 200},
+}
+MILVUS_SEARCH_PARAMS = {
+    "IVF_FLAT": {"nprobe": 16},
+    "IVF_SQ8": {"nprobe": 16},
+    "HNSW": {"ef": 64},
+}
+MILVUS_VECTOR_FLOAT16 = False  # 向量以float16存储，内存减半；Milvus Lite不支持，需要Milvus Standalone/Distributed
+# 请求可按这些元数据字段限定检索范围（RAGRequest.filters），值为字段类型 str / int；构建知识库时为其创建标量索引
+FILTERABLE_METADATA_FIELDS = {"file_name": "str", "page": "int", "chunk_id": "int"}
+MILVUS_SCALAR_INDEX_TYPE = "INVERTED"
+
+# --- Vector store backend ---
+# milvus：langchain_milvus + MILVUS_URI；mmap：进程内的内存映射float32矩阵 + SQLite元数据，检索不经过Milvus客户端，
+# 多个uvicorn worker共享同一份页缓存。切换后端后需要重新构建知识库
+VECTOR_STORE_BACKEND = "milvus"
+MMAP_STORE_DIR = "/NAS/caizj/project/Awesome-MRAG/dataset/mmap_store"
+MMAP_METRIC_TYPE = "IP"  # IP / COSINE / L2
+MMAP_SEARCH_BLOCK_ROWS = 65536  # 精确检索每次参与矩阵乘法的行数，限制临时内存
+# 可选的HNSW近似检索（需要hnswlib），关闭时为NumPy精确top-k
+MMAP_ANN_ENABLED = False
+MMAP_HNSW_M = 16
+MMAP_HNSW_EF_CONSTRUCTION = 200
+MMAP_HNSW_EF = 64
 
 # --- RAG ---
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 RETRIEVER_TOP_K = 5
 
+# --- Hybrid retrieval (BM25 + dense, RRF) ---
+HYBRID_SEARCH_ENABLED = True  # 稀疏索引不存在时自动退化为纯稠密检索
+SPARSE_INDEX_DIR = "/NAS/caizj/project/Awesome-MRAG/dataset/sparse_index"
+HYBRID_FETCH_K = 20  # 每一路检索返回的候选数
+RRF_K = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+HYBRID_SPARSE_WORKERS = 4
+
+# --- Reranking ---
+RERANK_ENABLED = False  # 开启后检索先取RERANK_FETCH_K个候选，重排序后保留RERANK_TOP_K个
+RERANKER_TYPE = "lexical"  # lexical / cross_encoder
+RERANKER_MODEL_PATH = "/NAS/caizj/models/BAAI/bge-reranker-base/"  # 仅cross_encoder使用
+RERANKER_DEVICE = "cpu"
+RERANK_FETCH_K = 20
+RERANK_TOP_K = 3
+# 每批打分的候选数，超时只能在批次之间生效。仅对batchable的重排序器（cross_encoder）生效：默认的lexical以候选集合为语料
+# 计算IDF，必须一次对全部候选打分，超时时只能放弃整次打分
+RERANK_BATCH_SIZE = 16
+RERANK_TIME_BUDGET = 0.3  # 秒，超时退回原检索顺序
+RERANK_WORKERS = 4
+
+# --- Prompt ---
+REASONING_API_BASE = "http://localhost:8888/v1"  # vLLM OpenAI兼容服务地址
+# prefix_cache: 固定指令前缀 + 按(file_name, chunk_id)排序的上下文 + 问题放在最后，便于vLLM复用KV缓存
+# legacy: 原模板，问题在上下文之前，上下文按检索分数排序
+PROMPT_LAYOUT = "prefix_cache"
+
+# --- Context packing ---
+CONTEXT_PACKING_ENABLED = True  # 去重并拼接重叠/相邻Chunk，按token预算截断
+CONTEXT_TOKEN_BUDGET = 3000  # 本地知识库部分的token上限
+CONTEXT_WEB_TOKEN_BUDGET = 1000  # 网络搜索部分的token上限
+CONTEXT_MIN_SEGMENT_TOKENS = 64  # 剩余预算不足该值时不再截断装入
+CONTEXT_TOKENIZER_PATH = REASONING_MODEL_PATH
+CONTEXT_CHARS_PER_TOKEN = 1.5  # tokenizer不可用时的估算值（偏保守，按中文计）
+
+# --- Embedding micro-batching ---
+EMBED_BATCH_ENABLED = True
+EMBED_BATCH_MAX_SIZE = 32  # 单个batch最多包含的query数
+EMBED_BATCH_WAIT_MS = 5.0  # 第一条query入队后最多等待的时间窗口
+
+# --- Query embedding cache ---
+QUERY_EMBED_CACHE_ENABLED = True
+QUERY_EMBED_CACHE_MAX_ENTRIES = 50000
+QUERY_EMBED_CACHE_TTL = 24 * 3600  # 秒
+QUERY_EMBED_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# --- Chunk embedding cache (on disk) ---
+DOC_EMBED_CACHE_ENABLED = True
+DOC_EMBED_CACHE_DIR = "/NAS/caizj/project/Awesome-MRAG/dataset/embedding_cache"
+
+# --- Semantic answer cache ---
+SEMANTIC_CACHE_ENABLED = False
+SEMANTIC_CACHE_THRESHOLD = 0.95  # query向量余弦相似度阈值
+SEMANTIC_CACHE_MAX_ENTRIES = 10000
+SEMANTIC_CACHE_TTL = 3600  # 秒
+KB_VERSION_CHECK_INTERVAL = 5.0  # 秒，检查知识库版本的最小间隔
+
+# --- Ingestion ---
+INGEST_WORKERS = os.cpu_count() or 1  # PDF解析进程数，<=1时串行解析
+INGEST_MAX_PENDING_FILES = 2 * INGEST_WORKERS  # 最多同时在途（解析中/待Embedding）的文件数
+INGEST_EMBED_BATCH_SIZE = 256  # 每次Embedding并写入Milvus的Chunk数
+INGEST_PROGRESS_INTERVAL = 10.0  # 秒，构建进度输出间隔
+INGEST_BATCH_RETRIES = 3  # 单个batch写入失败后的重试次数
+INGEST_RETRY_BACKOFF = 1.0  # 秒，重试退避基数（指数增长）
+INGEST_CHECKPOINT_PATH = "/NAS/caizj/project/Awesome-MRAG/dataset/milvus/ingest_checkpoint.jsonl"
+INGEST_MANIFEST_PATH = "/NAS/caizj/project/Awesome-MRAG/dataset/milvus/ingest_manifest.json"  # 文件hash、mtime与Chunk主键
+UPDATE_DELETE_SOURCE_FILES = True  # 增量更新成功后删除UNUPDATED_DATA_PATH中的源文件
+
 # --- FastAPI ---
 API_HOST = "0.0.0.0"
 API_PORT = 8992
+API_WORKERS = 1  # 大于1时需要EMBEDDING_BACKEND = "remote"，否则每个worker都会加载一份Embedding模型
+# 阻塞操作（Embedding、Milvus检索、MCP调用）线程池大小
+BLOCKING_EXECUTOR_WORKERS = 16
+# /rag/batch：单次请求的最大问题数，以及同时进行的LLM生成数（所有batch请求共享）
+BATCH_MAX_REQUESTS = 256
+BATCH_GENERATION_CONCURRENCY = 8  # /rag/batch同时处理的条目数，应小于WEB_SEARCH_MAX_IN_FLIGHT，否则条目可能因Web搜索已满而跳过
+
+# --- Startup ---
+# 服务启动后在后台初始化，预热（一次本地问答）成功后/readyz才返回200；LLM不可用时按间隔重试预热
+WARMUP_ENABLED = True
+WARMUP_QUERY = "What is a GUI agent?"
+WARMUP_TASK_DESCRIPTION = "Given a search query, retrieve relevant passages that answer the query"
+WARMUP_RETRY_INTERVAL = 5.0
+MCP_RETRY_INTERVAL = 30.0  # MCP初始化失败后的重试间隔，MCP就绪前只使用本地知识回答
+STARTUP_RETRY_BACKOFF = 2.0  # 秒，Embedding/Milvus/chain初始化失败后的重试间隔基数（指数增长）
+STARTUP_RETRY_MAX_INTERVAL = 60.0
+STARTUP_MAX_ATTEMPTS = 5  # 单个启动阶段的最多尝试次数，仍失败时/healthz返回503，由存活探针重启进程
+
+# --- Metrics ---
+METRICS_ENABLED = True  # /metrics（Prometheus格式）和Server-Timing响应头
 
 # --- Document format ---
 SUPPORTED_FORMATS = ['.pdf']
+PDF_PARSER = "pypdfium2"  # pypdfium2 / pypdf，pypdfium2未安装时回退到pypdf
+PDF_PAGE_WORKERS = 1  # 单个大PDF按页分段并行解析的进程数，<=1时逐页串行；并行构建知识库时不再按页并行。
+# 默认串行：2个worker解析100页PDF实测慢于串行（45 vs 466 页/s），多核机器上用bench_pdf_parsing.py确认有收益后再调大
+PDF_PARALLEL_MIN_PAGES = 64  # 页数不少于此值的PDF才按页并行解析，小文件进程调度开销大于收益
 
 # --- MCP Services ---
 ENABLE_WEB_SEARCH = True
+WEB_SEARCH_TIMEOUT = 3.0  # 秒，Web搜索超时后只使用本地文档回答
+WEB_SEARCH_MAX_IN_FLIGHT = 16  # 同时进行的Web搜索上限（独立线程池），达到上限的请求跳过Web搜索（status=busy）
+WEB_SEARCH_CACHE_TTL = 600  # 秒，Web搜索结果缓存时间
+WEB_SEARCH_CACHE_MAX_ENTRIES = 5000
+WEB_SEARCH_CACHE_MAX_BYTES = 64 * 1024 * 1024
+WEB_SEARCH_CACHE_MAX_ENTRY_BYTES = 256 * 1024  # 单条结果超过该大小不缓存
 MCP_CONFIG_PATH = "/NAS/caizj/project/Awesome-MRAG/server/mcp_servers_config.json"
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
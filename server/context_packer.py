@@ -0,0 +1,138 @@
+import threading
+from typing import List, Optional, Tuple
+
+import config
+from langchain_core.documents import Document
+from loguru import logger
+from sparse_index import doc_key
+
+# 相邻Chunk的重叠部分短于该长度时视为巧合（如标点），不做拼接去重
+MIN_STITCH_OVERLAP = 16
+
+
+# 使用推理模型的tokenizer计数；未安装transformers或模型不可用时按字符数估算
+class TokenCounter:
+    def __init__(self, tokenizer_path: Optional[str] = None,
+                 chars_per_token: float = config.CONTEXT_CHARS_PER_TOKEN):
+        self.tokenizer_path = tokenizer_path or config.CONTEXT_TOKENIZER_PATH
+        self.chars_per_token = chars_per_token
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    try:
+                        from transformers import AutoTokenizer
+
+                        self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_path)
+                    except Exception as e:
+                        logger.warning(f"加载tokenizer失败，按字符数估算token: {e}")
+                    self._loaded = True
+        return self._tokenizer
+
+    def count(self, text: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return int(len(text) / self.chars_per_token + 0.999)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is not None:
+            ids = self.tokenizer.encode(text, add_special_tokens=False)
+            return text if len(ids) <= max_tokens else self.tokenizer.decode(ids[:max_tokens])
+        return text[: int(max_tokens * self.chars_per_token)]
+
+
+token_counter = TokenCounter()
+
+
+# 返回b开头与a结尾重叠的字符数，没有足够长的重叠时返回0
+def overlap_length(a: str, b: str, max_overlap: int) -> int:
+    limit = min(len(a), len(b), max_overlap)
+    for length in range(limit, MIN_STITCH_OVERLAP - 1, -1):
+        if a.endswith(b[:length]):
+            return length
+    return 0
+
+
+def canonical_key(doc: Document) -> tuple:
+    chunk_id = doc.metadata.get("chunk_id")
+    return (str(doc.metadata.get("file_name")), chunk_id if isinstance(chunk_id, int) else -1)
+
+
+def _is_adjacent(prev: Document, doc: Document) -> bool:
+    return (
+        prev.metadata.get("file_name") == doc.metadata.get("file_name")
+        and prev.metadata.get("source_location") == doc.metadata.get("source_location")
+        and isinstance(doc.metadata.get("chunk_id"), int)
+        and doc.metadata.get("chunk_id") == prev.metadata.get("chunk_id", -2) + 1
+    )
+
+
+# 去重并把同一页上chunk_id连续的Chunk拼接成段落；段落按其中最靠前的检索排名排序
+def stitch_documents(docs: List[Document], max_overlap: Optional[int] = None) -> List[dict]:
+    max_overlap = max_overlap or config.CHUNK_OVERLAP * 2
+    ranked = {}
+    for rank, doc in enumerate(docs):
+        ranked.setdefault(doc_key(doc.metadata), (rank, doc))
+
+    ordered = sorted(ranked.values(), key=lambda item: canonical_key(item[1]))
+
+    segments = []
+    for rank, doc in ordered:
+        text = doc.page_content.strip()
+        if not text:
+            continue
+        if segments and _is_adjacent(segments[-1]["docs"][-1], doc):
+            segment = segments[-1]
+            if text not in segment["text"]:
+                overlap = overlap_length(segment["text"], text, max_overlap)
+                segment["text"] += text[overlap:] if overlap else "\n" + text
+            segment["docs"].append(doc)
+            segment["rank"] = min(segment["rank"], rank)
+            continue
+        segments.append({"text": text, "docs": [doc], "rank": rank})
+
+    segments.sort(key=lambda segment: segment["rank"])
+    return segments
+
+
+# 按顺序把段落装入token预算；放不下的段落在剩余预算足够时截断，否则跳过
+# canonical_order=True时按相关性选出段落后再按(file_name, chunk_id)排列，相同文档集合得到相同的上下文
+def pack_context(docs: List[Document], token_budget: Optional[int] = None,
+                 counter: Optional[TokenCounter] = None,
+                 canonical_order: bool = False) -> Tuple[List[str], dict]:
+    token_budget = token_budget or config.CONTEXT_TOKEN_BUDGET
+    counter = counter or token_counter
+    segments = stitch_documents(docs)
+
+    packed, used, dropped = [], 0, 0
+    for segment in segments:
+        tokens = counter.count(segment["text"])
+        remaining = token_budget - used
+        if tokens <= remaining:
+            packed.append((segment, segment["text"]))
+            used += tokens
+        elif remaining >= config.CONTEXT_MIN_SEGMENT_TOKENS:
+            packed.append((segment, counter.truncate(segment["text"], remaining)))
+            used = token_budget
+        else:
+            dropped += 1
+
+    if canonical_order:
+        packed.sort(key=lambda item: canonical_key(item[0]["docs"][0]))
+    texts = [text for _, text in packed]
+
+    stats = {
+        "chunks": len(docs),
+        "segments": len(texts),
+        "dropped": dropped,
+        "tokens": used,
+        "budget": token_budget,
+    }
+    return texts, stats
@@ -1,51 +1,173 @@
 import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List
-
-from langchain_community.document_loaders.parsers.pdf import PyPDFium2Parser
+from typing import Iterator, List, Optional, Tuple
 
 import config
-from langchain_community.document_loaders import PyPDFLoader
+from executor import apply_config, process_pool_context
+from ingest_manifest import file_fingerprint
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from loguru import logger
 
 
-class UnifiedDocumentLoader:
+# PDF解析后端：page_count返回页数，iter_pages逐页产出[start, end)范围内的(页序号, 文本)
+class PdfiumParser:
+    name = "pypdfium2"
+
+    def __init__(self):
+        import pypdfium2
+
+        self._pdfium = pypdfium2
+
+    def page_count(self, file_path: str) -> int:
+        pdf = self._pdfium.PdfDocument(file_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    def iter_pages(self, file_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        pdf = self._pdfium.PdfDocument(file_path)
+        try:
+            for i in range(start, len(pdf) if end is None else end):
+                page = pdf[i]
+                text_page = page.get_textpage()
+                try:
+                    yield i, text_page.get_text_range().replace("\r\n", "\n")
+                finally:
+                    text_page.close()
+                    page.close()
+        finally:
+            pdf.close()
+
+
+class PypdfParser:
+    name = "pypdf"
+
     def __init__(self):
+        import pypdf
+
+        self._pypdf = pypdf
+
+    def page_count(self, file_path: str) -> int:
+        return len(self._pypdf.PdfReader(file_path).pages)
+
+    def iter_pages(self, file_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        pages = self._pypdf.PdfReader(file_path).pages
+        for i in range(start, len(pages) if end is None else end):
+            yield i, pages[i].extract_text()
+
+
+PDF_PARSERS = {parser.name: parser for parser in (PdfiumParser, PypdfParser)}
+
+
+# 按名称创建解析后端，pypdfium2不可用时回退到pypdf
+def create_pdf_parser(name: str = None):
+    name = name or config.PDF_PARSER
+    if name not in PDF_PARSERS:
+        raise ValueError(f"不支持的PDF解析后端: {name}，可选: {sorted(PDF_PARSERS)}")
+    try:
+        return PDF_PARSERS[name]()
+    except ImportError:
+        if name == PypdfParser.name:
+            raise
+        logger.warning(f"PDF解析后端 {name} 不可用，回退到pypdf")
+        return PypdfParser()
+
+
+# 进程池中执行：解析一段页范围，返回(页序号, 文本)列表
+def _parse_page_range(parser_name: str, file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    return list(create_pdf_parser(parser_name).iter_pages(file_path, start, end))
+
+
+# 按页并行解析共用一个长期存在的进程池，每个大PDF都新建进程池时，forkserver启动worker的开销远大于解析本身
+_page_pool: Optional[ProcessPoolExecutor] = None
+_page_pool_workers = 0
+_page_pool_lock = threading.Lock()
+
+
+def _get_page_pool(workers: int) -> ProcessPoolExecutor:
+    global _page_pool, _page_pool_workers
+    with _page_pool_lock:
+        if _page_pool is None or _page_pool_workers < workers:
+            if _page_pool is not None:
+                _page_pool.shutdown(wait=False)
+            _page_pool = ProcessPoolExecutor(max_workers=workers, mp_context=process_pool_context())
+            _page_pool_workers = workers
+        return _page_pool
+
+
+class UnifiedDocumentLoader:
+    # page_workers: 单个大PDF按页并行解析的进程数，在进程池worker中使用时应为1
+    def __init__(self, parser: str = None, page_workers: int = None):
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=config.CHUNK_SIZE, chunk_overlap=config.CHUNK_OVERLAP
         )
-
-    def load_pdf(self, file_path: str) -> List[Document]:
-        loader = PyPDFLoader(file_path)
-        pages = loader.load()
-
-        PDFs = []
-        for i, page in enumerate(pages):
-            doc = Document(
-                page_content=page.page_content,
+        self.parser = create_pdf_parser(parser)
+        self.page_workers = config.PDF_PAGE_WORKERS if page_workers is None else page_workers
+
+    # 逐页产出(页序号, 文本)：page_workers>1且页数达到PDF_PARALLEL_MIN_PAGES时按页范围分段交给多个进程解析，按页顺序产出
+    # 服务进程中已有gRPC/Embedding线程，使用forkserver/spawn启动解析进程，不直接fork
+    def _iter_pdf_pages(self, file_path: str) -> Iterator[Tuple[int, str]]:
+        num_pages = self.parser.page_count(file_path)
+        if self.page_workers <= 1 or num_pages < config.PDF_PARALLEL_MIN_PAGES:
+            yield from self.parser.iter_pages(file_path, 0, num_pages)
+            return
+
+        workers = min(self.page_workers, num_pages)
+        span = -(-num_pages // (4 * workers))  # 每个进程约4段，页数不均时负载更平衡
+        ranges = [(start, min(start + span, num_pages)) for start in range(0, num_pages, span)]
+        # 最多workers段在途，每段完成后按顺序产出并补交下一段：解析进度不会远超消费者，已解析的页面不在内存中堆积
+        pool = _get_page_pool(workers)
+        pending = deque()
+        try:
+            for start, end in ranges:
+                if len(pending) >= workers:
+                    yield from pending.popleft().result()
+                pending.append(pool.submit(_parse_page_range, self.parser.name, file_path, start, end))
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    # 逐页产出页面级Document，不在内存中保留整个PDF的页面列表
+    def lazy_load_pdf(self, file_path: str) -> Iterator[Document]:
+        file_name = os.path.basename(file_path)
+        num_pages = 0
+        for i, text in self._iter_pdf_pages(file_path):
+            num_pages += 1
+            yield Document(
+                page_content=text,
                 metadata={
-                    "file_name": os.path.basename(file_path),
+                    "file_name": file_name,
                     "source_location": f"第{i + 1}页",
+                    "page": i + 1,  # 页码，供检索时按页码范围过滤
                     "minio_id": 444,
                 },
             )
-            PDFs.append(doc)
 
-        logger.info(f"成功提取PDF文档 {os.path.basename(file_path)} - {len(pages)} 页")
-        return PDFs
+        logger.info(f"成功提取PDF文档 {file_name} - {num_pages} 页（{self.parser.name}）")
 
-    def load_document(self, file_path: str) -> List[Document]:
+    def load_pdf(self, file_path: str) -> List[Document]:
+        return list(self.lazy_load_pdf(file_path))
+
+    def lazy_load_document(self, file_path: str) -> Iterator[Document]:
         extension = Path(file_path).suffix.lower()
 
         if extension == ".pdf":
-            return self.load_pdf(file_path)
+            return self.lazy_load_pdf(file_path)
         else:
             raise ValueError(f"不支持的文件格式: {extension}")
 
-    def _load_directory(self, directory_path: str) -> List[Document]:
-        all_documents = []
+    def load_document(self, file_path: str) -> List[Document]:
+        return list(self.lazy_load_document(file_path))
+
+    # 逐个文件流式加载，单个文件解析出错时记录日志并跳过该文件剩余的页面
+    def _lazy_load_directory(self, directory_path: str) -> Iterator[Document]:
         directory = Path(directory_path)
 
         for file_path in directory.rglob("*"):
@@ -54,25 +176,24 @@ class UnifiedDocumentLoader:
                 and file_path.suffix.lower() in config.SUPPORTED_FORMATS
             ):
                 try:
-                    documents = self.load_document(str(file_path))
-                    all_documents.extend(documents)
+                    yield from self.lazy_load_document(str(file_path))
                 except Exception as e:
                     logger.error(f"处理文件 {file_path} 时出错: {e}")
 
-        return all_documents
-
     # 主要函数，输入文件/文件夹地址，统一返回Chunk级Document对象
     def load_and_split_documents(self, input_path: str) -> List[Document]:
-        # 1.加载文件，得到页面级Document对象
+        # 1.加载文件，逐个得到页面级Document对象
         if os.path.isfile(input_path):
-            documents = self.load_document(input_path)
+            documents = self.lazy_load_document(input_path)
         elif os.path.isdir(input_path):
-            documents = self._load_directory(input_path)
+            documents = self._lazy_load_directory(input_path)
         else:
             raise ValueError(f"输入路径不存在: {input_path}")
 
-        # 2. 分割文件，得到Chunk级Document对象
-        splits = self.text_splitter.split_documents(documents)
+        # 2. 逐页分割，得到Chunk级Document对象；分割器对每个页面独立切分，结果与整体分割一致
+        splits = []
+        for document in documents:
+            splits.extend(self.text_splitter.split_documents([document]))
 
         # 3. 对Chunk添加相关信息
         for i, split in enumerate(splits):
@@ -81,3 +202,23 @@ class UnifiedDocumentLoader:
 
         logger.info(f"文档被分割成 {len(splits)} 个文本块")
         return splits
+
+
+# ---------- 知识库构建的解析进程池 ----------
+# worker函数放在本模块而不是vector_manager中：forkserver只需预先导入解析相关的轻量模块，不导入Milvus客户端
+_worker_loader = None
+
+# 解析worker需要与父进程一致的配置项
+PARSE_WORKER_CONFIG = ("CHUNK_SIZE", "CHUNK_OVERLAP", "PDF_PARSER")
+
+
+# 进程池worker中不再按页并行解析（page_workers=1），避免嵌套进程池使进程数超过CPU核数
+def init_parse_worker(page_workers: int = None, settings: dict = None):
+    global _worker_loader
+    apply_config(settings or {})
+    _worker_loader = UnifiedDocumentLoader(page_workers=page_workers)
+
+
+# 进程池中执行：计算文件指纹，加载PDF并分割成Chunk级Document对象
+def load_and_split_file(file_path: str) -> Tuple[dict, List[Document]]:
+    return file_fingerprint(file_path), _worker_loader.load_and_split_documents(file_path)
@@ -0,0 +1,105 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+from loguru import logger
+
+
+# 动态微批：把并发到达的单条query embedding请求攒成一个batch，一次调用model.embed
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+    ):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._batch_size_histogram = {}
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._backlogged = False  # 上一个batch执行期间是否有新请求到达
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def _collect_batch(self) -> list:
+        # 1. 阻塞等待第一条请求，从它入队开始计时窗口
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+
+        # 上一个batch执行期间没有新请求到达（空闲或串行调用）且队列为空时立即发出，不等满窗口；
+        # 并发请求在batch执行期间积压时才按窗口攒批
+        if not self._backlogged and self._queue.empty():
+            return batch
+
+        # 2. 在窗口内继续收集，直到达到max_batch_size；窗口已过期时仍取走队列中已积压的请求
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            dispatched_at = time.perf_counter()
+            self._record(batch, dispatched_at)
+
+            texts = [text for text, _, _ in batch]
+            try:
+                embeddings = self.embed_fn(texts)
+                # 返回数量不一致时zip会丢掉多余的future，其调用方将永远阻塞
+                if len(embeddings) != len(batch):
+                    raise ValueError(f"embed_fn返回了{len(embeddings)}个向量，输入为{len(batch)}条")
+            except Exception as e:
+                logger.error(f"批量Embedding失败 (batch_size={len(batch)}): {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                self._backlogged = not self._queue.empty()
+
+            for (_, future, _), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    def _record(self, batch: list, dispatched_at: float):
+        waits = [dispatched_at - enqueued_at for _, _, enqueued_at in batch]
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            size = len(batch)
+            self._batch_size_histogram[size] = self._batch_size_histogram.get(size, 0) + 1
+            self._total_wait += sum(waits)
+            self._max_wait_seen = max(self._max_wait_seen, max(waits))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "batches": self._batches,
+                "requests": self._requests,
+                "avg_batch_size": round(self._requests / self._batches, 2) if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_size_histogram.items())),
+                "avg_queue_wait_ms": round(self._total_wait / self._requests * 1000, 3) if self._requests else 0.0,
+                "max_queue_wait_ms": round(self._max_wait_seen * 1000, 3),
+                "queue_depth": self._queue.qsize(),
+            }
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+KEY_BYTES = 16
+
+
+# 按内容寻址的Chunk向量缓存：key = hash(Embedding模型路径, Chunk文本)
+# vectors.f32为内存映射的float32矩阵（追加写入），keys.bin按相同顺序保存每一行的key
+class PersistentEmbeddingCache:
+    def __init__(self, directory, model_name: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.model_name = model_name
+        self._meta_path = self.directory / "meta.json"
+        self._keys_path = self.directory / "keys.bin"
+        self._vectors_path = self.directory / "vectors.f32"
+        self._lock = threading.Lock()
+        self.dim: Optional[int] = None
+        self._index: Dict[bytes, int] = {}
+        self._rows = 0  # 已提交的行数，新行从这里开始编号
+        self._matrix: Optional[np.memmap] = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not self._meta_path.exists():
+            return
+        meta = json.loads(self._meta_path.read_text(encoding="utf-8"))
+        if meta.get("model_name") != self.model_name:
+            logger.warning(f"Embedding cache was built by {meta.get('model_name')}, rebuilding for {self.model_name}")
+            self._reset()
+            return
+        self.dim = meta["dim"]
+        # 按uint8逐行读取：S dtype会去掉末尾的NUL字节，以\0结尾的key重启后再也无法命中；中断时写了一半的key不读入
+        key_rows = self._keys_path.stat().st_size // KEY_BYTES if self._keys_path.exists() else 0
+        keys = np.zeros((0, KEY_BYTES), dtype=np.uint8)
+        if key_rows:
+            keys = np.fromfile(self._keys_path, dtype=np.uint8, count=key_rows * KEY_BYTES).reshape(-1, KEY_BYTES)
+        vector_rows = self._vectors_path.stat().st_size // (4 * self.dim) if self._vectors_path.exists() else 0
+
+        # 写入顺序为先向量后key，中断时以两者中较少的行数为准，并截断多余的行，之后的追加从该行数开始
+        rows = min(len(keys), vector_rows)
+        for path, row_bytes in ((self._vectors_path, 4 * self.dim), (self._keys_path, KEY_BYTES)):
+            with open(path, "ab") as f:
+                f.truncate(rows * row_bytes)
+        self._index = {key.tobytes(): row for row, key in enumerate(keys[:rows])}
+        self._rows = rows
+        self._remap(rows)
+
+    # 模型或向量维度与缓存不一致时清空缓存重新写入
+    def _reset(self):
+        self._matrix = None
+        for path in (self._meta_path, self._keys_path, self._vectors_path):
+            path.unlink(missing_ok=True)
+        self.dim = None
+        self._index = {}
+        self._rows = 0
+
+    def _remap(self, rows: int):
+        self._matrix = (
+            np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim)) if rows else None
+        )
+
+    def key(self, text: str) -> bytes:
+        digest = hashlib.sha256()
+        digest.update(self.model_name.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.digest()[:KEY_BYTES]
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        with self._lock:
+            rows = [self._index.get(key) for key in keys]
+            hits = sum(row is not None for row in rows)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            return [self._matrix[row] if row is not None else None for row in rows]
+
+    def put_many(self, keys: List[bytes], vectors: List[List[float]]):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is not None and matrix.shape[1] != self.dim:
+                logger.warning(f"Embedding dim changed ({self.dim} -> {matrix.shape[1]}), rebuilding the cache")
+                self._reset()
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+                self._meta_path.write_text(
+                    json.dumps({"dim": self.dim, "model_name": self.model_name}), encoding="utf-8"
+                )
+
+            fresh = list({key: i for i, key in enumerate(keys) if key not in self._index}.values())
+            if not fresh:
+                return
+            with open(self._vectors_path, "ab") as f:
+                f.write(matrix[fresh].tobytes())
+            with open(self._keys_path, "ab") as f:
+                f.write(b"".join(keys[i] for i in fresh))
+
+            for offset, i in enumerate(fresh):
+                self._index[keys[i]] = self._rows + offset
+            self._rows += len(fresh)
+            self._remap(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": len(self._index) * (self.dim or 0) * 4,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,61 @@
+import asyncio
+import contextvars
+import multiprocessing
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
+import config
+
+# 有界线程池：Embedding、Milvus检索、MCP调用等阻塞操作统一放到这里执行，避免阻塞uvicorn事件循环
+blocking_executor = ThreadPoolExecutor(
+    max_workers=config.BLOCKING_EXECUTOR_WORKERS,
+    thread_name_prefix="rag-blocking",
+)
+
+
+# run_in_executor不会传递contextvars，这里显式复制，线程中记录的阶段耗时才能归属到当前请求
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(blocking_executor, partial(context.run, func, *args, **kwargs))
+
+
+# Web搜索使用独立线程池：超时的MCP调用无法中断，会一直占用线程直到返回，不能因此拖慢本地检索
+# 线程数等于在途上限，达到上限时直接跳过而不是排队，排队的搜索在轮到时早已超过deadline
+web_search_executor = ThreadPoolExecutor(
+    max_workers=config.WEB_SEARCH_MAX_IN_FLIGHT,
+    thread_name_prefix="rag-web-search",
+)
+_web_search_slots = threading.BoundedSemaphore(config.WEB_SEARCH_MAX_IN_FLIGHT)
+
+
+# 提交一次Web搜索，在途搜索已达WEB_SEARCH_MAX_IN_FLIGHT时返回None
+def submit_web_search(func, *args) -> Optional[Future]:
+    if not _web_search_slots.acquire(blocking=False):
+        return None
+    context = contextvars.copy_context()
+    future = web_search_executor.submit(context.run, func, *args)
+    future.add_done_callback(lambda _: _web_search_slots.release())
+    return future
+
+
+# 进程池的启动方式：父进程中已有gRPC连接、Embedding模型和后台线程，fork会复制这些状态，可能死锁。
+# 使用forkserver（不支持的平台用spawn）从干净的进程创建worker；forkserver预先导入解析相关模块，新worker无需重复导入
+def process_pool_context():
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["document_processor"])
+    return context
+
+
+# 子进程不继承父进程运行时修改的config，需要的配置项随进程池initializer传入
+def config_snapshot(names) -> dict:
+    return {name: getattr(config, name) for name in names}
+
+
+def apply_config(values: dict):
+    for name, value in values.items():
+        setattr(config, name, value)
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+import config
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from loguru import logger
+from pydantic import PrivateAttr
+from metadata_filter import MetadataFilter
+from sparse_index import doc_key
+
+# 稀疏检索使用独立线程池：检索本身已在blocking_executor中执行，复用同一个池可能互相等待导致死锁
+sparse_executor = ThreadPoolExecutor(
+    max_workers=config.HYBRID_SPARSE_WORKERS, thread_name_prefix="rag-sparse"
+)
+
+
+# Qwen3 Embedding的query带有Instruct前缀，BM25只使用Query部分
+def strip_instruct(query: str) -> str:
+    marker = "\nQuery: "
+    return query.split(marker, 1)[1] if marker in query else query
+
+
+# Reciprocal Rank Fusion：score = Σ 1 / (rrf_k + rank)
+def reciprocal_rank_fusion(ranked_lists: List[List[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    scores = {}
+    documents = {}
+    for ranked in ranked_lists:
+        for rank, document in enumerate(ranked, start=1):
+            key = doc_key(document.metadata)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(key, document)
+
+    fused = []
+    for key in sorted(scores, key=scores.get, reverse=True)[:k]:
+        document = documents[key]
+        document.metadata["rrf_score"] = round(scores[key], 6)
+        fused.append(document)
+    return fused
+
+
+# 混合检索：Milvus稠密检索与BM25稀疏检索并行执行，结果按RRF融合
+class HybridRetriever(BaseRetriever):
+    dense_retriever: BaseRetriever
+    sparse_index: Any  # BM25Index
+    k: int = 5
+    sparse_k: int = 20
+    rrf_k: int = 60
+    version_fn: Optional[Callable[[], str]] = None  # 知识库版本，变化时从磁盘重新加载BM25索引
+    version_check_interval: float = 5.0
+
+    _version: Optional[str] = PrivateAttr(default=None)
+    _version_checked_at: float = PrivateAttr(default=0.0)
+    _reload_lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def model_post_init(self, __context: Any) -> None:
+        if self.version_fn is not None:
+            self._version = self.version_fn()
+            self._version_checked_at = time.monotonic()
+
+    # 增量更新知识库后kb_version变化，重新加载BM25索引，否则已删除的文件仍会命中、新文件检索不到
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check_interval:
+            return
+        with self._reload_lock:
+            if now - self._version_checked_at < self.version_check_interval:
+                return
+            self._version_checked_at = now
+            version = self.version_fn()
+            if version != self._version:
+                # 旧索引关闭docs文件句柄：文件可能已被更新进程删除，不关闭会一直占用描述符和磁盘空间；
+                # 正在进行的检索读取的是自己dup的描述符，不受影响
+                previous, self.sparse_index = self.sparse_index, self.sparse_index.reload()
+                previous.close()
+                self._version = version
+                logger.info(f"知识库版本变化，已重新加载BM25索引 ({len(self.sparse_index)} 个Chunk)")
+
+    def _sparse_search(self, query: str, metadata_filter: MetadataFilter = None) -> List[Document]:
+        self._check_version()
+        hits = self.sparse_index.search(strip_instruct(query), self.sparse_k, metadata_filter)
+        return [document for document, _ in hits]
+
+    # 稠密检索结果已由外部给出时（如/rag/batch的多向量检索），只补充稀疏检索并融合
+    def fuse(self, query: str, dense_docs: List[Document], metadata_filter: MetadataFilter = None) -> List[Document]:
+        return reciprocal_rank_fusion([dense_docs, self._sparse_search(query, metadata_filter)], self.k, self.rrf_k)
+
+    # kwargs中的metadata_filter同时作用于两路检索：稠密检索由向量库在检索中过滤，稀疏检索在取top-k前过滤
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun, **kwargs: Any
+    ) -> List[Document]:
+        sparse_future = sparse_executor.submit(self._sparse_search, query, kwargs.get("metadata_filter"))
+        dense_docs = self.dense_retriever.invoke(query, **kwargs)
+        return reciprocal_rank_fusion([dense_docs, sparse_future.result()], self.k, self.rrf_k)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun, **kwargs: Any
+    ) -> List[Document]:
+        loop = asyncio.get_running_loop()
+        sparse_docs, dense_docs = await asyncio.gather(
+            loop.run_in_executor(sparse_executor, self._sparse_search, query, kwargs.get("metadata_filter")),
+            self.dense_retriever.ainvoke(query, **kwargs),
+        )
+        return reciprocal_rank_fusion([dense_docs, sparse_docs], self.k, self.rrf_k)
@@ -0,0 +1,53 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+def file_sha256(file_path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path) -> dict:
+    stat = os.stat(file_path)
+    return {"sha256": file_sha256(file_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+# 入库清单：file_name -> {sha256, size, mtime_ns, pks}，用于增量更新时判断文件是否变化以及删除旧Chunk
+class IngestManifest:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries: Dict[str, dict] = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def get(self, file_name: str) -> Optional[dict]:
+        return self.entries.get(file_name)
+
+    def set(self, file_name: str, fingerprint: dict, pks: List):
+        self.entries[file_name] = {**fingerprint, "pks": list(pks)}
+
+    def remove(self, file_name: str):
+        self.entries.pop(file_name, None)
+
+    def clear(self):
+        self.entries = {}
+
+    # size和mtime都未变化时认为文件未修改，无需读取文件计算hash
+    def is_unchanged_by_stat(self, file_name: str, stat: os.stat_result) -> bool:
+        entry = self.entries.get(file_name)
+        return bool(entry) and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+    def save(self):
+        # 先写临时文件再原子替换，避免中断时清单损坏
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
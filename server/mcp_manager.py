@@ -1,17 +1,43 @@
 import json
+import re
+import threading
 from typing import Optional
 
 import config
+from cache import LRUTTLCache, SingleFlight
 from loguru import logger
+from metrics import stage
 from mcpstore import MCPStore
 
 
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().casefold()
+
+
+def _text_size(obj) -> int:
+    return len(str(obj).encode("utf-8"))
+
+
 class MCPManager:
     
     def __init__(self):
         self.store = None
         self.web_search_tool = None
-        
+        # Web搜索结果缓存：key为归一化后的query，过期时间WEB_SEARCH_CACHE_TTL
+        self.search_cache = LRUTTLCache(
+            max_entries=config.WEB_SEARCH_CACHE_MAX_ENTRIES,
+            ttl=config.WEB_SEARCH_CACHE_TTL,
+            max_bytes=config.WEB_SEARCH_CACHE_MAX_BYTES,
+            max_entry_bytes=config.WEB_SEARCH_CACHE_MAX_ENTRY_BYTES,
+            sizeof=_text_size,
+        )
+        # 相同query的并发请求共享同一次远程调用
+        self._single_flight = SingleFlight()
+        self._stats_lock = threading.Lock()
+        self.remote_calls = 0
+        self.coalesced = 0
+        self.errors = 0
+
     def initialize(self):
         try:
             with open(config.MCP_CONFIG_PATH, 'r', encoding='utf-8') as f:
@@ -61,19 +87,52 @@ class MCPManager:
     def web_search(self, query: str) -> Optional[str]:
         if not self.web_search_tool:
             return None
-        
+
+        with stage("web_search"):
+            # 1. 先查缓存
+            key = normalize_query(query)
+            cached = self.search_cache.get(key)
+            if cached is not None:
+                return cached
+
+            # 2. 缓存未命中，相同key的并发请求只发起一次远程调用
+            result, shared = self._single_flight.do(key, lambda: self._remote_search(key, query))
+            if shared:
+                with self._stats_lock:
+                    self.coalesced += 1
+            return result
+
+    def _remote_search(self, key: str, query: str) -> Optional[str]:
+        with self._stats_lock:
+            self.remote_calls += 1
         try:
             # 1. bailian官网上指定所需的参数
-            result = self.web_search_tool.invoke({
-                "query": query,
-                "count": 1, # 只检索一个
-                "ctx": ""
-            })
+            with stage("mcp_call"):
+                result = self.web_search_tool.invoke({
+                    "query": query,
+                    "count": 1, # 只检索一个
+                    "ctx": ""
+                })
             logger.info(f"Web搜索成功: {query[:50]}...")
-            return result
         except Exception as e:
+            with self._stats_lock:
+                self.errors += 1
             logger.error(f"Web搜索失败: {e}")
             return None
 
+        # 2. 只缓存非空结果，超过WEB_SEARCH_CACHE_MAX_ENTRY_BYTES的结果不缓存
+        if result:
+            self.search_cache.set(key, result)
+        return result
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            calls = {
+                "remote_calls": self.remote_calls,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+            }
+        return {**calls, "cache": self.search_cache.stats()}
+
 
 MCP_Service = MCPManager()
\ No newline at end of file
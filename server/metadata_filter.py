@@ -0,0 +1,113 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import config
+
+MAX_FILTER_VALUES = 1000
+MAX_STRING_LENGTH = 512
+
+
+class FilterError(ValueError):
+    pass
+
+
+# Milvus表达式中的字符串字面量：json.dumps负责转义引号和反斜杠
+def quote_expr_value(value: str) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _check_value(field: str, value: Any):
+    kind = config.FILTERABLE_METADATA_FIELDS[field]
+    if kind == "int":
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise FilterError(f"字段 {field} 的值必须是整数: {value!r}")
+    elif not isinstance(value, str) or len(value) > MAX_STRING_LENGTH:
+        raise FilterError(f"字段 {field} 的值必须是长度不超过{MAX_STRING_LENGTH}的字符串: {value!r}")
+    return value
+
+
+# 检索范围的元数据过滤：条件为(字段, 运算符, 值)，字段只能来自FILTERABLE_METADATA_FIELDS白名单，值按字段类型校验，
+# 多个条件之间为and。同一个过滤条件可以编译为Milvus表达式（to_expr）、SQLite条件（to_sql）或逐条判断（matches）
+class MetadataFilter:
+    def __init__(self, conditions: Iterable[Tuple[str, str, Any]]):
+        self.conditions = tuple(conditions)
+
+    @classmethod
+    def build(
+        cls,
+        file_names: Optional[List[str]] = None,
+        page_from: Optional[int] = None,
+        page_to: Optional[int] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> Optional["MetadataFilter"]:
+        conditions = []
+        fields = dict(metadata or {})
+        if file_names is not None:
+            if "file_name" in fields:
+                raise FilterError("file_names与metadata.file_name不能同时指定")
+            fields["file_name"] = file_names
+        for field, value in fields.items():
+            if field not in config.FILTERABLE_METADATA_FIELDS:
+                raise FilterError(f"不支持按字段 {field} 过滤，可用字段: {sorted(config.FILTERABLE_METADATA_FIELDS)}")
+            values = value if isinstance(value, list) else [value]
+            if not values or len(values) > MAX_FILTER_VALUES:
+                raise FilterError(f"字段 {field} 的取值数量必须在1到{MAX_FILTER_VALUES}之间")
+            # 先逐个校验再去重：嵌套的list/dict不可哈希，直接dict.fromkeys会抛出TypeError
+            checked = [_check_value(field, v) for v in values]
+            conditions.append((field, "in", tuple(dict.fromkeys(checked))))
+
+        if page_from is not None:
+            conditions.append(("page", ">=", _check_value("page", page_from)))
+        if page_to is not None:
+            conditions.append(("page", "<=", _check_value("page", page_to)))
+        if page_from is not None and page_to is not None and page_from > page_to:
+            raise FilterError(f"页码范围无效: {page_from} > {page_to}")
+        return cls(conditions) if conditions else None
+
+    @property
+    def fields(self) -> set:
+        return {field for field, _, _ in self.conditions}
+
+    def to_expr(self) -> str:
+        clauses = []
+        for field, op, value in self.conditions:
+            if op == "in":
+                literals = [quote_expr_value(v) if isinstance(v, str) else str(v) for v in value]
+                clauses.append(f"{field} in [{', '.join(literals)}]")
+            else:
+                clauses.append(f"{field} {op} {value}")
+        return " and ".join(clauses)
+
+    # column为字段对应的SQL表达式（如json_extract），值全部以参数传入
+    def to_sql(self, column) -> Tuple[str, list]:
+        clauses, params = [], []
+        for field, op, value in self.conditions:
+            if op == "in":
+                clauses.append(f"{column(field)} IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                clauses.append(f"{column(field)} {op} ?")
+                params.append(value)
+        return " AND ".join(clauses), params
+
+    def matches(self, metadata: dict) -> bool:
+        for field, op, value in self.conditions:
+            actual = metadata.get(field)
+            if op == "in":
+                if actual not in value:
+                    return False
+            elif isinstance(actual, bool) or not isinstance(actual, int):
+                return False
+            elif (op == ">=" and actual < value) or (op == "<=" and actual > value):
+                return False
+        return True
+
+    # 同一批请求按过滤条件分组检索时作为分组key
+    def __hash__(self) -> int:
+        return hash(self.conditions)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, MetadataFilter) and self.conditions == other.conditions
+
+    def __repr__(self) -> str:
+        return f"MetadataFilter({self.to_expr()})"
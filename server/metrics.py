@@ -0,0 +1,268 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import config
+from langchain_core.callbacks import BaseCallbackHandler
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Prometheus文本格式的最小实现：Counter / Gauge / Histogram，按标签值元组分别计数，每个指标一把锁
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每个标签值：[各bucket计数(非累计) + +Inf, sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += counts[-1]
+            labels = _format_labels(self.labelnames, key)
+            inf = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds", "Latency of each RAG pipeline stage.", ("stage",)
+)
+STAGE_ERRORS = Counter("rag_stage_errors_total", "Exceptions raised inside a RAG pipeline stage.", ("stage",))
+REQUEST_SECONDS = Histogram(
+    "rag_request_duration_seconds", "End-to-end HTTP request latency.", ("endpoint", "status")
+)
+REQUESTS_IN_FLIGHT = Gauge("rag_requests_in_flight", "HTTP requests currently being served.", ("endpoint",))
+LLM_IN_FLIGHT = Gauge("rag_llm_requests_in_flight", "LLM generations currently running.")
+LLM_TOKENS = Counter("rag_llm_tokens_total", "Tokens processed by the reasoning model.", ("type",))
+
+# 当前请求的阶段耗时列表[(stage, seconds)]，由MetricsMiddleware创建，用于生成Server-Timing响应头
+_request_timings: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_timings", default=None)
+
+
+def record_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def _stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+@contextmanager
+def _disabled_stage(name: str):
+    yield
+
+
+# 用法：with stage("milvus_search"): ...  METRICS_ENABLED关闭时为空操作
+stage = _stage if config.METRICS_ENABLED else _disabled_stage
+
+
+def server_timing(timings: List[Tuple[str, float]], total: float) -> str:
+    merged: Dict[str, float] = {}
+    for name, seconds in timings:
+        merged[name] = merged.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in merged.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# 纯ASGI中间件（BaseHTTPMiddleware会缓冲流式响应）：统计请求耗时/并发数，并在响应头中写入Server-Timing
+class MetricsMiddleware:
+    def __init__(self, app, endpoints: Sequence[str]):
+        self.app = app
+        self.endpoints = set(endpoints)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = scope["path"] if scope["path"] in self.endpoints else "other"
+        timings = []
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                header = server_timing(timings, time.perf_counter() - start)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", header.encode("latin-1"))
+                ]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, status=status["code"])
+            _request_timings.reset(token)
+
+
+# LLM回调：记录首token时间、生成耗时、token数和并发生成数
+class LLMMetricsCallback(BaseCallbackHandler):
+    run_inline = True  # 在调用方的上下文中同步执行，Server-Timing才能拿到当前请求
+
+    def __init__(self):
+        self._runs: Dict[str, list] = {}  # run_id -> [start, first_token_time]
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._runs[str(run_id)] = [time.perf_counter(), None]
+        LLM_IN_FLIGHT.inc()
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(str(run_id))
+        if run is not None and run[1] is None:
+            run[1] = time.perf_counter()
+            record_stage("llm_ttft", run[1] - run[0])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(str(run_id), None)
+        if run is None:
+            return
+        LLM_IN_FLIGHT.dec()
+        now = time.perf_counter()
+        if run[1] is None:
+            record_stage("llm_ttft", now - run[0])  # 非流式调用：首token即完整结果
+        record_stage("llm_generation", now - run[0])
+
+        usage = _token_usage(response)
+        if usage:
+            LLM_TOKENS.inc(usage[0], type="prompt")
+            LLM_TOKENS.inc(usage[1], type="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        if self._runs.pop(str(run_id), None) is not None:
+            LLM_IN_FLIGHT.dec()
+            STAGE_ERRORS.inc(stage="llm_generation")
+
+
+def _token_usage(response) -> Optional[Tuple[int, int]]:
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    if token_usage:
+        return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+    return None
@@ -0,0 +1,396 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+import config
+from metadata_filter import MetadataFilter
+from metrics import stage
+
+METRICS = ("IP", "COSINE", "L2")
+
+
+# 进程内向量库：vectors.f32为追加写入的float32矩阵（内存映射，只读打开，多个worker进程共享同一份页缓存），
+# norms.f32为每行的平方范数（L2检索用），meta.db（SQLite）保存Chunk文本和元数据，state.json记录已提交的行数
+# 行号即主键pk；删除只写入tombstones表，检索时按掩码跳过
+class MmapVectorStore(VectorStore):
+    def __init__(
+        self,
+        embedding_function: Embeddings,
+        directory,
+        metric: str = "IP",
+        drop_old: bool = False,
+        block_rows: int = 65536,
+        ann_index: Optional["HNSWIndex"] = None,
+    ):
+        if metric not in METRICS:
+            raise ValueError(f"不支持的度量类型: {metric}")
+        self.embedding_function = embedding_function
+        self.directory = Path(directory)
+        self.metric = metric
+        self.block_rows = block_rows
+        self.ann_index = ann_index
+        if drop_old and self.directory.exists():
+            shutil.rmtree(self.directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._state_path = self.directory / "state.json"
+        self._vectors_path = self.directory / "vectors.f32"
+        self._norms_path = self.directory / "norms.f32"
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(self.directory / "meta.db", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks "
+            "(pk INTEGER PRIMARY KEY, file_name TEXT, page_content TEXT, metadata TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS chunks_file_name ON chunks (file_name)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS tombstones (pk INTEGER PRIMARY KEY)")
+        self._db.commit()
+        self.create_scalar_indexes()
+
+        self.dim: Optional[int] = None
+        self.count = 0
+        # (matrix, norms, alive掩码, 有效行数)，整体替换，检索线程拿到的总是一致的快照
+        self._snapshot = (None, None, np.zeros(0, dtype=bool), 0)
+        self._state_stamp = None
+        self._refresh()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    # ---------- 快照 ----------
+    def _stamp(self):
+        try:
+            stat = self._state_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    # 其他进程（知识库构建/更新）提交写入后state.json被替换，检索前按文件戳判断是否需要重新映射
+    # 写入进程自己的HNSW索引已是最新，提交后不需要重新加载（reload_ann=False）
+    def _refresh(self, reload_ann: bool = True):
+        stamp = self._stamp()
+        if stamp == self._state_stamp:
+            return
+        with self._lock:
+            if stamp == self._state_stamp:
+                return
+            state = json.loads(self._state_path.read_text(encoding="utf-8")) if stamp else {"dim": None, "count": 0}
+            self.dim, self.count = state["dim"], state["count"]
+            matrix = norms = None
+            if self.count:
+                matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+                norms = np.memmap(self._norms_path, dtype=np.float32, mode="r", shape=(self.count,))
+            alive = np.ones(self.count, dtype=bool)
+            deleted = [row[0] for row in self._db.execute("SELECT pk FROM tombstones WHERE pk < ?", (self.count,))]
+            alive[deleted] = False
+            self._snapshot = (matrix, norms, alive, int(alive.sum()))
+            if self.ann_index is not None and reload_ann:
+                self.ann_index.load(self.directory, self.dim, self.count)
+            self._state_stamp = stamp
+
+    def _commit_state(self):
+        tmp_path = self._state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"dim": self.dim, "count": self.count}), encoding="utf-8")
+        os.replace(tmp_path, self._state_path)
+        self._refresh(reload_ann=False)
+
+    # 可过滤字段对应的SQL表达式：file_name为独立列，其余字段从metadata JSON中取
+    @staticmethod
+    def _column(field: str) -> str:
+        return "file_name" if field == "file_name" else f"json_extract(metadata, '$.{field}')"
+
+    # 为可过滤字段创建表达式索引，查询中的表达式与索引一致时SQLite才会使用
+    def create_scalar_indexes(self):
+        with self._lock, self._db:
+            for field in config.FILTERABLE_METADATA_FIELDS:
+                if field != "file_name":
+                    self._db.execute(f"CREATE INDEX IF NOT EXISTS chunks_{field} ON chunks ({self._column(field)})")
+
+    def __len__(self) -> int:
+        self._refresh()
+        return self._snapshot[3]
+
+    # ---------- 写入 ----------
+    def _prepare(self, vectors) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        if self.metric == "COSINE":
+            matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        return matrix
+
+    def add_embeddings(
+        self, texts: List[str], embeddings: List[List[float]], metadatas: Optional[List[dict]] = None
+    ) -> List[int]:
+        if not texts:
+            return []
+        matrix = self._prepare(embeddings)
+        metadatas = metadatas or [{} for _ in texts]
+        with self._lock:
+            self._refresh()
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(f"向量维度不一致: {matrix.shape[1]} != {self.dim}")
+
+            # 中断的写入可能在文件尾部留下未提交的行，以state.json的行数为准截断后再追加
+            start = self.count
+            for path, row_bytes in ((self._vectors_path, 4 * self.dim), (self._norms_path, 4)):
+                with open(path, "ab") as f:
+                    f.truncate(start * row_bytes)
+            with open(self._vectors_path, "ab") as f:
+                f.write(matrix.tobytes())
+            with open(self._norms_path, "ab") as f:
+                f.write(np.einsum("ij,ij->i", matrix, matrix).astype(np.float32).tobytes())
+
+            pks = list(range(start, start + len(texts)))
+            with self._db:
+                self._db.execute("DELETE FROM chunks WHERE pk >= ?", (start,))
+                self._db.execute("DELETE FROM tombstones WHERE pk >= ?", (start,))
+                self._db.executemany(
+                    "INSERT INTO chunks (pk, file_name, page_content, metadata) VALUES (?, ?, ?, ?)",
+                    [
+                        (pk, metadata.get("file_name"), text, json.dumps(metadata, ensure_ascii=False))
+                        for pk, text, metadata in zip(pks, texts, metadatas)
+                    ],
+                )
+            if self.ann_index is not None:
+                self.ann_index.add(self.directory, self.metric, self.dim, matrix, pks)
+            self.count = start + len(texts)
+            self._commit_state()
+        return pks
+
+    def add_texts(
+        self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any
+    ) -> List[int]:
+        texts = list(texts)
+        return self.add_embeddings(texts, self.embedding_function.embed_documents(texts), metadatas)
+
+    def delete(self, ids: Optional[List[int]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            with self._db:
+                self._db.executemany("DELETE FROM chunks WHERE pk = ?", [(int(pk),) for pk in ids])
+                self._db.executemany("INSERT OR IGNORE INTO tombstones (pk) VALUES (?)", [(int(pk),) for pk in ids])
+            if self.ann_index is not None:
+                self.ann_index.delete(self.directory, ids)
+            self._commit_state()
+        return True
+
+    def query_file_pks(self, file_names: Iterable[str]) -> Dict[str, list]:
+        pks: Dict[str, list] = {}
+        with self._lock:
+            for file_name in file_names:
+                rows = self._db.execute("SELECT pk FROM chunks WHERE file_name = ?", (file_name,)).fetchall()
+                if rows:
+                    pks[file_name] = [row[0] for row in rows]
+        return pks
+
+    def delete_files(self, file_names: Iterable[str]):
+        pks = [pk for file_pks in self.query_file_pks(file_names).values() for pk in file_pks]
+        self.delete(pks)
+
+    # ---------- 检索 ----------
+    # 满足过滤条件的行号（升序），由SQLite按标量索引查出；已删除的行不在chunks表中，未提交的行按快照行数排除
+    def _filter_rows(self, metadata_filter: MetadataFilter, count: int) -> np.ndarray:
+        clause, params = metadata_filter.to_sql(self._column)
+        with self._lock:
+            rows = self._db.execute(f"SELECT pk FROM chunks WHERE {clause}", params).fetchall()
+        pks = np.sort(np.asarray([row[0] for row in rows], dtype=np.int64))
+        return pks[pks < count]
+
+    # 分块计算 queries @ matrix.T，每块只保留top-k候选，临时内存与知识库规模无关；分数越大越相似（L2为负距离）
+    # 指定candidates时只计算这些行（元数据过滤后的候选），按块取出后与全量扫描走同一套top-k合并
+    def _exact_search(
+        self, snapshot, queries: np.ndarray, k: int, candidates: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        matrix, norms, alive, _ = snapshot
+        total = len(alive) if candidates is None else len(candidates)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, total, self.block_rows):
+            end = min(start + self.block_rows, total)
+            if candidates is None:
+                block_rows, block_alive = np.arange(start, end), alive[start:end]
+                block, block_norms = matrix[start:end], norms[start:end]
+            else:
+                block_rows = candidates[start:end]
+                block_alive = alive[block_rows]
+                block, block_norms = matrix[block_rows], norms[block_rows]
+            scores = queries @ block.T
+            if self.metric == "L2":
+                scores = 2 * scores - block_norms
+            scores[:, ~block_alive] = -np.inf
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(block_rows, (len(queries), end - start))], axis=1)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores, rows = np.take_along_axis(scores, top, axis=1), np.take_along_axis(rows, top, axis=1)
+            best_scores, best_rows = scores, rows
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores, best_rows = np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+        if self.metric == "L2":
+            best_scores = np.einsum("ij,ij->i", queries, queries)[:, None] - best_scores
+        return best_rows, best_scores
+
+    # 有过滤条件时先用SQLite取出候选行，再对候选行做精确检索（候选集通常远小于全库，不走HNSW）
+    def _search(self, vectors, k: int, metadata_filter: MetadataFilter = None) -> List[List[Tuple[int, float]]]:
+        self._refresh()
+        snapshot = self._snapshot
+        queries = self._prepare(vectors)
+        candidates = None
+        if metadata_filter is not None:
+            candidates = self._filter_rows(metadata_filter, len(snapshot[2]))
+            candidates = candidates[snapshot[2][candidates]]
+            k = min(k, len(candidates))
+        k = min(k, snapshot[3])  # k不超过有效行数，结果中不会出现已删除的行
+        if k <= 0:
+            return [[] for _ in queries]
+
+        with stage("mmap_search"):
+            if candidates is None and self.ann_index is not None and self.ann_index.ready:
+                rows, scores = self.ann_index.search(queries, k)
+            else:
+                rows, scores = self._exact_search(snapshot, queries, k, candidates)
+        return [
+            [(int(row), float(score)) for row, score in zip(row_list, score_list)]
+            for row_list, score_list in zip(rows, scores)
+        ]
+
+    def _fetch(self, pks: List[int]) -> Dict[int, Document]:
+        if not pks:
+            return {}
+        placeholders = ",".join("?" * len(pks))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT pk, page_content, metadata FROM chunks WHERE pk IN ({placeholders})", pks
+            ).fetchall()
+        return {
+            pk: Document(page_content=page_content, metadata={"pk": pk, **json.loads(metadata)})
+            for pk, page_content, metadata in rows
+        }
+
+    def search_by_vectors(
+        self, vectors: List[List[float]], k: int, metadata_filter: MetadataFilter = None
+    ) -> List[List[Document]]:
+        return [
+            [document for document, _ in hits]
+            for hits in self.search_with_score_by_vectors(vectors, k, metadata_filter)
+        ]
+
+    def search_with_score_by_vectors(
+        self, vectors: List[List[float]], k: int, metadata_filter: MetadataFilter = None
+    ) -> List[List[Tuple[Document, float]]]:
+        if not len(vectors):
+            return []
+        results = self._search(vectors, k, metadata_filter)
+        documents = self._fetch(sorted({pk for hits in results for pk, _ in hits}))
+        return [[(documents[pk], score) for pk, score in hits if pk in documents] for hits in results]
+
+    # metadata_filter由检索器透传（retriever.invoke(query, metadata_filter=...)）
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, metadata_filter: MetadataFilter = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.search_with_score_by_vectors([embedding], k, metadata_filter)[0]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        directory=None,
+        **kwargs: Any,
+    ) -> "MmapVectorStore":
+        store = cls(embedding, directory, **kwargs)
+        store.add_texts(texts, metadatas)
+        return store
+
+
+# 可选的HNSW近似检索（hnswlib）：索引随写入增量更新并保存为hnsw.bin，各进程加载到自己的内存中
+class HNSWIndex:
+    def __init__(self, m: int = 16, ef_construction: int = 200, ef: int = 64):
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("MMAP_ANN_ENABLED需要hnswlib: pip install hnswlib") from e
+        self._hnswlib = hnswlib
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self.index = None
+        self.metric = None
+
+    @property
+    def ready(self) -> bool:
+        return self.index is not None
+
+    @staticmethod
+    def _path(directory: Path) -> Path:
+        return directory / "hnsw.bin"
+
+    def _space(self, metric: str) -> str:
+        return {"IP": "ip", "COSINE": "ip", "L2": "l2"}[metric]  # COSINE的向量写入前已归一化
+
+    def load(self, directory: Path, dim: Optional[int], count: int):
+        path = self._path(directory)
+        meta_path = directory / "hnsw.json"
+        if not count or not path.exists() or not meta_path.exists():
+            self.index = None
+            return
+        self.metric = json.loads(meta_path.read_text(encoding="utf-8"))["metric"]
+        index = self._hnswlib.Index(space=self._space(self.metric), dim=dim)
+        index.load_index(str(path), max_elements=count)
+        index.set_ef(self.ef)
+        self.index = index
+
+    def add(self, directory: Path, metric: str, dim: int, matrix: np.ndarray, pks: List[int]):
+        if self.index is None:
+            self.metric = metric
+            self.index = self._hnswlib.Index(space=self._space(metric), dim=dim)
+            self.index.init_index(max_elements=max(1024, len(pks)), ef_construction=self.ef_construction, M=self.m)
+            (directory / "hnsw.json").write_text(json.dumps({"metric": metric}), encoding="utf-8")
+        required = self.index.get_current_count() + len(pks)
+        if required > self.index.get_max_elements():
+            self.index.resize_index(max(required, 2 * self.index.get_max_elements()))
+        self.index.add_items(matrix, np.asarray(pks))
+        self.index.save_index(str(self._path(directory)))
+
+    def delete(self, directory: Path, pks: List[int]):
+        if self.index is None:
+            return
+        for pk in pks:
+            try:
+                self.index.mark_deleted(int(pk))
+            except RuntimeError:
+                pass  # 已删除或不存在
+        self.index.save_index(str(self._path(directory)))
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        self.index.set_ef(max(self.ef, k))
+        labels, distances = self.index.knn_query(queries, k=k)
+        if self.metric == "L2":
+            return labels.astype(np.int64), distances  # 平方L2距离，与精确检索一致
+        return labels.astype(np.int64), 1.0 - distances  # hnswlib的ip距离为1 - 内积
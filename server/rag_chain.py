@@ -1,3 +1,7 @@
+import asyncio
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
 import config
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
@@ -5,25 +9,39 @@ from langchain_openai import ChatOpenAI
 from loguru import logger
 from langchain_core.runnables import RunnableLambda
 from langchain_core.documents import Document
+from executor import run_blocking, submit_web_search
+from metrics import LLMMetricsCallback, stage
+from context_packer import canonical_key, pack_context, token_counter
+from reranker import arerank_documents, rerank_documents, rerank_metadata
 
 
 def format_docs(docs):
     return "\n\n".join(doc.page_content for doc in docs)
 
 
-# 组装本地知识和web知识
+# 组装本地知识和web知识；开启CONTEXT_PACKING_ENABLED时按token预算打包，返回(context, 统计信息)
 def build_context(retrieval_result):
     context = []
+    stats = None
 
     local_docs = retrieval_result.get("local_docs", [])
+    canonical_order = config.PROMPT_LAYOUT == "prefix_cache"
     if local_docs:
-        context.append(f"【本地知识库】\n{format_docs(local_docs)}")
+        if config.CONTEXT_PACKING_ENABLED:
+            texts, stats = pack_context(local_docs, canonical_order=canonical_order)
+            context.append("【本地知识库】\n" + "\n\n".join(texts))
+        else:
+            if canonical_order:
+                local_docs = sorted(local_docs, key=canonical_key)
+            context.append(f"【本地知识库】\n{format_docs(local_docs)}")
 
     web_docs = retrieval_result.get("web_docs")
     if web_docs:
+        if config.CONTEXT_PACKING_ENABLED:
+            web_docs = token_counter.truncate(web_docs, config.CONTEXT_WEB_TOKEN_BUDGET)
         context.append(f"【网络搜索】\n{web_docs}")
 
-    return "\n\n---\n\n".join(context) if context else "未找到相关信息"
+    return ("\n\n---\n\n".join(context) if context else "未找到相关信息"), stats
 
 
 def build_sources(retrieval_result):
@@ -48,48 +66,178 @@ def build_sources(retrieval_result):
 
 def create_chat_model():
     return ChatOpenAI(
-        openai_api_base="http://localhost:8888/v1",
+        openai_api_base=config.REASONING_API_BASE,
         api_key="EMPTY",
         model_name=config.REASONING_MODEL_PATH,
         temperature=0.8,
+        stream_usage=True,  # 流式输出时也返回token用量
+        callbacks=[LLMMetricsCallback()] if config.METRICS_ENABLED else None,
     )
 
 
-def retrieve_and_format(retriever, query_data, mcp_service=None):
+def web_search_enabled(mcp_service) -> bool:
+    return bool(config.ENABLE_WEB_SEARCH and mcp_service and mcp_service.web_search_tool)
+
+
+# 请求带有元数据过滤条件时，随retriever.invoke透传到向量库和BM25检索
+def retriever_kwargs(query_data) -> dict:
+    metadata_filter = query_data.get("metadata_filter")
+    return {"metadata_filter": metadata_filter} if metadata_filter is not None else {}
+
+
+def web_search_metadata(status: str, start: float) -> dict:
+    # status: disabled / busy / ok / empty / timeout
+    return {"status": status, "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}
+
 
+# 提交Web搜索，返回(future, 初始状态)：未启用为disabled，在途搜索已满为busy，两者future均为None
+def start_web_search(mcp_service, query: str, start: float):
+    if not web_search_enabled(mcp_service):
+        return None, web_search_metadata("disabled", start)
+    future = submit_web_search(mcp_service.web_search, query)
+    if future is None:
+        logger.warning(f"在途Web搜索已达上限({config.WEB_SEARCH_MAX_IN_FLIGHT})，仅使用本地文档")
+        return None, web_search_metadata("busy", start)
+    return future, None
+
+
+# 本地检索和Web搜索并行执行，Web搜索超过WEB_SEARCH_TIMEOUT则只使用本地文档
+def retrieve_and_format(retriever, query_data, mcp_service=None, reranker=None):
+    start = time.perf_counter()
     query_with_instruct = query_data["query_with_instruct"]
     original_query = query_data["original_query"]
 
-    local_docs = retriever.invoke(query_with_instruct)
+    # 1. 先把Web搜索提交到独立线程池，再在当前线程执行本地检索
+    web_future, web_search = start_web_search(mcp_service, original_query, start)
+
+    with stage("retrieval"):
+        local_docs = retriever.invoke(query_with_instruct, **retriever_kwargs(query_data))
 
+    # 2. 对过量召回的候选重排序，超出时间预算则退回原顺序
+    rerank = rerank_metadata("disabled", start, len(local_docs))
+    if reranker is not None:
+        with stage("rerank"):
+            local_docs, rerank = rerank_documents(reranker, original_query, local_docs, config.RERANK_TOP_K)
+
+    # 3. 在剩余的deadline内等待Web搜索结果
     web_docs = None
-    if config.ENABLE_WEB_SEARCH and mcp_service and mcp_service.web_search_tool:
-        web_docs = mcp_service.web_search(original_query)
+    if web_future is not None:
+        remaining = max(0.0, config.WEB_SEARCH_TIMEOUT - (time.perf_counter() - start))
+        try:
+            web_docs = web_future.result(timeout=remaining)
+            web_search = web_search_metadata("ok" if web_docs else "empty", start)
+        except FutureTimeoutError:
+            web_search = web_search_metadata("timeout", start)
+            logger.warning(f"Web搜索超时({config.WEB_SEARCH_TIMEOUT}s)，仅使用本地文档")
+
+    return {
+        "local_docs": local_docs,
+        "web_docs": web_docs,
+        "question": original_query,
+        "metadata": {"web_search": web_search, "rerank": rerank},
+    }
+
+
+# 异步版本：检索和Web搜索都是阻塞调用，放到有界线程池中并行执行
+# local_docs不为None时跳过本地检索，直接使用给定的候选文档（/rag/batch已批量完成检索）
+async def aretrieve_and_format(retriever, query_data, mcp_service=None, reranker=None, local_docs=None):
+    start = time.perf_counter()
+    query_with_instruct = query_data["query_with_instruct"]
+    original_query = query_data["original_query"]
 
-    return {"local_docs": local_docs, "web_docs": web_docs, "question": original_query}
+    web_future, web_search = start_web_search(mcp_service, original_query, start)
+    web_task = asyncio.wrap_future(web_future) if web_future is not None else None
 
+    if local_docs is None:
+        with stage("retrieval"):
+            local_docs = await run_blocking(retriever.invoke, query_with_instruct, **retriever_kwargs(query_data))
 
-def create_rag_chain(retriever, mcp_service=None):
-    logger.info("Init RAG chain")
+    rerank = rerank_metadata("disabled", start, len(local_docs))
+    if reranker is not None:
+        with stage("rerank"):
+            local_docs, rerank = await arerank_documents(
+                reranker, original_query, local_docs, config.RERANK_TOP_K
+            )
 
-    chat_model = create_chat_model()
-    template = """You are an assistant for question-answering tasks. Use the following pieces of retrieved context to answer the question. If you don't know the answer, just say that you don't know. Use three sentences maximum and keep the answer concise.
+    web_docs = None
+    if web_task is not None:
+        remaining = max(0.0, config.WEB_SEARCH_TIMEOUT - (time.perf_counter() - start))
+        try:
+            web_docs = await asyncio.wait_for(web_task, timeout=remaining)
+            web_search = web_search_metadata("ok" if web_docs else "empty", start)
+        except asyncio.TimeoutError:
+            web_search = web_search_metadata("timeout", start)
+            logger.warning(f"Web搜索超时({config.WEB_SEARCH_TIMEOUT}s)，仅使用本地文档")
+
+    return {
+        "local_docs": local_docs,
+        "web_docs": web_docs,
+        "question": original_query,
+        "metadata": {"web_search": web_search, "rerank": rerank},
+    }
+
+
+def assemble_retrieval(retrieval_result):
+    with stage("context_pack"):
+        context, context_stats = build_context(retrieval_result)
+    metadata = dict(retrieval_result["metadata"])
+    if context_stats is not None:
+        metadata["context"] = context_stats
+    return {
+        "context": context,
+        "question": retrieval_result["question"],
+        "sources": build_sources(retrieval_result),
+        "metadata": metadata,
+    }
+
+
+# 检索阶段：query_data -> {"context", "question", "sources", "metadata"}
+def create_retrieval_chain(retriever, mcp_service=None, reranker=None):
+    # 同时提供同步和异步实现：invoke走retrieve_and_format，ainvoke走aretrieve_and_format
+    async def aretrieve(query_data):
+        return await aretrieve_and_format(retriever, query_data, mcp_service, reranker)
+
+    return RunnableLambda(
+        lambda query_data: retrieve_and_format(retriever, query_data, mcp_service, reranker),
+        afunc=aretrieve,
+    ) | RunnableLambda(assemble_retrieval)
+
+
+PROMPT_TEMPLATES = {
+    "legacy": """You are an assistant for question-answering tasks. Use the following pieces of retrieved context to answer the question. If you don't know the answer, just say that you don't know. Use three sentences maximum and keep the answer concise.
 Question: {question} 
 Context: {context} 
-Answer:"""
+Answer:""",
+    # 指令在前且不含变量，上下文其次，问题最后：命中相同文档的请求共享尽可能长的前缀
+    "prefix_cache": """You are an assistant for question-answering tasks. Use the following pieces of retrieved context to answer the question. If you don't know the answer, just say that you don't know. Use three sentences maximum and keep the answer concise.
+Context: {context}
+Question: {question}
+Answer:""",
+}
+
+
+# 生成阶段：{"context", "question"} -> answer，流式接口直接对该阶段调用astream
+def create_generation_chain(layout=None):
+    chat_model = create_chat_model()
+    template = PROMPT_TEMPLATES[layout or config.PROMPT_LAYOUT]
     prompt = ChatPromptTemplate.from_template(template)
+    return prompt | chat_model | StrOutputParser()
+
+
+def compose_rag_chain(retrieval_chain, generation_chain):
+    return retrieval_chain | {
+        "response": generation_chain,
+        "sources": lambda x: x["sources"],
+        "metadata": lambda x: x["metadata"],
+    }
+
+
+def create_rag_chain(retriever, mcp_service=None, reranker=None):
+    logger.info("Init RAG chain")
 
-    rag_chain = (
-        RunnableLambda(lambda query_data: retrieve_and_format(retriever, query_data, mcp_service))
-        | {
-            "context": lambda x: build_context(x),
-            "question": lambda x: x["question"],
-            "sources": lambda x: build_sources(x),
-        }
-        | {
-            "response": prompt | chat_model | StrOutputParser(),
-            "sources": lambda x: x["sources"],
-        }
+    rag_chain = compose_rag_chain(
+        create_retrieval_chain(retriever, mcp_service, reranker),
+        create_generation_chain(),
     )
 
     logger.info("RAG链创建完成")
@@ -0,0 +1,179 @@
+import asyncio
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import List, Optional, Tuple
+
+import config
+from langchain_core.documents import Document
+from loguru import logger
+from sparse_index import tokenize
+
+# 重排序使用独立线程池：超时后评分线程在批次之间检查取消标记退出，不占用blocking_executor
+rerank_executor = ThreadPoolExecutor(
+    max_workers=config.RERANK_WORKERS, thread_name_prefix="rag-rerank"
+)
+
+
+# 重排序器接口：对一批候选文档打分，分数越高越相关
+# batchable=False表示分数依赖整个候选集合（如以候选集合为语料的IDF），必须一次对全部候选打分
+class Reranker:
+    name = "base"
+    batchable = True
+
+    def score_batch(self, query: str, documents: List[Document]) -> List[float]:
+        raise NotImplementedError
+
+
+# 词法重排序：以候选集合为语料计算BM25，再乘以查询词覆盖率，纯CPU、无需模型
+# IDF和平均长度来自整个候选集合，分批打分时各批分数不可比，因此不分批
+class LexicalReranker(Reranker):
+    name = "lexical"
+    batchable = False
+
+    def __init__(self, k1: float = None, b: float = None):
+        self.k1 = config.BM25_K1 if k1 is None else k1
+        self.b = config.BM25_B if b is None else b
+
+    def score_batch(self, query: str, documents: List[Document]) -> List[float]:
+        query_terms = set(tokenize(query))
+        if not query_terms or not documents:
+            return [0.0] * len(documents)
+
+        doc_terms = [Counter(tokenize(document.page_content)) for document in documents]
+        avg_len = sum(sum(tf.values()) for tf in doc_terms) / len(doc_terms) or 1.0
+        n_docs = len(doc_terms)
+        idf = {}
+        for term in query_terms:
+            df = sum(1 for tf in doc_terms if term in tf)
+            idf[term] = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+
+        scores = []
+        for tf in doc_terms:
+            length = sum(tf.values())
+            score, matched = 0.0, 0
+            for term in query_terms:
+                freq = tf.get(term, 0)
+                if not freq:
+                    continue
+                matched += 1
+                norm = self.k1 * (1.0 - self.b + self.b * length / avg_len)
+                score += idf[term] * freq * (self.k1 + 1.0) / (freq + norm)
+            scores.append(score * matched / len(query_terms))
+        return scores
+
+
+# Cross-Encoder重排序（可选依赖sentence-transformers），默认在CPU上运行
+class CrossEncoderReranker(Reranker):
+    name = "cross_encoder"
+
+    def __init__(self, model_name: str, device: str = "cpu", batch_size: int = 16):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError(
+                "CrossEncoderReranker需要sentence-transformers: pip install sentence-transformers"
+            ) from e
+        self.model = CrossEncoder(model_name, device=device, max_length=512)
+        self.batch_size = batch_size
+
+    def score_batch(self, query: str, documents: List[Document]) -> List[float]:
+        pairs = [(query, document.page_content) for document in documents]
+        return [float(score) for score in self.model.predict(pairs, batch_size=self.batch_size)]
+
+
+def create_reranker(kind: Optional[str] = None) -> Reranker:
+    kind = kind or config.RERANKER_TYPE
+    if kind == "lexical":
+        return LexicalReranker()
+    if kind == "cross_encoder":
+        return CrossEncoderReranker(config.RERANKER_MODEL_PATH, device=config.RERANKER_DEVICE)
+    raise ValueError(f"未知的重排序器类型: {kind}")
+
+
+def rerank_metadata(status: str, start: float, candidates: int) -> dict:
+    # status: disabled / ok / timeout / error
+    return {
+        "status": status,
+        "candidates": candidates,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+def _score_all(reranker: Reranker, query: str, documents: List[Document], batch_size: int,
+               cancelled: threading.Event) -> Optional[List[float]]:
+    if not reranker.batchable:
+        batch_size = len(documents)
+    scores = []
+    for i in range(0, len(documents), batch_size):
+        if cancelled.is_set():
+            return None
+        scores.extend(reranker.score_batch(query, documents[i : i + batch_size]))
+    return scores
+
+
+def _apply_scores(documents: List[Document], scores: List[float], k: int) -> List[Document]:
+    # 稳定排序：同分时保持原检索顺序
+    order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)[:k]
+    ranked = []
+    for i in order:
+        documents[i].metadata["rerank_score"] = round(float(scores[i]), 6)
+        ranked.append(documents[i])
+    return ranked
+
+
+# 一次重排序：提交评分任务，等待结果由同步/异步两个入口各自完成，finish统一处理超时、出错和排序
+# time_budget/batch_size为None时在调用时读取config，运行时修改配置即可生效
+class _RerankJob:
+    def __init__(self, reranker: Reranker, query: str, documents: List[Document], k: int,
+                 time_budget: float = None, batch_size: int = None):
+        self.documents = documents
+        self.k = k
+        self.time_budget = config.RERANK_TIME_BUDGET if time_budget is None else time_budget
+        self.start = time.perf_counter()
+        self.cancelled = threading.Event()
+        self.future = None
+        if len(documents) > 1:
+            batch_size = batch_size or config.RERANK_BATCH_SIZE
+            self.future = rerank_executor.submit(_score_all, reranker, query, documents, batch_size, self.cancelled)
+
+    def finish(self, scores: List[float] = None, error: Exception = None) -> Tuple[List[Document], dict]:
+        documents, k = self.documents, self.k
+        if isinstance(error, (FutureTimeoutError, asyncio.TimeoutError)):
+            self.cancelled.set()
+            logger.warning(f"重排序超时({self.time_budget}s)，使用原检索顺序")
+            return documents[:k], rerank_metadata("timeout", self.start, len(documents))
+        if error is not None:
+            logger.warning(f"重排序失败，使用原检索顺序: {error}")
+            return documents[:k], rerank_metadata("error", self.start, len(documents))
+        if scores is None:
+            return documents[:k], rerank_metadata("ok", self.start, len(documents))
+        return _apply_scores(documents, scores, k), rerank_metadata("ok", self.start, len(documents))
+
+
+# 在time_budget秒内完成重排序，超时或出错时退回原检索顺序的前k个
+def rerank_documents(reranker: Reranker, query: str, documents: List[Document], k: int,
+                     time_budget: float = None, batch_size: int = None) -> Tuple[List[Document], dict]:
+    job = _RerankJob(reranker, query, documents, k, time_budget, batch_size)
+    if job.future is None:
+        return job.finish()
+    try:
+        scores = job.future.result(timeout=job.time_budget)
+    except Exception as e:
+        return job.finish(error=e)
+    return job.finish(scores)
+
+
+async def arerank_documents(reranker: Reranker, query: str, documents: List[Document], k: int,
+                            time_budget: float = None, batch_size: int = None) -> Tuple[List[Document], dict]:
+    job = _RerankJob(reranker, query, documents, k, time_budget, batch_size)
+    if job.future is None:
+        return job.finish()
+    try:
+        scores = await asyncio.wait_for(asyncio.wrap_future(job.future), timeout=job.time_budget)
+    except Exception as e:
+        return job.finish(error=e)
+    return job.finish(scores)
@@ -0,0 +1,125 @@
+import threading
+import time
+from typing import Any, Callable, Optional, Tuple
+
+import numpy as np
+
+
+# 语义回答缓存：query向量与历史query的余弦相似度超过阈值时，直接复用历史回答，不再调用LLM
+class SemanticAnswerCache:
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_entries: int = 10000,
+        ttl: Optional[float] = None,
+        version_fn: Optional[Callable[[], str]] = None,
+        version_check_interval: float = 5.0,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_fn = version_fn  # 知识库版本，变化时清空缓存
+        self.version_check_interval = version_check_interval
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None  # (max_entries, dim)，首次写入时按维度分配
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._expires_at = np.full(max_entries, np.inf)
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._payloads = [None] * max_entries
+        self._clock = 0
+        self._version = version_fn() if version_fn else None
+        self._version_checked_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check_interval:
+            return
+        self._version_checked_at = now
+        version = self.version_fn()
+        if version != self._version:
+            self._version = version
+            self._clear()
+            self.invalidations += 1
+
+    def _best_match(self, vector: np.ndarray) -> Tuple[int, float]:
+        similarities = self._vectors @ vector
+        similarities[~self._valid] = -np.inf
+        best = int(np.argmax(similarities))
+        return best, float(similarities[best])
+
+    def lookup(self, embedding) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            self._check_version()
+            if self._vectors is None or not self._valid.any():
+                self.misses += 1
+                return None
+
+            self._valid &= self._expires_at > time.monotonic()
+            best, similarity = self._best_match(self._normalize(embedding))
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+
+            self._clock += 1
+            self._last_used[best] = self._clock
+            self.hits += 1
+            return self._payloads[best], similarity
+
+    def store(self, embedding, payload: Any):
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._check_version()
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+
+            # 1. 已有近似重复的query时覆盖原条目；否则找空位，没有空位则淘汰最久未使用的条目
+            slot = None
+            if self._valid.any():
+                best, similarity = self._best_match(vector)
+                if similarity >= self.threshold:
+                    slot = best
+            if slot is None:
+                free = np.flatnonzero(~self._valid)
+                if free.size:
+                    slot = int(free[0])
+                else:
+                    slot = int(np.argmin(self._last_used))
+                    self.evictions += 1
+
+            # 2. 写入
+            self._clock += 1
+            self._vectors[slot] = vector
+            self._payloads[slot] = payload
+            self._valid[slot] = True
+            self._expires_at[slot] = time.monotonic() + self.ttl if self.ttl else np.inf
+            self._last_used[slot] = self._clock
+
+    def _clear(self):
+        self._valid[:] = False
+        self._payloads = [None] * self.max_entries
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": int(self._valid.sum()),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "vector_bytes": int(self._vectors.nbytes) if self._vectors is not None else 0,
+            }
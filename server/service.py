@@ -0,0 +1,181 @@
+import asyncio
+from typing import Dict, Optional
+
+import config
+from loguru import logger
+from executor import run_blocking
+from hybrid_retriever import HybridRetriever
+from mcp_manager import MCP_Service
+from rag_chain import (
+    aretrieve_and_format,
+    assemble_retrieval,
+    compose_rag_chain,
+    create_generation_chain,
+    create_retrieval_chain,
+)
+from reranker import create_reranker
+from semantic_cache import SemanticAnswerCache
+from sparse_index import load_sparse_index
+from vector_store import CachedEmbedding, create_embedding_model, load_existing_vector_store, read_kb_version
+
+# 阶段状态：pending / ok / disabled / error: <原因>
+PENDING, OK, DISABLED = "pending", "ok", "disabled"
+
+
+# RAG服务的全部组件，由FastAPI lifespan在后台按阶段初始化：
+# embedding -> vector_store -> chains -> warmup 完成后ready；MCP独立初始化，上线前只用本地知识回答
+class RAGService:
+    def __init__(self):
+        self.ready = False
+        self.failed = False  # 启动阶段重试耗尽，服务无法自行恢复
+        self.stages: Dict[str, str] = {
+            "embedding": PENDING,
+            "vector_store": PENDING,
+            "chains": PENDING,
+            "warmup": PENDING if config.WARMUP_ENABLED else DISABLED,
+            "mcp": PENDING if config.ENABLE_WEB_SEARCH else DISABLED,
+        }
+        self.embedding_model: Optional[CachedEmbedding] = None
+        self.vector_store = None
+        self.retriever = None
+        self.reranker = None
+        self.retriever_top_k = config.RETRIEVER_TOP_K
+        self.dense_top_k = config.RETRIEVER_TOP_K  # /rag/batch多向量检索的返回数，与稠密检索一致
+        # MCP工具就绪前web_search_tool为None，rag_chain会自动跳过Web搜索
+        self.mcp_service = MCP_Service if config.ENABLE_WEB_SEARCH else None
+        self.retrieval_chain = None
+        self.generation_chain = None
+        self.rag_chain = None
+        self.semantic_cache: Optional[SemanticAnswerCache] = None
+        self._tasks = []
+
+    def _init_embedding(self):
+        self.embedding_model = create_embedding_model()
+
+    def _init_vector_store(self):
+        self.vector_store = load_existing_vector_store(self.embedding_model)
+
+        # 开启重排序时检索阶段过量召回RERANK_FETCH_K个候选，由重排序保留RERANK_TOP_K个
+        self.reranker = create_reranker() if config.RERANK_ENABLED else None
+        self.retriever_top_k = config.RERANK_FETCH_K if self.reranker else config.RETRIEVER_TOP_K
+        self.dense_top_k = self.retriever_top_k
+        self.retriever = self.vector_store.as_retriever(search_kwargs={"k": self.retriever_top_k})
+
+        # 混合检索：BM25稀疏索引存在时与Milvus稠密检索并行，结果按RRF融合；知识库更新后按kb_version重新加载BM25索引
+        # 启动时BM25索引为空则只使用稠密检索，构建知识库后需重启服务才会启用混合检索
+        if config.HYBRID_SEARCH_ENABLED:
+            sparse_index = load_sparse_index()
+            if len(sparse_index):
+                self.dense_top_k = max(config.HYBRID_FETCH_K, self.retriever_top_k)
+                self.retriever = HybridRetriever(
+                    dense_retriever=self.vector_store.as_retriever(search_kwargs={"k": self.dense_top_k}),
+                    sparse_index=sparse_index,
+                    k=self.retriever_top_k,
+                    sparse_k=self.dense_top_k,
+                    rrf_k=config.RRF_K,
+                    version_fn=read_kb_version,
+                    version_check_interval=config.KB_VERSION_CHECK_INTERVAL,
+                )
+                logger.info(f"✅ 混合检索已启用 (BM25索引 {len(sparse_index)} 个Chunk)")
+            else:
+                logger.warning("BM25索引为空，仅使用稠密检索")
+
+    def _init_chains(self):
+        # 检索阶段和生成阶段分开保存，流式接口需要先返回sources再流式输出生成结果
+        self.retrieval_chain = create_retrieval_chain(self.retriever, self.mcp_service, self.reranker)
+        self.generation_chain = create_generation_chain()
+        self.rag_chain = compose_rag_chain(self.retrieval_chain, self.generation_chain)
+
+        # 可选的语义回答缓存：近似重复的问题直接复用历史RAGResponse，知识库版本变化时失效
+        if config.SEMANTIC_CACHE_ENABLED:
+            self.semantic_cache = SemanticAnswerCache(
+                threshold=config.SEMANTIC_CACHE_THRESHOLD,
+                max_entries=config.SEMANTIC_CACHE_MAX_ENTRIES,
+                ttl=config.SEMANTIC_CACHE_TTL,
+                version_fn=read_kb_version,
+                version_check_interval=config.KB_VERSION_CHECK_INTERVAL,
+            )
+
+    # 预热：一次只走本地知识的完整问答，覆盖Embedding、Milvus检索和LLM
+    async def _warmup(self):
+        query_data = {
+            "query_with_instruct": self.embedding_model.get_detailed_instruct(
+                task_description=config.WARMUP_TASK_DESCRIPTION, query=config.WARMUP_QUERY
+            ),
+            "original_query": config.WARMUP_QUERY,
+        }
+        retrieval_result = await aretrieve_and_format(self.retriever, query_data, None, self.reranker)
+        retrieved = await run_blocking(assemble_retrieval, retrieval_result)  # 首次打包上下文会加载tokenizer，不在事件循环中执行
+        await self.generation_chain.ainvoke(retrieved)
+
+    # 初始化属于一次性的长耗时阻塞操作，放到默认线程池，不占用处理请求的blocking_executor
+    async def _run_stage(self, name: str, func) -> bool:
+        try:
+            await asyncio.to_thread(func)
+        except Exception as e:
+            self.stages[name] = f"error: {e}"
+            logger.exception(f"启动阶段 {name} 失败")
+            return False
+        self.stages[name] = OK
+        logger.info(f"✅ 启动阶段 {name} 完成")
+        return True
+
+    async def _start_local(self):
+        for name, func in (
+            ("embedding", self._init_embedding),
+            ("vector_store", self._init_vector_store),
+            ("chains", self._init_chains),
+        ):
+            # Milvus、Embedding服务等依赖可能暂时不可用，失败后指数退避重试
+            attempt = 1
+            while not await self._run_stage(name, func):
+                if attempt >= config.STARTUP_MAX_ATTEMPTS:
+                    self.failed = True
+                    logger.error(f"启动阶段 {name} 连续失败{attempt}次，停止重试")
+                    return
+                delay = min(config.STARTUP_RETRY_BACKOFF * 2 ** (attempt - 1), config.STARTUP_RETRY_MAX_INTERVAL)
+                logger.warning(f"启动阶段 {name} 第{attempt}次失败，{delay:.0f}s后重试")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+        # LLM服务可能晚于本服务启动，预热失败时按间隔重试
+        while config.WARMUP_ENABLED:
+            try:
+                await self._warmup()
+                self.stages["warmup"] = OK
+                break
+            except Exception as e:
+                self.stages["warmup"] = f"error: {e}"
+                logger.warning(f"预热失败，{config.WARMUP_RETRY_INTERVAL}s后重试: {e}")
+                await asyncio.sleep(config.WARMUP_RETRY_INTERVAL)
+
+        self.ready = True
+        logger.info("✅ RAG service initialized successfully")
+
+    # MCP的wait_service会阻塞到远端SSE服务就绪，失败时按间隔重试，期间只使用本地知识回答
+    async def _start_mcp(self):
+        while True:
+            try:
+                if await asyncio.to_thread(MCP_Service.initialize) and MCP_Service.web_search_tool:
+                    self.stages["mcp"] = OK
+                    logger.info("✅ MCP服务已启用")
+                    return
+                self.stages["mcp"] = "error: 未找到Web搜索工具"
+            except Exception as e:
+                self.stages["mcp"] = f"error: {e}"
+            logger.warning(f"MCP服务初始化失败，{config.MCP_RETRY_INTERVAL}s后重试")
+            await asyncio.sleep(config.MCP_RETRY_INTERVAL)
+
+    async def start(self):
+        self._tasks.append(asyncio.create_task(self._start_local()))
+        if config.ENABLE_WEB_SEARCH:
+            self._tasks.append(asyncio.create_task(self._start_mcp()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def status(self) -> dict:
+        return {"ready": self.ready, "failed": self.failed, "stages": dict(self.stages)}
@@ -0,0 +1,370 @@
+import json
+import math
+import os
+import re
+import threading
+import uuid
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import config
+import numpy as np
+from langchain_core.documents import Document
+
+from metadata_filter import MetadataFilter
+
+_ASCII_TOKEN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+_CJK_RUN = re.compile(r"[一-鿿]+")
+_WORD_SEP = re.compile(r"[-_.]")
+
+
+# 英文按词切分（带连字符的词同时保留整体和各部分，如agentcpm-gui），中文按字的bigram切分
+def tokenize(text: str) -> List[str]:
+    text = text.lower()
+    tokens = []
+    for word in _ASCII_TOKEN.findall(text):
+        tokens.append(word)
+        if "-" in word or "_" in word or "." in word:  # 大多数词不含分隔符，跳过re.split
+            tokens.extend(_WORD_SEP.split(word))
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def doc_key(metadata: dict) -> str:
+    return f"{metadata.get('file_name')}#{metadata.get('chunk_id')}"
+
+
+# 按偏移读取一行，不改变文件描述符的读写位置，多个线程可以共用同一个描述符
+def _pread_line(fd: int, offset: int, chunk_size: int = 8192) -> bytes:
+    parts = []
+    while True:
+        data = os.pread(fd, chunk_size, offset)
+        end = data.find(b"\n")
+        if end >= 0 or not data:
+            parts.append(data if end < 0 else data[: end + 1])
+            return b"".join(parts)
+        parts.append(data)
+        offset += len(data)
+
+
+# int列中表示字段缺失的值
+_MISSING_INT = -(2 ** 63)
+
+
+# BM25倒排索引：postings为term -> (doc_id数组uint32, tf数组uint16)，落盘为CSR格式的npz + 文档正文sidecar。
+# 内存中只保留词频统计、正文在sidecar中的偏移和可过滤字段的紧凑列（str字段存字符串表下标），
+# 正文和完整元数据追加写入docs-<generation>.jsonl，检索时按偏移读取top-k，内存占用不随正文大小增长
+class BM25Index:
+    def __init__(self, directory, k1: float = 1.5, b: float = 0.75):
+        self.directory = Path(directory)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.doc_len = array("I")
+        self.alive = bytearray()
+        self.doc_offsets = array("Q")  # doc_id -> 正文在docs文件中的字节偏移
+        # file_name列同时用于按文件删除
+        self.fields = {"file_name": "str", **config.FILTERABLE_METADATA_FIELDS}
+        self.columns: Dict[str, array] = {field: array("q") for field in self.fields}
+        self.strings: Dict[str, list] = {field: [None] for field, kind in self.fields.items() if kind == "str"}
+        self._string_ids: Dict[str, dict] = {field: {} for field in self.strings}
+        self._docs_name: Optional[str] = None
+        self._writer = None
+        self._reader = None
+        self._alive_count = 0
+        self._total_len = 0
+
+    @classmethod
+    def load(cls, directory, **kwargs) -> "BM25Index":
+        index = cls(directory, **kwargs)
+        if (index.directory / "index.npz").exists():
+            index._load()
+        return index
+
+    # 从磁盘重新加载一份新索引（知识库更新后使用），当前对象不变，正在进行的检索不受影响
+    def reload(self) -> "BM25Index":
+        return type(self).load(self.directory, k1=self.k1, b=self.b)
+
+    def __len__(self) -> int:
+        return self._alive_count
+
+    def close(self):
+        with self._lock:
+            for f in (self._writer, self._reader):
+                if f is not None:
+                    f.close()
+            self._writer = self._reader = None
+
+    # ---------- 写入 ----------
+    def add_documents(self, documents: Iterable[Document]):
+        with self._lock:
+            writer = self._open_writer()
+            for document in documents:
+                tokens = tokenize(document.page_content)
+                doc_id = len(self.doc_len)
+                for term, tf in Counter(tokens).items():
+                    ids, tfs = self.postings.setdefault(term, (array("I"), array("H")))
+                    ids.append(doc_id)
+                    tfs.append(min(tf, 65535))
+
+                self.doc_offsets.append(writer.tell())
+                record = {"page_content": document.page_content, "metadata": document.metadata}
+                writer.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                for field, column in self.columns.items():
+                    column.append(self._encode(field, document.metadata.get(field)))
+                self.doc_len.append(len(tokens))
+                self.alive.append(1)
+                self._alive_count += 1
+                self._total_len += len(tokens)
+
+    # 删除文件对应的全部Chunk：只打删除标记，save时压缩
+    def remove_file(self, file_name: str):
+        with self._lock:
+            for doc_id in self._file_doc_ids(file_name):
+                if self.alive[doc_id]:
+                    self.alive[doc_id] = 0
+                    self._alive_count -= 1
+                    self._total_len -= self.doc_len[doc_id]
+
+    # 索引中有未删除Chunk的文件名
+    def file_names(self) -> set:
+        with self._lock:
+            column = np.frombuffer(self.columns["file_name"], dtype=np.int64)
+            alive = np.frombuffer(self.alive, dtype=np.uint8, count=len(column)).astype(bool)
+            return {self.strings["file_name"][i] for i in np.unique(column[alive]) if i}
+
+    def clear(self):
+        with self._lock:
+            self.close()
+            self.__init__(self.directory, self.k1, self.b)
+
+    def _file_doc_ids(self, file_name: str) -> np.ndarray:
+        index = self._string_ids["file_name"].get(file_name)
+        if index is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(np.frombuffer(self.columns["file_name"], dtype=np.int64) == index)
+
+    def _encode(self, field: str, value) -> int:
+        if field in self.strings:
+            if value is None:
+                return 0
+            ids = self._string_ids[field]
+            if value not in ids:
+                ids[value] = len(self.strings[field])
+                self.strings[field].append(value)
+            return ids[value]
+        return value if isinstance(value, int) and not isinstance(value, bool) else _MISSING_INT
+
+    def _decode(self, field: str, doc_id: int):
+        value = self.columns[field][doc_id]
+        if field in self.strings:
+            return self.strings[field][value]
+        return None if value == _MISSING_INT else value
+
+    # ---------- 正文读写 ----------
+    # 已加载的docs文件只追加不改写，正在检索的其他进程持有的偏移始终有效；clear和压缩时写入新的docs文件
+    def _open_writer(self):
+        if self._writer is None:
+            if self._docs_name is None:
+                self._docs_name = f"docs-{uuid.uuid4().hex}.jsonl"
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._writer = open(self.directory / self._docs_name, "ab")
+        return self._writer
+
+    def _open_reader(self):
+        if self._writer is not None:
+            self._writer.flush()
+        if self._reader is None:
+            self._reader = open(self.directory / self._docs_name, "rb")
+        return self._reader
+
+    def _read_line(self, doc_id: int) -> bytes:
+        reader = self._open_reader()
+        reader.seek(self.doc_offsets[doc_id])
+        return reader.readline()
+
+    def _read_document(self, doc_id: int) -> Document:
+        record = json.loads(self._read_line(doc_id))
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    # 逐条读取未删除的文档，不一次性加载全部正文
+    def iter_documents(self) -> Iterator[Document]:
+        for doc_id in range(len(self.doc_len)):
+            with self._lock:
+                document = self._read_document(doc_id) if self.alive[doc_id] else None
+            if document is not None:
+                yield document
+
+    # ---------- 检索 ----------
+    # metadata_filter在取top-k之前按字段列过滤候选，保证返回的k条都满足条件。
+    # 锁内只复制查询词的postings、doc_len、alive和过滤字段列，并dup已打开的docs文件描述符，
+    # 打分、过滤和读取正文都在锁外进行，多个线程的检索可以并行。
+    # 按描述符而不是按路径读取：其他进程更新索引后会删除旧docs文件，重新加载前已打开的文件仍可读取
+    def search(self, query: str, k: int = 10, metadata_filter: MetadataFilter = None) -> List[Tuple[Document, float]]:
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self._alive_count:
+                return []
+            num_docs = len(self.doc_len)
+            postings = [
+                (np.frombuffer(p[0], dtype=np.uint32).copy(), np.frombuffer(p[1], dtype=np.uint16).astype(np.float32))
+                for p in map(self.postings.get, terms)
+                if p is not None
+            ]
+            if not postings:
+                return []
+            doc_len = np.frombuffer(self.doc_len, dtype=np.uint32, count=num_docs).astype(np.float32)
+            alive = np.frombuffer(self.alive, dtype=np.uint8, count=num_docs).astype(bool)
+            alive_count, avgdl = self._alive_count, self._total_len / self._alive_count
+            mask = self._filter_mask(metadata_filter, num_docs) if metadata_filter is not None else None
+            doc_offsets = self.doc_offsets  # 压缩时整体替换而非原地修改，锁外按旧偏移读取旧docs文件
+            fd = os.dup(self._open_reader().fileno())
+
+        try:
+            norm = self.k1 * (1 - self.b + self.b * doc_len / avgdl)
+            scores = np.zeros(num_docs, dtype=np.float32)
+            for ids, tfs in postings:
+                idf = math.log(1 + (alive_count - len(ids) + 0.5) / (len(ids) + 0.5))
+                scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norm[ids])
+
+            keep = alive & (scores > 0)
+            if mask is not None:
+                keep &= mask
+            candidates = np.flatnonzero(keep)
+            if candidates.size > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            candidates = candidates[np.argsort(-scores[candidates])]
+            results = []
+            for i in candidates:
+                record = json.loads(_pread_line(fd, doc_offsets[i]))
+                results.append((Document(page_content=record["page_content"], metadata=record["metadata"]), float(scores[i])))
+            return results
+        finally:
+            os.close(fd)
+
+    # 按过滤条件在int64字段列上做向量化比较：str字段先在字符串表中把取值换成下标，不在表中的取值不可能匹配
+    def _filter_mask(self, metadata_filter: MetadataFilter, num_docs: int) -> np.ndarray:
+        mask = np.ones(num_docs, dtype=bool)
+        for field, op, value in metadata_filter.conditions:
+            column = np.frombuffer(self.columns[field], dtype=np.int64, count=num_docs)
+            if op == "in":
+                if field in self.strings:
+                    ids = self._string_ids[field]
+                    value = [ids[v] for v in value if v in ids]
+                mask &= np.isin(column, np.array(value, dtype=np.int64))
+            elif op == ">=":
+                mask &= (column != _MISSING_INT) & (column >= value)
+            elif op == "<=":
+                mask &= (column != _MISSING_INT) & (column <= value)
+        return mask
+
+    # ---------- 持久化 ----------
+    # 全部统计信息写入一个npz后原子替换，docs文件先落盘；替换后删除不再引用的旧docs文件
+    def save(self):
+        with self._lock:
+            self._compact()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if self._writer is not None:
+                self._writer.flush()
+                os.fsync(self._writer.fileno())
+            terms = list(self.postings)
+            lengths = np.array([len(self.postings[t][0]) for t in terms], dtype=np.int64)
+            offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+            doc_ids = np.concatenate([np.frombuffer(self.postings[t][0], dtype=np.uint32) for t in terms]) if terms else np.zeros(0, np.uint32)
+            tfs = np.concatenate([np.frombuffer(self.postings[t][1], dtype=np.uint16) for t in terms]) if terms else np.zeros(0, np.uint16)
+            meta = {"docs_file": self._docs_name, "vocab": terms, "strings": self.strings}
+
+            tmp = self.directory / "index.tmp.npz"
+            np.savez_compressed(
+                tmp,
+                offsets=offsets,
+                doc_ids=doc_ids,
+                tfs=tfs,
+                doc_len=np.frombuffer(self.doc_len, dtype=np.uint32),
+                doc_offsets=np.frombuffer(self.doc_offsets, dtype=np.uint64),
+                meta=np.frombuffer(json.dumps(meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+                **{f"col_{field}": np.frombuffer(column, dtype=np.int64) for field, column in self.columns.items()},
+            )
+            tmp.replace(self.directory / "index.npz")
+            # 其他进程已打开的旧docs文件删除后仍可读取，重新加载索引后切换到新文件
+            for path in self.directory.glob("docs*.jsonl"):
+                if path.name != self._docs_name:
+                    path.unlink(missing_ok=True)
+
+    def _load(self):
+        data = np.load(self.directory / "index.npz")
+        meta = json.loads(data["meta"].tobytes())
+        offsets, doc_ids, tfs = data["offsets"], data["doc_ids"], data["tfs"]
+        for i, term in enumerate(meta["vocab"]):
+            start, end = offsets[i], offsets[i + 1]
+            self.postings[term] = (array("I", doc_ids[start:end].tobytes()), array("H", tfs[start:end].tobytes()))
+        self.doc_len = array("I", data["doc_len"].astype(np.uint32).tobytes())
+        self.doc_offsets = array("Q", data["doc_offsets"].astype(np.uint64).tobytes())
+        self.alive = bytearray([1]) * len(self.doc_len)
+        self._alive_count = len(self.doc_len)
+        self._total_len = int(sum(self.doc_len))
+
+        self._docs_name = meta["docs_file"]
+        if self._docs_name is not None:
+            self._reader = open(self.directory / self._docs_name, "rb")
+        for field, values in meta["strings"].items():
+            if field in self.strings:
+                self.strings[field] = values
+                self._string_ids[field] = {value: i for i, value in enumerate(values) if i}
+        missing = []
+        for field in self.columns:
+            if f"col_{field}" in data.files:
+                self.columns[field] = array("q", data[f"col_{field}"].astype(np.int64).tobytes())
+            else:
+                missing.append(field)
+        # 索引构建后新增的可过滤字段：从docs文件逐条读取元数据补齐该列
+        for doc_id in range(len(self.doc_len) if missing else 0):
+            metadata = json.loads(self._read_line(doc_id))["metadata"]
+            for field in missing:
+                self.columns[field].append(self._encode(field, metadata.get(field)))
+
+    # 去掉已删除的文档并重新编号，未删除文档的正文复制到新的docs文件
+    def _compact(self):
+        if self._alive_count == len(self.doc_len):
+            return
+        remap = np.full(len(self.doc_len), -1, dtype=np.int64)
+        alive_ids = np.flatnonzero(np.frombuffer(self.alive, dtype=np.uint8))
+        remap[alive_ids] = np.arange(len(alive_ids))
+
+        postings = {}
+        for term, (ids, tfs) in self.postings.items():
+            ids_np = np.frombuffer(ids, dtype=np.uint32)
+            keep = remap[ids_np] >= 0
+            if keep.any():
+                postings[term] = (
+                    array("I", remap[ids_np[keep]].astype(np.uint32).tobytes()),
+                    array("H", np.frombuffer(tfs, dtype=np.uint16)[keep].tobytes()),
+                )
+        self.postings = postings
+
+        docs_name = f"docs-{uuid.uuid4().hex}.jsonl"
+        doc_offsets = array("Q")
+        with open(self.directory / docs_name, "wb") as f:
+            for doc_id in alive_ids:
+                doc_offsets.append(f.tell())
+                f.write(self._read_line(int(doc_id)))
+        self.close()
+        self._docs_name = docs_name
+        self.doc_offsets = doc_offsets
+        self.doc_len = array("I", np.frombuffer(self.doc_len, dtype=np.uint32)[alive_ids].tobytes())
+        self.columns = {
+            field: array("q", np.frombuffer(column, dtype=np.int64)[alive_ids].tobytes())
+            for field, column in self.columns.items()
+        }
+        self.alive = bytearray([1]) * len(self.doc_len)
+
+
+def load_sparse_index() -> BM25Index:
+    return BM25Index.load(config.SPARSE_INDEX_DIR, k1=config.BM25_K1, b=config.BM25_B)
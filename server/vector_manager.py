@@ -1,88 +1,416 @@
+import argparse
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
 
 import config
-from document_processor import UnifiedDocumentLoader
+import grpc
+from document_processor import PARSE_WORKER_CONFIG, UnifiedDocumentLoader, init_parse_worker, load_and_split_file
+from executor import config_snapshot, process_pool_context
+from sparse_index import load_sparse_index
+from ingest_manifest import IngestManifest, file_fingerprint
 from langchain_core.documents import Document
 from loguru import logger
-from vector_store import VLLMEmbedding, create_vector_store, load_existing_vector_store
+from pymilvus.exceptions import MilvusUnavailableException
+from vector_store import (
+    bump_kb_version,
+    create_embedding_model,
+    iter_batches,
+    load_existing_vector_store,
+)
 
-# 离线初始化本地知识库
-def build_offline_knowledge_base():
-    input_dir = config.RAW_DATA_PATH
 
-    logger.info(f"Processing documents from: {input_dir}")
-    all_documents: List[Document] = []
-    document_loader = UnifiedDocumentLoader()
+# 入库清单、断点和向量库中的file_name都是文件名而不是路径：不同子目录下的同名文件会互相覆盖记录，
+# 其中一个文件的Chunk变成孤儿，更新时还会按清单误删另一个文件的Chunk，因此发现同名文件时直接报错
+def list_source_files(input_dir) -> List[Path]:
+    files = sorted(
+        file_path
+        for file_path in Path(input_dir).rglob("*")
+        if file_path.is_file() and file_path.suffix.lower() in config.SUPPORTED_FORMATS
+    )
+    paths_by_name: Dict[str, List[Path]] = {}
+    for file_path in files:
+        paths_by_name.setdefault(file_path.name, []).append(file_path)
+    duplicates = {name: paths for name, paths in paths_by_name.items() if len(paths) > 1}
+    if duplicates:
+        details = "; ".join(f"{name}: {', '.join(str(p) for p in paths)}" for name, paths in duplicates.items())
+        raise ValueError(f"{input_dir} 中存在同名文件，请重命名后再入库: {details}")
+    return files
+
+
+# 构建进度：定期输出已解析文件数、已入库Chunk数和吞吐
+class IngestProgress:
+    def __init__(self, total_files: int, interval: float = config.INGEST_PROGRESS_INTERVAL):
+        self.total_files = total_files
+        self.interval = interval
+        self.files_done = 0
+        self.files_failed = 0
+        self.chunks_parsed = 0
+        self.chunks_embedded = 0
+        self.start = time.perf_counter()
+        self._last_report = self.start
+
+    def file_done(self, num_chunks: int):
+        self.files_done += 1
+        self.chunks_parsed += num_chunks
+        self._maybe_report()
+
+    def file_failed(self):
+        self.files_failed += 1
+        self._maybe_report()
+
+    def batch_embedded(self, num_chunks: int):
+        self.chunks_embedded += num_chunks
+        self._maybe_report()
 
-    for file_path in Path(input_dir).rglob("*"):
-        if file_path.is_file() and file_path.suffix.lower() in config.SUPPORTED_FORMATS:
+    def _maybe_report(self):
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        finished = self.files_done + self.files_failed
+        logger.info(
+            f"[{finished}/{self.total_files} files] parsed {self.chunks_parsed} chunks, "
+            f"embedded {self.chunks_embedded} chunks, failed {self.files_failed} files, "
+            f"{finished / elapsed:.1f} files/s, {self.chunks_embedded / elapsed:.1f} chunks/s"
+        )
+
+
+# 解析阶段：workers>1时在进程池中并行解析，最多INGEST_MAX_PENDING_FILES个文件在途；否则串行解析
+def parse_files(
+    files: List[Path], progress: IngestProgress, workers: int
+) -> Iterator[Tuple[Path, dict, List[Document]]]:
+    if workers <= 1:
+        init_parse_worker()
+        for file_path in files:
             try:
-                # 1. 将所有文件变成Chunk级Document对象，放入all_documents中
-                documents = document_loader.load_and_split_documents(str(file_path))
-                all_documents.extend(documents)
+                fingerprint, documents = load_and_split_file(str(file_path))
             except Exception as e:
                 logger.error(f"Failed to process file {file_path}: {e}")
+                progress.file_failed()
+                continue
+            progress.file_done(len(documents))
+            yield file_path, fingerprint, documents
+        return
 
-    if not all_documents:
-        logger.warning("No documents found or all failed to process.")
+    max_pending = max(workers, config.INGEST_MAX_PENDING_FILES)
+    pending_files = iter(files)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=process_pool_context(),
+        initializer=init_parse_worker,
+        initargs=(1, config_snapshot(PARSE_WORKER_CONFIG)),
+    ) as pool:
+        in_flight = {}
+
+        def submit_next():
+            file_path = next(pending_files, None)
+            if file_path is not None:
+                in_flight[pool.submit(load_and_split_file, str(file_path))] = file_path
+
+        for _ in range(max_pending):
+            submit_next()
+
+        # 主线程消费已完成的文件时，进程池继续解析其余在途文件
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path = in_flight.pop(future)
+                submit_next()
+                try:
+                    fingerprint, documents = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to process file {file_path}: {e}")
+                    progress.file_failed()
+                    continue
+                progress.file_done(len(documents))
+                yield file_path, fingerprint, documents
+
+
+class IngestError(RuntimeError):
+    pass
+
+
+# 构建断点：追加写入的JSONL，记录已全部入库(completed)和部分入库(partial)的文件
+class IngestCheckpoint:
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def load(self) -> Tuple[Set[str], Set[str]]:
+        completed, partial = set(), set()
+        if not self.path.exists():
+            return completed, partial
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 中断时可能写了半行
+                (completed if record["state"] == "completed" else partial).add(record["file_name"])
+        return completed, partial - completed
+
+    def reset(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text("", encoding="utf-8")
+
+    def record(self, state: str, file_names: Iterable[str]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for file_name in file_names:
+                f.write(json.dumps({"state": state, "file_name": file_name}, ensure_ascii=False) + "\n")
+
+
+# 写入失败时能确定服务端没有提交的错误：连接不上或服务不可用。响应超时等其他错误可能已经提交，
+# 主键由向量库在写入时生成（Milvus使用auto_id，mmap为行号），重试不是幂等的，会以新的主键再写一遍
+def is_retryable_insert_error(e: Exception) -> bool:
+    if isinstance(e, (ConnectionError, MilvusUnavailableException)):
+        return True
+    return isinstance(e, grpc.RpcError) and e.code() == grpc.StatusCode.UNAVAILABLE
+
+
+def _with_retries(func, description: str, retryable=lambda e: True):
+    for attempt in range(config.INGEST_BATCH_RETRIES + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == config.INGEST_BATCH_RETRIES or not retryable(e):
+                raise IngestError(f"Failed to {description}: {e}") from e
+            delay = config.INGEST_RETRY_BACKOFF * 2 ** attempt
+            logger.warning(f"Failed to {description} ({e}), retry {attempt + 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+# 带重试的批量写入：Embedding没有副作用，失败时指数退避重试；写入向量库只在确定未提交时重试
+def insert_batch(vector_store, batch: List[Document]) -> List:
+    texts = [document.page_content for document in batch]
+    embeddings = _with_retries(
+        lambda: vector_store.embeddings.embed_documents(texts), f"embed batch of {len(batch)} chunks"
+    )
+    return _with_retries(
+        lambda: vector_store.add_embeddings(texts, embeddings, [document.metadata for document in batch]),
+        f"insert batch of {len(batch)} chunks",
+        is_retryable_insert_error,
+    )
+
+
+# 流式分批：逐文件消费解析结果，凑满batch_size就产出一个batch，内存中最多保留一个batch
+# 解析出0个Chunk的文件不进入任何batch，其指纹记入empty_files由调用方直接标记完成
+def stream_batches(
+    parsed: Iterator[Tuple[Path, dict, List[Document]]],
+    batch_size: int,
+    pending_chunks: Dict[str, int],
+    fingerprints: Dict[str, dict],
+    empty_files: Dict[str, dict],
+) -> Iterator[List[Document]]:
+    batch: List[Document] = []
+    for file_path, fingerprint, documents in parsed:
+        if not documents:
+            empty_files[file_path.name] = fingerprint
+            continue
+        pending_chunks[file_path.name] = len(documents)
+        fingerprints[file_path.name] = fingerprint
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+# 离线初始化本地知识库：解析与Embedding流水线并行，分批Embedding并写入Milvus，峰值内存与语料规模无关
+# resume=True时不清空collection，跳过断点中已完成的文件，并删除部分入库文件的残留Chunk
+def build_offline_knowledge_base(
+    input_dir=None, embedding_model=None, workers: int = None, resume: bool = False
+):
+    input_dir = input_dir or config.RAW_DATA_PATH
+    workers = config.INGEST_WORKERS if workers is None else workers
+    checkpoint = IngestCheckpoint(config.INGEST_CHECKPOINT_PATH)
+    manifest = IngestManifest(config.INGEST_MANIFEST_PATH)
+    sparse_index = load_sparse_index()
+
+    # 1. 确定待处理文件
+    files = list_source_files(input_dir)
+    completed, partial = checkpoint.load() if resume else (set(), set())
+    if not resume:
+        checkpoint.reset()
+        manifest.clear()
+        sparse_index.clear()
+    else:
+        # 断点每个batch追加一次，清单和BM25索引只在结束时保存：进程被强制终止时，断点中已完成的文件可能缺少
+        # 清单或BM25记录，这些文件按部分入库处理，删除Milvus中的残留Chunk后重新入库
+        indexed = sparse_index.file_names()
+        lost = set()
+        for file_name in completed:
+            entry = manifest.get(file_name)
+            if entry is None or (entry["pks"] and file_name not in indexed):
+                lost.add(file_name)
+        if lost:
+            logger.warning(f"{len(lost)} completed files are missing from the manifest or sparse index, re-ingesting")
+            completed -= lost
+            partial |= lost
+    files = [file_path for file_path in files if file_path.name not in completed]
+    logger.info(
+        f"Processing {len(files)} documents from: {input_dir} ({workers} parse workers, "
+        f"{len(completed)} already completed)"
+    )
+    if not files:
+        logger.warning("No documents to process.")
         return
 
-    logger.info(f"Successfully processed {len(all_documents)} document chunks.")
+    # 2. 打开collection：全量构建时清空，断点续传时删除部分入库文件的Chunk，以及清单中指向这些Chunk的记录
+    embedding_model = embedding_model or create_embedding_model()
+    vector_store = load_existing_vector_store(embedding_model, drop_old=not resume)
+    if partial:
+        vector_store.delete_files(partial)
+        for file_name in partial:
+            sparse_index.remove_file(file_name)
+            manifest.remove(file_name)
+        logger.info(f"Removed chunks of {len(partial)} partially ingested files")
+
+    # 3. 流式解析 -> 分批Embedding -> 写入Milvus，每个batch写入后更新断点和入库清单
+    progress = IngestProgress(len(files))
+    pending_chunks: Dict[str, int] = {}
+    fingerprints: Dict[str, dict] = {}
+    file_pks: Dict[str, list] = {}
+    empty_files: Dict[str, dict] = {}
+    inserted = 0
+    parsed = parse_files(files, progress, workers)
+
+    # 0个Chunk的文件解析完成即视为入库完成，写入断点并以pks=[]记入清单，否则断点续传和增量更新都会重新解析
+    def finish_empty_files():
+        for file_name, fingerprint in empty_files.items():
+            manifest.set(file_name, fingerprint, [])
+        checkpoint.record("completed", empty_files)
+        empty_files.clear()
+
+    try:
+        batches = stream_batches(parsed, config.INGEST_EMBED_BATCH_SIZE, pending_chunks, fingerprints, empty_files)
+        for batch in batches:
+            finish_empty_files()
+            pks = insert_batch(vector_store, batch)
+            sparse_index.add_documents(batch)
+            inserted += len(batch)
+            progress.batch_embedded(len(batch))
+
+            touched = set()
+            for document, pk in zip(batch, pks):
+                file_name = document.metadata["file_name"]
+                pending_chunks[file_name] -= 1
+                file_pks.setdefault(file_name, []).append(pk)
+                touched.add(file_name)
+            finished = [name for name in touched if pending_chunks[name] == 0]
+            for file_name in finished:
+                manifest.set(file_name, fingerprints.pop(file_name), file_pks.pop(file_name))
+            checkpoint.record("partial", touched.difference(finished))
+            checkpoint.record("completed", finished)
+        finish_empty_files()
+    except IngestError as e:
+        logger.error(f"{e}. Re-run with resume=True to continue from the checkpoint.")
+        raise
+    finally:
+        parsed.close()
+        manifest.save()
+        sparse_index.save()
+
+    progress.report()
+    if not inserted:
+        logger.warning("No documents found or all failed to process.")
+        return
 
-    # 对all_documents进行Embedding，并存入Milvus中
-    embedding_model = VLLMEmbedding(model_name=config.EMBEDDING_MODEL_PATH)
-    create_vector_store(all_documents, embedding_model)
+    vector_store.create_scalar_indexes()
+    bump_kb_version()
+    logger.info(f"Knowledge base creation complete ({inserted} chunks).")
 
-    logger.info("Knowledge base creation complete.")
 
-# 本地知识库动态新增
-def update_offline_knowledge_base():
-    update_dir = Path(config.UNUPDATED_DATA_PATH)
+# 本地知识库动态新增：根据入库清单跳过未变化的文件，修改过的文件删除旧Chunk后重新入库
+def update_offline_knowledge_base(update_dir=None, embedding_model=None):
+    update_dir = Path(update_dir or config.UNUPDATED_DATA_PATH)
 
     # 1.获取所有待更新文件
-    files = [f for f in update_dir.rglob("*") 
-             if f.is_file() and f.suffix.lower() in config.SUPPORTED_FORMATS]
-    
+    files = list_source_files(update_dir)
     if not files:
         logger.info("No files to update.")
         return
-    
-    logger.info(f"Found {len(files)} files to update")
 
-    # 2. 加载向量库和文档处理器
-    embedding_model = VLLMEmbedding(model_name=config.EMBEDDING_MODEL_PATH)
+    # 2. 对比入库清单：size和mtime未变直接跳过，否则计算hash判断内容是否变化，全程不调用模型和向量库
+    manifest = IngestManifest(config.INGEST_MANIFEST_PATH)
+    changed: List[Tuple[Path, dict]] = []
+    for file_path in files:
+        if manifest.is_unchanged_by_stat(file_path.name, file_path.stat()):
+            continue
+        fingerprint = file_fingerprint(file_path)
+        entry = manifest.get(file_path.name)
+        if entry and entry["sha256"] == fingerprint["sha256"]:
+            manifest.set(file_path.name, fingerprint, entry["pks"])  # 内容未变，只更新mtime
+            continue
+        changed.append((file_path, fingerprint))
+
+    logger.info(f"Found {len(files)} files, {len(changed)} new or modified")
+    if not changed:
+        manifest.save()
+        return
+
+    # 3. 加载向量库和文档处理器；清单中没有的文件一次性批量查询是否已入库（清单建立前入库的数据）
+    embedding_model = embedding_model or create_embedding_model()
     vector_store = load_existing_vector_store(embedding_model)
     document_loader = UnifiedDocumentLoader()
+    sparse_index = load_sparse_index()
+    legacy_pks = vector_store.query_file_pks(
+        [file_path.name for file_path, _ in changed if manifest.get(file_path.name) is None]
+    )
 
-    # 3. 处理文件
-    for file_path in files:
+    # 4. 处理文件
+    updated = 0
+    for file_path, fingerprint in changed:
         file_name = file_path.name
         try:
-            # 检查是否已存在（根据文件名搜索）
-            existing = vector_store.similarity_search(
-                query="", k=1, expr=f'file_name == "{file_name}"'
-            )
-            
-            if existing:
-                logger.warning(f"File {file_name} already exists, skipping")
-                continue
-            
             # 加载、分割、添加文档
             documents = document_loader.load_and_split_documents(str(file_path))
-            vector_store.add_documents(documents)
-            
+            pks = []
+            for batch in iter_batches(documents, config.INGEST_EMBED_BATCH_SIZE):
+                pks.extend(insert_batch(vector_store, batch))
+
+            # 新Chunk写入成功后再删除旧Chunk，写入失败时旧数据仍然可用
+            entry = manifest.get(file_name)
+            old_pks = entry["pks"] if entry else legacy_pks.get(file_name, [])
+            for old_batch in iter_batches(old_pks, 1000):
+                vector_store.delete(ids=old_batch)
+            sparse_index.remove_file(file_name)
+            sparse_index.add_documents(documents)
+
+            manifest.set(file_name, fingerprint, pks)
+            updated += 1
+            action = "re-indexed" if old_pks else "added"
+
             # 删除源文件
-            file_path.unlink()
-            logger.info(f"✅ Successfully added and removed {file_name} ({len(documents)} chunks)")
-            
+            if config.UPDATE_DELETE_SOURCE_FILES:
+                file_path.unlink()
+            logger.info(f"✅ Successfully {action} {file_name} ({len(documents)} chunks)")
+
         except Exception as e:
             logger.error(f"Failed to process {file_name}: {e}")
-    
+
+    manifest.save()
+    sparse_index.save()
+    if updated:
+        vector_store.create_scalar_indexes()  # 新建的collection或新增的元数据字段
+        bump_kb_version()
     logger.info("Knowledge base update complete.")
 
 
 if __name__ == "__main__":
-    build_offline_knowledge_base()
-    # update_offline_knowledge_base()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--update", action="store_true", help="增量更新UNUPDATED_DATA_PATH中的文件")
+    parser.add_argument("--resume", action="store_true", help="从断点继续上一次中断的全量构建")
+    args = parser.parse_args()
+
+    if args.update:
+        update_offline_knowledge_base()
+    else:
+        build_offline_knowledge_base(resume=args.resume)
 
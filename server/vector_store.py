@@ -1,27 +1,141 @@
-from typing import List
+import os
+import sys
+import threading
+import time
+from abc import abstractmethod
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List
 
+import numpy as np
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
 from langchain_milvus import Milvus
 from loguru import logger
-from vllm import LLM
 
 import config
+from cache import LRUTTLCache
+from embedding_batcher import EmbeddingBatcher
+from embedding_store import PersistentEmbeddingCache
+from metadata_filter import MetadataFilter, quote_expr_value
+from metrics import stage
+from mmap_store import HNSWIndex, MmapVectorStore
+
+
+def _cache_entry_size(obj) -> int:
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    return len(obj.encode("utf-8")) if isinstance(obj, str) else sys.getsizeof(obj)
 
 
 # 继承LangChain的Embeddings，接口规范要求必须重写embed_documents和embed_query
-class VLLMEmbedding(Embeddings):
+# 微批队列、query缓存和Chunk向量缓存与后端无关，子类只需实现_embed
+class CachedEmbedding(Embeddings):
     def __init__(self, model_name: str, **kwargs):
         super().__init__(**kwargs)
-        self.model = LLM(model=model_name, task="embed")  # model参数指模型地址
+        self.model_name = model_name
+        # 并发的单条query请求先进入微批队列，攒成batch后一次调用_embed
+        self.query_batcher = None
+        if config.EMBED_BATCH_ENABLED:
+            self.query_batcher = EmbeddingBatcher(
+                self._embed,
+                max_batch_size=config.EMBED_BATCH_MAX_SIZE,
+                max_wait_ms=config.EMBED_BATCH_WAIT_MS,
+            )
+        # query向量缓存：key为get_detailed_instruct生成的文本（即task_description + query），value为float32数组
+        self.query_cache = None
+        if config.QUERY_EMBED_CACHE_ENABLED:
+            self.query_cache = LRUTTLCache(
+                max_entries=config.QUERY_EMBED_CACHE_MAX_ENTRIES,
+                ttl=config.QUERY_EMBED_CACHE_TTL,
+                max_bytes=config.QUERY_EMBED_CACHE_MAX_BYTES,
+                sizeof=_cache_entry_size,
+            )
+        # Chunk向量持久化缓存，首次调用embed_documents时打开
+        self._document_cache = None
+
+    @property
+    def document_cache(self) -> PersistentEmbeddingCache:
+        if self._document_cache is None and config.DOC_EMBED_CACHE_ENABLED:
+            self._document_cache = PersistentEmbeddingCache(config.DOC_EMBED_CACHE_DIR, self.model_name)
+        return self._document_cache
 
+    # 子类未实现_embed时实例化即报错，而不是在第一次检索时才报错
+    @abstractmethod
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        raise NotImplementedError
+
+    # 只把缓存未命中的文本送入模型，重建知识库时未变化的Chunk无需重新Embedding
     def embed_documents(self, texts: list[str]) -> list[list[float]]:
-        outputs = self.model.embed(texts)
-        return [output.outputs.embedding for output in outputs]
+        cache = self.document_cache
+        if cache is None:
+            return self._embed(texts)
+
+        keys = [cache.key(text) for text in texts]
+        vectors = cache.get_many(keys)
+        misses = {}  # key -> text，同一batch内的重复文本只计算一次
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                misses.setdefault(key, text)
+
+        if misses:
+            embeddings = self._embed(list(misses.values()))
+            cache.put_many(list(misses.keys()), embeddings)
+            computed = dict(zip(misses.keys(), embeddings))
+            return [
+                computed[key] if vector is None else vector.tolist()
+                for key, vector in zip(keys, vectors)
+            ]
+        return [vector.tolist() for vector in vectors]
 
     def embed_query(self, text: str) -> list[float]:
-        outputs = self.model.embed([text])
-        return outputs[0].outputs.embedding
+        with stage("embed_query"):
+            return self._embed_query(text)
+
+    def _embed_query(self, text: str) -> list[float]:
+        if self.query_cache is not None:
+            cached = self.query_cache.get(text)
+            if cached is not None:
+                return cached.tolist()
+
+        if self.query_batcher is not None:
+            embedding = self.query_batcher.embed(text)
+        else:
+            embedding = self._embed([text])[0]
+
+        if self.query_cache is not None:
+            self.query_cache.set(text, np.asarray(embedding, dtype=np.float32))
+        return embedding
+
+    # 批量query：缓存未命中的query合并为一次model.embed调用，用于/rag/batch
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        with stage("embed_batch"):
+            return self._embed_queries(texts)
+
+    def _embed_queries(self, texts: list[str]) -> list[list[float]]:
+        embeddings = [None] * len(texts)
+        misses = {}  # text -> 位置列表，重复的query只计算一次
+        for i, text in enumerate(texts):
+            cached = self.query_cache.get(text) if self.query_cache is not None else None
+            if cached is not None:
+                embeddings[i] = cached.tolist()
+            else:
+                misses.setdefault(text, []).append(i)
+
+        if misses:
+            for text, embedding in zip(misses, self._embed(list(misses))):
+                if self.query_cache is not None:
+                    self.query_cache.set(text, np.asarray(embedding, dtype=np.float32))
+                for i in misses[text]:
+                    embeddings[i] = embedding
+        return embeddings
+
+    def stats(self) -> dict:
+        return {
+            "query_batcher": self.query_batcher.stats() if self.query_batcher else None,
+            "query_cache": self.query_cache.stats() if self.query_cache else None,
+            "document_cache": self._document_cache.stats() if self._document_cache else None,
+        }
 
     def get_detailed_instruct(self, task_description: str, query: str) -> str:
         return (
@@ -29,28 +143,271 @@ class VLLMEmbedding(Embeddings):
         )
 
 
-# 初始化存储，kn_builder会调用
-def create_vector_store(
-    documents: List[Document], embedding_model: VLLMEmbedding
-) -> Milvus:
-    vector_store = Milvus.from_documents(  # 创建vector_store需要指定document参数
-        documents=documents,
-        embedding=embedding_model,
-        connection_args={"uri": config.MILVUS_URI},
-        collection_name=config.MILVUS_COLLECTION_NAME,
-        drop_old=True,
-    )
+# 进程内vLLM引擎：每个加载它的进程都持有一份模型，API只能单worker运行
+class VLLMEmbedding(CachedEmbedding):
+    def __init__(self, model_name: str, **kwargs):
+        if config.EMBEDDING_CUDA_DEVICES:
+            os.environ.setdefault("CUDA_VISIBLE_DEVICES", config.EMBEDDING_CUDA_DEVICES)
+        from vllm import LLM  # 延迟导入，离线工具和基准测试无需加载vLLM
+
+        self.model = LLM(model=model_name, task="embed")  # model参数指模型地址
+        # vLLM的LLM引擎不是线程安全的，线程池中的并发请求需串行访问模型
+        self._model_lock = threading.Lock()
+        super().__init__(model_name, **kwargs)
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        with self._model_lock:
+            outputs = self.model.embed(texts)
+        return [output.outputs.embedding for output in outputs]
+
+
+# 独立部署的OpenAI兼容Embedding服务（如vllm serve --task embed），通过长连接池调用/v1/embeddings
+# API进程不加载模型，可以多worker运行
+class RemoteEmbedding(CachedEmbedding):
+    def __init__(
+        self,
+        model_name: str,
+        base_url: str = None,
+        api_key: str = None,
+        batch_size: int = None,
+        timeout: float = None,
+        retries: int = None,
+        **kwargs,
+    ):
+        import httpx
+
+        self.base_url = (base_url or config.EMBEDDING_API_BASE).rstrip("/")
+        self.batch_size = batch_size or config.EMBEDDING_REMOTE_BATCH_SIZE
+        self.retries = config.EMBEDDING_REMOTE_RETRIES if retries is None else retries
+        self._httpx = httpx
+        self.client = httpx.Client(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {api_key or config.EMBEDDING_API_KEY}"},
+            timeout=timeout or config.EMBEDDING_REMOTE_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=config.EMBEDDING_REMOTE_MAX_CONNECTIONS,
+                max_keepalive_connections=config.EMBEDDING_REMOTE_MAX_CONNECTIONS,
+            ),
+        )
+        super().__init__(model_name, **kwargs)
+
+    def _request(self, texts: list[str]) -> list[list[float]]:
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.client.post("/embeddings", json={"model": self.model_name, "input": texts})
+                response.raise_for_status()
+                data = sorted(response.json()["data"], key=lambda item: item["index"])
+                return [item["embedding"] for item in data]
+            except (self._httpx.TransportError, self._httpx.HTTPStatusError) as e:
+                # 连接错误、429和5xx可重试，其他4xx属于请求错误直接抛出
+                retryable = not isinstance(e, self._httpx.HTTPStatusError) or (
+                    e.response.status_code == 429 or e.response.status_code >= 500
+                )
+                if not retryable or attempt == self.retries:
+                    raise
+                delay = config.EMBEDDING_REMOTE_BACKOFF * 2 ** attempt
+                logger.warning(f"Embedding请求失败({e})，{delay:.1f}s后第{attempt + 1}次重试")
+                time.sleep(delay)
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        embeddings = []
+        for batch in iter_batches(texts, self.batch_size):
+            embeddings.extend(self._request(batch))
+        return embeddings
 
-    logger.info("Milvus vector store is built successfully")
-    return vector_store
 
+# 按EMBEDDING_BACKEND创建Embedding模型：vllm（进程内）或remote（OpenAI兼容服务）
+def create_embedding_model(model_name: str = None) -> CachedEmbedding:
+    model_name = model_name or config.EMBEDDING_MODEL_PATH
+    if config.EMBEDDING_BACKEND == "vllm":
+        return VLLMEmbedding(model_name=model_name)
+    if config.EMBEDDING_BACKEND == "remote":
+        return RemoteEmbedding(model_name=model_name)
+    raise ValueError(f"未知的Embedding后端: {config.EMBEDDING_BACKEND}")
 
-# 加载Milvus，用于增量存储，
-def load_existing_vector_store(embedding_model: VLLMEmbedding = None) -> Milvus:
-    vector_store = Milvus(  # 使用vector_store无需指定document参数
+
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def file_name_expr(file_names: Iterable[str]) -> str:
+    return f"file_name in [{', '.join(quote_expr_value(name) for name in file_names)}]"
+
+
+def milvus_index_params(index_type: str = None, metric_type: str = None, params: dict = None) -> dict:
+    index_type = index_type or config.MILVUS_INDEX_TYPE
+    return {
+        "index_type": index_type,
+        "metric_type": metric_type or config.MILVUS_METRIC_TYPE,
+        "params": dict(config.MILVUS_INDEX_PARAMS.get(index_type, {}) if params is None else params),
+    }
+
+
+def milvus_search_params(index_type: str, metric_type: str, params: dict = None) -> dict:
+    return {
+        "metric_type": metric_type,
+        "params": dict(config.MILVUS_SEARCH_PARAMS.get(index_type, {}) if params is None else params),
+    }
+
+
+# 所有稠密检索最终都经过_collection_search，在这里统计Milvus检索耗时（不含query Embedding）
+class InstrumentedMilvus(Milvus):
+    def __init__(self, *args, vector_float16: bool = False, **kwargs):
+        self.vector_float16 = vector_float16
+        super().__init__(*args, **kwargs)
+
+    # 检索参数按collection实际的索引类型和度量生成：已有collection的索引与当前配置不同时仍能正确检索
+    def _create_search_params(self) -> None:
+        if self.search_params is not None or not self.client.has_collection(self.collection_name):
+            return
+        index = self._get_index()
+        if index is not None:
+            index_param = index["index_param"]
+            self.search_params = milvus_search_params(index_param["index_type"], index_param["metric_type"])
+
+    # float16向量：写入和检索前转换为np.float16，collection的向量字段随之推断为FLOAT16_VECTOR
+    def as_vector(self, vector):
+        return np.asarray(vector, dtype=np.float16) if self.vector_float16 else vector
+
+    def add_embeddings(self, texts, embeddings, *args, **kwargs):
+        return super().add_embeddings(texts, [self.as_vector(e) for e in embeddings], *args, **kwargs)
+
+    # collection中没有过滤字段（如旧知识库没有page）时，没有Chunk满足条件
+    def can_filter(self, metadata_filter: MetadataFilter) -> bool:
+        return metadata_filter.fields <= set(self.fields)
+
+    # metadata_filter由检索器透传（retriever.invoke(query, metadata_filter=...)），编译为Milvus表达式在向量检索中过滤
+    def _filter_kwargs(self, metadata_filter: MetadataFilter, kwargs: dict) -> dict:
+        if metadata_filter is not None:
+            expr = metadata_filter.to_expr()
+            kwargs["expr"] = f"({kwargs['expr']}) and ({expr})" if kwargs.get("expr") else expr
+        return kwargs
+
+    def _collection_search(self, embedding_or_text, *args, metadata_filter: MetadataFilter = None, **kwargs):
+        if metadata_filter is not None and not self.can_filter(metadata_filter):
+            return [[]]
+        with stage("milvus_search"):
+            return super()._collection_search(
+                self.as_vector(embedding_or_text), *args, **self._filter_kwargs(metadata_filter, kwargs)
+            )
+
+    async def _acollection_search(self, embedding_or_text, *args, metadata_filter: MetadataFilter = None, **kwargs):
+        if metadata_filter is not None and not self.can_filter(metadata_filter):
+            return [[]]
+        with stage("milvus_search"):
+            return await super()._acollection_search(
+                self.as_vector(embedding_or_text), *args, **self._filter_kwargs(metadata_filter, kwargs)
+            )
+
+    # 为可过滤的元数据字段创建标量索引，已存在的索引和collection中没有的字段跳过
+    def create_scalar_indexes(self):
+        if self.col is None:
+            return
+        for field in config.FILTERABLE_METADATA_FIELDS:
+            if field not in self.fields or self.client.list_indexes(self.collection_name, field_name=field):
+                continue
+            index_params = self.client.prepare_index_params()
+            index_params.add_index(field, index_type=config.MILVUS_SCALAR_INDEX_TYPE)
+            # sync=False：不逐个轮询等待（pymilvus每个索引至少等待0.5s），索引在后台构建，构建完成前过滤检索照常可用
+            self.client.create_index(self.collection_name, index_params, sync=False)
+            logger.info(f"Creating {config.MILVUS_SCALAR_INDEX_TYPE} index on {field}")
+
+    # 批量查询每个文件在向量库中的Chunk主键，代替逐文件的similarity_search
+    def query_file_pks(self, file_names: Iterable[str]) -> Dict[str, list]:
+        pks: Dict[str, list] = {}
+        if self.col is None:
+            return pks
+
+        for names in iter_batches(file_names, 1000):
+            rows = self.client.query(
+                self.collection_name,
+                filter=file_name_expr(names),
+                output_fields=[self._primary_field, "file_name"],
+            )
+            for row in rows:
+                pks.setdefault(row["file_name"], []).append(row[self._primary_field])
+        return pks
+
+    def delete_files(self, file_names: Iterable[str]):
+        for names in iter_batches(file_names, 1000):
+            self.delete(expr=file_name_expr(names))
+
+    # 一次Milvus请求检索多个query向量，返回与vectors一一对应的Document列表（/rag/batch使用），所有query共用同一个过滤条件
+    def search_by_vectors(
+        self, vectors: List[List[float]], k: int, metadata_filter: MetadataFilter = None
+    ) -> List[List[Document]]:
+        if self.col is None or not vectors:
+            return [[] for _ in vectors]
+        if metadata_filter is not None and not self.can_filter(metadata_filter):
+            return [[] for _ in vectors]
+
+        with stage("milvus_search"):
+            results = self.client.search(
+                self.collection_name,
+                data=[self.as_vector(list(vector)) for vector in vectors],
+                anns_field=self._vector_field,
+                search_params=self._as_list(self.search_params)[0],
+                limit=k,
+                filter=metadata_filter.to_expr() if metadata_filter is not None else "",
+                output_fields=self._get_output_fields(),
+                timeout=self.timeout,
+            )
+        return [[self._parse_document(hit["entity"]) for hit in hits] for hits in results]
+
+
+# 加载向量库（VECTOR_STORE_BACKEND），用于增量存储
+def load_existing_vector_store(
+    embedding_model: CachedEmbedding = None, drop_old: bool = False
+) -> VectorStore:
+    if config.VECTOR_STORE_BACKEND == "mmap":
+        ann_index = None
+        if config.MMAP_ANN_ENABLED:
+            ann_index = HNSWIndex(config.MMAP_HNSW_M, config.MMAP_HNSW_EF_CONSTRUCTION, config.MMAP_HNSW_EF)
+        vector_store = MmapVectorStore(
+            embedding_model,
+            config.MMAP_STORE_DIR,
+            metric=config.MMAP_METRIC_TYPE,
+            drop_old=drop_old,
+            block_rows=config.MMAP_SEARCH_BLOCK_ROWS,
+            ann_index=ann_index,
+        )
+        logger.info(f"loading mmap vector store successfully ({len(vector_store)} chunks)")
+        return vector_store
+    if config.VECTOR_STORE_BACKEND != "milvus":
+        raise ValueError(f"未知的向量库后端: {config.VECTOR_STORE_BACKEND}")
+
+    vector_store = InstrumentedMilvus(  # 使用vector_store无需指定document参数，collection在第一次写入时创建
         embedding_function=embedding_model,
         connection_args={"uri": config.MILVUS_URI},
         collection_name=config.MILVUS_COLLECTION_NAME,
+        drop_old=drop_old,
+        auto_id=True,  # 主键由Milvus生成；写入时不传ids（add_embeddings在auto_id=False时要求ids）
+        index_params=milvus_index_params(),
+        vector_float16=config.MILVUS_VECTOR_FLOAT16,
     )
     logger.info("connecting to Milvus vector store successfully")
     return vector_store
+
+
+# 知识库版本号：构建/更新知识库后写入新版本，语义缓存据此判断是否失效
+def bump_kb_version() -> str:
+    version = str(time.time_ns())
+    path = Path(config.KB_VERSION_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(version, encoding="utf-8")
+    logger.info(f"Knowledge base version -> {version}")
+    return version
+
+
+def read_kb_version() -> str:
+    try:
+        return Path(config.KB_VERSION_PATH).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return ""
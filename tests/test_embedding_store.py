@@ -0,0 +1,29 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "server"))
+
+from embedding_store import KEY_BYTES, PersistentEmbeddingCache  # noqa: E402
+
+
+def test_key_ending_in_nul_hits_after_reload(tmp_path):
+    cache = PersistentEmbeddingCache(tmp_path, "model")
+    keys = [b"\x01" * (KEY_BYTES - 1) + b"\x00", b"\x00" * KEY_BYTES, b"\x02" * KEY_BYTES]
+    cache.put_many(keys, [[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]])
+
+    reloaded = PersistentEmbeddingCache(tmp_path, "model")
+    vectors = reloaded.get_many(keys)
+    assert [list(vector) for vector in vectors] == [[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]]
+    assert reloaded.hits == 3
+
+
+def test_partial_key_write_is_truncated(tmp_path):
+    cache = PersistentEmbeddingCache(tmp_path, "model")
+    key = b"\x03" * KEY_BYTES
+    cache.put_many([key], [[1.0, 2.0]])
+    with open(tmp_path / "keys.bin", "ab") as f:
+        f.write(b"\x04" * (KEY_BYTES // 2))
+
+    reloaded = PersistentEmbeddingCache(tmp_path, "model")
+    assert len(reloaded) == 1
+    assert list(reloaded.get_many([key])[0]) == [1.0, 2.0]